@@ -0,0 +1,219 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import click
+
+import pyscom
+import simulator
+
+
+
+
+# Modules that pyscom only imports in the commands needing them, none of them must be imported at startup
+LAZY_MODULES = ("asyncio", "serial", "http.server", "sqlite3", "concurrent.futures", "socket", "json", "csv", "mmap", "platform")
+
+
+# Value written for each format in the encode and decode benchmarks
+FORMAT_VALUES = {
+    "bool": 1,
+    "short_enum": 3,
+    "long_enum": 8,
+    "int32": 480,
+    "float": 25.5,
+}
+
+
+# Measure the time of a function call, return the result of the benchmark
+def measure(name, function, group, **parameters):
+    """Measure the time of a function call, return the result of the benchmark\n
+    The function is called in loops of at least 0.2 second, the best of 5 loops is kept."""
+
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    best = min([elapsed] + timer.repeat(repeat=4, number=number)) / number
+    return {"group": group, "name": name, **parameters, "seconds_per_call": best, "calls_per_second": 1 / best}
+
+
+# Benchmark the frame codec, the checksum and the multi-info decoding
+def run_micro_benchmarks():
+    """Benchmark the frame codec, the checksum and the multi-info decoding"""
+
+    results = []
+
+    # Encode and decode of each format
+    for format, value in FORMAT_VALUES.items():
+        tx_frame = pyscom.encode_write_request(1, 101, 2, 1138, 5, value, format)
+        results.append(measure("encode_write_request", lambda: pyscom.encode_write_request(1, 101, 2, 1138, 5, value, format), "codec", format=format))
+        results.append(measure("decode_request_frame", lambda: pyscom.decode_request_frame(tx_frame, format, False), "codec", format=format))
+        results.append(measure("decode_response_frame", lambda: pyscom.decode_response_frame(tx_frame, format, True), "codec", format=format))
+    catalog_frame = pyscom.encode_write_request(1, 101, 2, 1138, 5, 25.5)
+    results.append(measure("decode_response_frame", lambda: pyscom.decode_response_frame(catalog_frame), "codec", format="catalog"))
+    multi_info_request = "(3000:Average),(3080:Sum),(7000:Master),(11000:Average),(11004:Sum),(15010:Sum)"
+    results.append(measure("encode_read_request", lambda: pyscom.encode_read_request(1, 501, 10, 1, 1, multi_info_request), "codec", format="byte_stream"))
+    byte_stream_frame = multi_info_frame(6)
+    results.append(measure("decode_response_frame", lambda: pyscom.decode_response_frame(byte_stream_frame, "byte_stream", True), "codec", format="byte_stream"))
+
+    # Checksum of a header and of larger data
+    for length in (11, 14, 100, 540):
+        data = os.urandom(length)
+        results.append(measure("calc_checksum", lambda: pyscom.calc_checksum(data), "checksum", bytes=length))
+    frames = [pyscom.encode_write_request(1, 101, 2, 1138, 5, index, "float") for index in range(10000)]
+    results.append(measure("verify_checksums", lambda: pyscom.verify_checksums(frames), "checksum", frames=len(frames)))
+
+    # Multi-info responses of N values
+    for items in (1, 10, pyscom.MULTI_INFO_MAX_ITEMS, 1000):
+        byte_stream = multi_info_frame(items)[pyscom.FRAME_LAYOUT.size:-pyscom.CHECKSUM.size]
+        results.append(measure("decode_byte_stream", lambda: pyscom.decode_byte_stream(byte_stream), "multi_info", items=items))
+
+    # Parsing of a raw capture
+    capture = b"".join(frames[:1000])
+    results.append(measure("FrameParser.feed", lambda: pyscom.FrameParser().feed(capture), "parser", frames=1000))
+
+    return results
+
+
+# Build a multi-info response of the given number of values
+def multi_info_frame(items):
+    """Build a multi-info response of the given number of values"""
+
+    data = pyscom.MULTI_INFO_CONTEXT.pack(0b0111, 0b10000000, 0, int(time.time()))
+    data += b"".join(pyscom.MULTI_INFO_RESPONSE_ITEM.pack(3000 + index % 1000, 253, 51.2) for index in range(items))
+    rx_frame = bytearray(pyscom.FRAME_OVERHEAD + len(data))
+    pyscom.encode_frame_into(rx_frame, pyscom.XCOM_ADDR, 1, pyscom.SERVICE_READ_PROPERTY, pyscom.MULTI_INFO_OBJECT_TYPE, pyscom.MULTI_INFO_OBJECT_ID, 1, data, pyscom.SERVICE_FLAG_RESPONSE)
+    return bytes(rx_frame)
+
+
+# Benchmark whole transactions with a simulated Xcom-232i
+def run_transaction_benchmarks(requests=200, turnaround=0.005):
+    """Benchmark whole transactions with a simulated Xcom-232i\n
+    Return the requests per second and the latency percentiles of each baudrate and mode"""
+
+    results = []
+    tx_frame = pyscom.encode_read_request(1, 101, 1, 3000, 1)
+    for baudrate in (38400, 115200):
+        xcom = simulator.XcomSimulator(baudrate=baudrate, turnaround=turnaround)
+        with xcom.serve_tcp() as server, pyscom.ScomSession(server.url, baudrate) as session:
+            session.send_frame(tx_frame)
+
+            # One request after the other
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(requests):
+                sent_at = time.perf_counter()
+                session.send_frame(tx_frame)
+                latencies.append(time.perf_counter() - sent_at)
+            elapsed = time.perf_counter() - start
+            results.append(transaction_result("send_frame", baudrate, requests, elapsed, latencies))
+
+            # Pipelined requests
+            depth = session.probe_pipeline_depth(tx_frame)
+            start = time.perf_counter()
+            session.send_pipelined([tx_frame] * requests, depth)
+            elapsed = time.perf_counter() - start
+            results.append(transaction_result("send_pipelined", baudrate, requests, elapsed, depth=depth))
+
+    return results
+
+
+# Build the result of a transaction benchmark
+def transaction_result(name, baudrate, requests, elapsed, latencies=None, **parameters):
+    """Build the result of a transaction benchmark"""
+
+    result = {"group": "transaction", "name": name, "bps": baudrate, **parameters, "requests": requests, "requests_per_second": requests / elapsed}
+    if latencies:
+        percentiles = statistics.quantiles(latencies, n=100)
+        result["p50_seconds"] = percentiles[49]
+        result["p99_seconds"] = percentiles[98]
+    return result
+
+
+# Benchmark the time to start the command line tool
+def run_startup_benchmarks(runs=10, commands=20):
+    """Benchmark the time to start the command line tool\n
+    The shell runs the given number of commands in one process. The last result lists
+    the modules of LAZY_MODULES that were imported at startup, there must be none."""
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(directory, "pyscom.py")
+    results = []
+    for name, arguments, stdin in (("python", ["-c", "pass"], None),
+                                   ("pyscom.py version", [script, "version"], None),
+                                   ("pyscom.py shell", [script, "--port=loop://", "shell"], "version\n" * commands)):
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + arguments, check=True, input=stdin, text=True, stdout=subprocess.DEVNULL)
+            durations.append(time.perf_counter() - start)
+        result = {"group": "startup", "name": name, "runs": runs, "median_seconds": statistics.median(durations), "min_seconds": min(durations)}
+        if stdin is not None:
+            result["commands"] = commands
+        results.append(result)
+
+    check = f"import sys, pyscom; print(' '.join(name for name in {LAZY_MODULES!r} if name in sys.modules))"
+    imported = subprocess.run([sys.executable, "-c", check], check=True, capture_output=True, text=True, cwd=directory).stdout.split()
+    results.append({"group": "startup", "name": "eager_imports", "modules": imported})
+    return results
+
+
+# Compare the startup results with the ones of a baseline, return the regressions found
+def find_startup_regressions(results, baseline_file, tolerance):
+    """Compare the startup results with the ones of a baseline, return the regressions found\n
+    A startup slower than the baseline's by more than tolerance (0.2: 20%) is a regression (python
+    itself is only a reference),
+    so is any module of LAZY_MODULES imported at startup."""
+
+    baseline = {}
+    if baseline_file is not None:
+        with open(baseline_file) as file:
+            for line in file:
+                result = json.loads(line)
+                if result.get("group") == "startup" and "median_seconds" in result:
+                    baseline[result["name"]] = result["median_seconds"]
+
+    regressions = []
+    for result in results:
+        if result.get("group") != "startup":
+            continue
+        if result.get("modules"):
+            regressions.append(f"imported at startup: {' '.join(result['modules'])}")
+        elif result["name"] != "python" and result["name"] in baseline and result["median_seconds"] > baseline[result["name"]] * (1 + tolerance):
+            regressions.append(f"{result['name']}: {result['median_seconds']:.3f}s instead of {baseline[result['name']]:.3f}s")
+    return regressions
+
+
+# Run the benchmarks and print one json result per line
+@click.command(help="Run the benchmarks and print one json result per line")
+@click.option('--only', type=click.Choice(["micro", "transaction", "startup"]), multiple=True, help="Only run these benchmarks (can be repeated)")
+@click.option('--requests', type=int, default=200, help="Requests sent by each transaction benchmark [default: 200]")
+@click.option('--output', type=click.File("a"), default=None, help="Append the results to this file instead of printing them")
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None, help="Fail if the startup is slower than in this file of previous results")
+@click.option('--tolerance', type=float, default=0.2, help="Slowdown of the startup accepted by --baseline [default: 0.2, 20%]")
+def main(only, requests, output, baseline, tolerance):
+    context = {"version": pyscom.VERSION, "python": platform.python_version(), "platform": platform.platform(), "time": time.time()}
+    benchmarks = {
+        "micro": run_micro_benchmarks,
+        "transaction": lambda: run_transaction_benchmarks(requests),
+        "startup": run_startup_benchmarks,
+    }
+    results = []
+    for name, benchmark in benchmarks.items():
+        if only and name not in only:
+            continue
+        for result in benchmark():
+            results.append(result)
+            print(json.dumps({**context, **result}), file=output or sys.stdout, flush=True)
+
+    # The startup is checked even without a baseline, for the modules imported too early
+    regressions = find_startup_regressions(results, baseline, tolerance)
+    if regressions:
+        raise click.ClickException("startup regression: " + ", ".join(regressions))
+
+
+# Execute the benchmarks when executing this script
+if __name__ == '__main__':
+    main()
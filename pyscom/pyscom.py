@@ -1,16 +1,30 @@
-import platform                     
+import os
+import abc
 import struct                       
+import itertools
+import collections
+import contextlib
 import click                        
-import serial                       
-from dataclasses import dataclass   
-from typing import Union            
+from dataclasses import dataclass, field
+from typing import Union, TYPE_CHECKING
 import math                         
-import re                           
-import datetime
+import time
+import array
+import heapq
+import threading
+import queue
+import bisect
+# asyncio, serial, datetime, re, socket, json, csv, sqlite3, mmap, concurrent.futures and http.server are
+# imported by the functions that use them, so that a command only pays for the modules it needs
+if TYPE_CHECKING:
+    import datetime     # Only for the annotations
 
 
 
 
+VERSION = "1.0.8"
+
+
 # Dataclass used to store frames
 @dataclass
 class Frame:
@@ -20,13 +34,403 @@ class Frame:
     object_type : int
     object_id : int
     property_id : int
-    property_data : Union[int, float, bool, str]
-    full_frame : str
+    property_data : Union[int, float, bool, str, bytes, None]
+    full_frame : bytes
+    service_flags : int = 0
+    service_id : int = 0
+
+
+# Dataclass used to store the response of the multi-info service
+@dataclass
+class MultiInfoResult:
+    timestamp : "datetime.datetime"
+    xcom_type : str                 # Xcom-LAN or Xcom-GSM
+    xcom_version : int
+    xtender_present : bool
+    bsp_present : bool
+    variotrack_present : bool
+    variostring_present : bool
+    info_refs : array.array         # The values are stored in columns, one item per user info
+    aggregations : array.array
+    values : array.array
+
+    def __len__(self):
+        return len(self.values)
+
+    # Iterate over every (info_ref, aggregation, value)
+    def __iter__(self):
+        """Iterate over every (info_ref, aggregation, value)"""
+
+        return zip(self.info_refs, self.aggregations, self.values)
+
+    # Return the values as a numpy structured array with the fields info_ref, aggregation and value
+    def to_numpy(self):
+        """Return the values as a numpy structured array with the fields info_ref, aggregation and value"""
+
+        import numpy
+        records = numpy.empty(len(self), dtype=[("info_ref", "<u2"), ("aggregation", "u1"), ("value", "<f4")])
+        records["info_ref"] = self.info_refs
+        records["aggregation"] = self.aggregations
+        records["value"] = self.values
+        return records
+
+
+# Dataclass used to store a property read periodically
+@dataclass
+class PollItem:
+    dst_addr : int
+    object_type : int
+    object_id : int
+    property_id : int
+    format : Union[str, None]       # None to use the format of the catalog
+    period : float      # In seconds
+    port : Union[str, None] = None      # Gateway the property is read through, None to let the "GatewayManager" choose
+
+
+# Dataclass used to store the result of a periodic read
+@dataclass
+class PollSample:
+    timestamp : float   # time.monotonic() when the response was received
+    dst_addr : int
+    object_type : int
+    object_id : int
+    property_id : int
+    value : Union[int, float, bool, None]
+    error : Union[str, None]    # The error's name, None if the value was read
+    lateness : float    # Seconds between the sample's deadline and the moment it was sent
+    overdue : bool      # Whether the lateness is above the poller's tolerance
+    skipped : int       # Number of samples of this property skipped since the previous one
+    port : Union[str, None] = None      # Gateway the sample was read through
+
+
+# Dataclass used to store a parameter to write with "apply"
+@dataclass
+class ParameterWrite:
+    dst_addr : int
+    object_id : int
+    format : str
+    value : Union[int, float, bool]
+    memory : Union[str, None] = None    # "ram" or "flash", None to follow the policy of "apply"
+
+
+# Dataclass used to store the outcome of a "ParameterWrite"
+@dataclass
+class WriteResult:
+    write : ParameterWrite
+    memory : str        # "ram" or "flash"
+    status : str        # UNCHANGED, WRITTEN, VERIFIED, VERIFY_FAILED, NO_RESPONSE, DEVICE_NOT_FOUND or the name of the error answered
+
+
+# Dataclass used to store the measurements of one transaction, given to the callback of "ScomMetrics"
+@dataclass
+class TransactionRecord:
+    port : str
+    dst_addr : int
+    object_type : int
+    object_id : int
+    property_id : int
+    attempts : int
+    duration : float            # Seconds from the first request to the response or the last error, retries included
+    error : Union[str, None]    # Name of the error of the last attempt, None if it succeeded
+
+
+# Dataclass used to store how a session retries a request
+@dataclass
+class RetryPolicy:
+    attempts : int = 3          # Times a request is sent at most
+    backoff : float = 0.05      # Seconds waited before the first retry
+    multiplier : float = 2      # The wait is multiplied by this after each retry
+    max_backoff : float = 1     # Longest wait between two attempts
+    failure_threshold : int = 3     # Failed transactions in a row that open the breaker of a device
+    reset_timeout : float = 30      # Seconds the breaker stays open before a single request is tried again
+
+    # Return the seconds to wait before the given retry (1 for the first one)
+    def delay(self, retry):
+        return min(self.backoff * self.multiplier ** (retry - 1), self.max_backoff)
 
 
 debug = False    # State that define outputs for debugging purposes
 
 
+# Range of object ids that belong to one family of devices
+@dataclass
+class ObjectFamily:
+    first_id : int
+    last_id : int
+    object_type : int       # 1: user info, 2: parameter
+    device : str
+    multicast_addr : int    # The address of the n-th device of the family is multicast_addr + n
+
+
+OBJECT_FAMILIES = [
+    ObjectFamily(1000, 1999, 2, "Xtender", 100),
+    ObjectFamily(3000, 3999, 1, "Xtender", 100),
+    ObjectFamily(6000, 6999, 2, "BSP", 600),
+    ObjectFamily(7000, 7999, 1, "BSP", 600),
+    ObjectFamily(10000, 10999, 2, "VarioTrack", 300),
+    ObjectFamily(11000, 11999, 1, "VarioTrack", 300),
+    ObjectFamily(14000, 14999, 2, "VarioString", 700),
+    ObjectFamily(15000, 15999, 1, "VarioString", 700),
+]
+MAX_DEVICES_PER_FAMILY = 15
+
+# Addresses a device of each family can have
+DEVICE_ADDRESSES = {
+    "Xtender": range(101, 110),
+    "VarioTrack": range(301, 316),
+    "BSP": range(601, 602),
+    "VarioString": range(701, 716),
+}
+
+
+# Dataclass used to store the devices found on an installation
+@dataclass
+class DeviceMap:
+    devices : dict          # Name of the device at each address, the Xcom-232i included
+    multicast_addrs : dict  # Name of the family of each multicast address having at least one device
+    timestamp : float       # time.time() when the installation was probed
+
+    def __contains__(self, dst_addr):
+        return dst_addr in self.devices or dst_addr in self.multicast_addrs
+
+
+# Dataclass used to store an object of the catalog, with its encoder and decoder
+@dataclass
+class CatalogObject:
+    object_type : int
+    object_id : int
+    format : str
+    unit : str
+    minimum : Union[int, float, None]
+    maximum : Union[int, float, None]
+    name : str
+    family : Union[ObjectFamily, None] = field(init=False)     # Found from the range of the object_id
+    codec : struct.Struct = field(init=False, repr=False)       # Layout of the format, compiled once
+
+    def __post_init__(self):
+        self.family = get_object_family(self.object_id)
+        self.codec = PROPERTY_FORMATS[self.format]
+
+    def decode(self, data):
+        if not data:
+            return None
+        # Only 0 and 1 are valid boolean values
+        if self.format == "bool":
+            return {0: False, 1: True}.get(data[0])
+        return self.codec.unpack_from(data)[0]
+
+    def encode(self, value):
+        try:
+            value = float(value) if self.format == "float" else int(value)
+            # Only numbers have a range, the values of an enum are flags
+            if self.format in RANGED_FORMATS and ((self.minimum is not None and value < self.minimum) or (self.maximum is not None and value > self.maximum)):
+                raise ValueError(f"out of the range {self.minimum} to {self.maximum}")
+            return self.codec.pack(value)
+        except (ValueError, TypeError, struct.error) as e:
+            raise FrameError(f"{value!r} can't be written to {self.object_id} ({self.name}): {e}") from e
+
+
+# Precompiled layouts of a frame, every field is little endian except the checksums
+START_BYTE = 0xAA
+FRAME_HEADER = struct.Struct("<BBIIH")          # start_byte, frame_flags, src_addr, dst_addr, data_length
+SERVICE_HEADER = struct.Struct("<BBHIH")        # service_flags, service_id, object_type, object_id, property_id
+CHECKSUM = struct.Struct(">H")                  # Byte A then byte B of the checksum
+FRAME_LAYOUT = struct.Struct("<BBIIHBBBBHIH")   # Header, header checksum and service at once
+FRAME_OVERHEAD = FRAME_HEADER.size + CHECKSUM.size + SERVICE_HEADER.size + CHECKSUM.size   # Length of a frame without property_data
+
+SERVICE_READ_PROPERTY = 0x01
+SERVICE_WRITE_PROPERTY = 0x02
+SERVICE_FLAG_ERROR = 0x01       # Set in the service_flags of an error response
+SERVICE_FLAG_RESPONSE = 0x02    # Set in the service_flags of every response
+ERROR_CODE = struct.Struct("<H")
+ERROR_INVALID_FRAME = 0x0001
+ERROR_DEVICE_NOT_FOUND = 0x0002
+ERROR_RESPONSE_TIMEOUT = 0x0003
+ERROR_GATEWAY_BUSY = 0x0013
+
+READ_POLL_INTERVAL = 0.05      # Longest time a read waits before the deadline of a frame is checked again
+
+# Layouts of the property_data for each format
+PROPERTY_FORMATS = {
+    "bool": struct.Struct("<?"),
+    "short_enum": struct.Struct("<h"),
+    "long_enum": struct.Struct("<i"),
+    "int32": struct.Struct("<i"),
+    "float": struct.Struct("<f"),
+}
+RANGED_FORMATS = ("int32", "float")     # Formats whose values are checked against the minimum and maximum of the catalog
+
+# Layouts of the multi-info service, read from the Xcom-232i itself
+XCOM_ADDR = 501
+MULTI_INFO_OBJECT_TYPE = 10
+MULTI_INFO_OBJECT_ID = 1
+MULTI_INFO_MAX_ITEMS = 76       # Most user infos a multi-info response can hold
+MULTI_INFO_REQUEST_ITEM = struct.Struct("<HB")      # user info reference, assembly
+MULTI_INFO_CONTEXT = struct.Struct("<BBHi")         # xcom flags, devices flags, reserved, timestamp
+MULTI_INFO_RESPONSE_ITEM = struct.Struct("<HBf")    # user info reference, assembly, value
+
+METRICS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, math.inf)    # Upper bounds of the durations histograms, in seconds
+METRICS_STAGES = ("encode", "port_open", "first_byte", "full_frame", "decode")
+
+CAPTURE_MAGIC = b"SCOMCAP1"                     # First bytes of a capture file
+CAPTURE_RECORD = struct.Struct("<dBI")          # time.time(), direction, length of the bytes that follow
+CAPTURE_TX = 0      # Bytes sent to the Xcom-232i
+CAPTURE_RX = 1      # Bytes received from the Xcom-232i
+
+DEFAULT_BROKER_ADDRESS = "tcp://127.0.0.1:4001"     # Address the "serve" command listens on, or "unix:///path/of/socket"
+BROKER_PRIORITY_WRITE = 0       # Writes are sent before the reads waiting for their turn
+BROKER_PRIORITY_READ = 1
+
+SHELL_EXCLUDED_COMMANDS = ("shell", "serve", "poll")    # Commands that run until they're stopped or open the port themselves
+
+PARAMETER_PROPERTIES = {"flash": 5, "ram": 13}     # Property written to change a parameter's value in each memory
+
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.csv")    # Objects known without giving their format
+CATALOG_PROPERTIES = {1: (1,), 2: (5, 6, 7, 13)}    # Properties having the format of their object, by object_type
+
+DEFAULT_CACHE_TTL = {1: 0, 2: 600}     # Seconds a response is kept by object_type, user infos change all the time
+
+# Name and description of every error code an Xcom-232i can answer
+SCOM_ERRORS = {
+    0x0001: ["INVALID_FRAME", "malformed frame"],
+    0x0002: ["DEVICE_NOT_FOUND", "wrong dst_addr field"],
+    0x0003: ["RESPONSE_TIMEOUT", "no response of the server"],
+    0x0011: ["SERVICE_NOT_SUPPORTED", "wrong service_id field"],
+    0x0012: ["INVALID_SERVICE_ARGUMENT", "wrong service_data"],
+    0x0013: ["SCOM_ERROR_GATEWAY_BUSY", "gateway (for example XCOM-232i) busy"],
+    0x0021: ["TYPE_NOT_SUPPORTED", "the object_type requested doesn't exist"],
+    0x0022: ["OBJECT_ID_NOT_FOUND", "no object with this object_id was found"],
+    0x0023: ["PROPERTY_NOT_SUPPORTED", "the property identified by property_id doesn't exist"],
+    0x0024: ["INVALID_DATA_LENGTH", "the field property_data has an invalid number of bytes"],
+    0x0025: ["PROPERTY_IS_READ_ONLY", "a writing to this property is not allowed"],
+    0x0026: ["INVALID_DATA", "this value is impossible for this property"],
+    0x0027: ["DATA_TOO_SMALL", "the value is below the minimum limit"],
+    0x0028: ["DATA_TOO_BIG", "the value is above the maximum limit"],
+    0x0029: ["WRITE_PROPERTY_FAILED", "writing is possible, but failed"],
+    0x002A: ["READ_PROPERTY_FAILED", "reading is possible, but failed"],
+    0x002B: ["ACCESS_DENIED", "insufficient user access"],
+    0x002C: ["SCOM_ERROR_OBJECT_NOT_SUPPORTED", "this object id, through existant, is not supported by the current implementation of the gateway"],
+    0x002D: ["SCOM_ERROR_MULTICAST_READ_NOT_SUPPORTED", "Read operation is not supported when used on multicast adresses."],
+    0x002E: ["OBJECT_PROPERTY_INVALID", "During a file transfer, the use of this property was unexpected"],
+    0x002F: ["FILE_OR_DIR_NOT_PRESENT", "Attempt to download a file not present on the sd card"],
+    0x0030: ["FILE_CORRUPTED", "A read error ocurred during the download of a file"],
+    0x0081: ["INVALID_SHELL_ARG", "the command line tool used received the wrong arguments"],
+}
+
+
+# Base of every error raised by pyscom
+class ScomError(Exception):
+
+    """Base of every error raised by pyscom"""
+
+    name = "SCOM_ERROR"     # Name reported in place of a value, e.g. by the poller
+    retryable = False       # Whether the same request may succeed if it's sent again
+
+
+# A frame or a value that can't be encoded or decoded
+class FrameError(ScomError, ValueError):
+
+    """A frame or a value that can't be encoded or decoded"""
+
+    name = "INVALID_FRAME"
+
+
+# A response was received, but its checksums didn't match
+class ChecksumError(FrameError):
+
+    """A response was received, but its checksums didn't match"""
+
+    name = "CHECKSUM_ERROR"
+    retryable = True
+
+
+# The device didn't answer, or a breaker stopped the request from being sent
+class UnavailableError(ScomError):
+
+    """The device didn't answer, or a breaker stopped the request from being sent"""
+
+
+# Nothing was received before the deadline
+class NoResponseError(UnavailableError):
+
+    """Nothing was received before the deadline"""
+
+    name = "NO_RESPONSE"
+    retryable = True
+
+
+# The circuit breaker of the device is open, the request wasn't sent
+class CircuitOpenError(UnavailableError):
+
+    """The circuit breaker of the device is open, the request wasn't sent"""
+
+    name = "CIRCUIT_OPEN"
+
+
+# The Xcom-232i answered with an error code
+class ScomResponseError(ScomError):
+
+    """The Xcom-232i answered with an error code\n
+    code, name and description come from SCOM_ERRORS, frame is the response received."""
+
+    def __init__(self, code, frame=b""):
+        self.code = code
+        self.name, self.description = SCOM_ERRORS.get(code, ["UNKNOWN_ERROR", "unknown error code"])
+        self.frame = frame
+        super().__init__(f"{self.name} (0x{code:04X}): {self.description}")
+
+
+# Error 0x0002, there is no device at the address
+class DeviceNotFoundError(ScomResponseError):
+
+    """Error 0x0002, there is no device at the address"""
+
+
+# Error 0x0003, the device didn't answer the Xcom-232i
+class ResponseTimeoutError(ScomResponseError):
+
+    """Error 0x0003, the device didn't answer the Xcom-232i"""
+
+    retryable = True
+
+
+# Error 0x0013, the Xcom-232i is busy with other requests
+class GatewayBusyError(ScomResponseError):
+
+    """Error 0x0013, the Xcom-232i is busy with other requests"""
+
+    retryable = True
+
+
+# Errors 0x0021 to 0x0023 and 0x002C, the object or property doesn't exist
+class ObjectNotFoundError(ScomResponseError):
+
+    """Errors 0x0021 to 0x0023 and 0x002C, the object or property doesn't exist"""
+
+
+# Errors 0x0024 to 0x0028, the value can't be written
+class InvalidValueError(ScomResponseError):
+
+    """Errors 0x0024 to 0x0028, the value can't be written"""
+
+
+# Exception raised for each error code, ScomResponseError for the others
+ERROR_EXCEPTIONS = {
+    0x0002: DeviceNotFoundError,
+    0x0003: ResponseTimeoutError,
+    0x0013: GatewayBusyError,
+    0x0021: ObjectNotFoundError,
+    0x0022: ObjectNotFoundError,
+    0x0023: ObjectNotFoundError,
+    0x002C: ObjectNotFoundError,
+    0x0024: InvalidValueError,
+    0x0025: InvalidValueError,
+    0x0026: InvalidValueError,
+    0x0027: InvalidValueError,
+    0x0028: InvalidValueError,
+}
+
+
 # Used to define sub commands
 @click.group()
 @click.option('--port', default="COM1", help="The serial port's name [default: COM1]")                     
@@ -36,53 +440,68 @@ debug = False    # State that define outputs for debugging purposes
                     1: all field of the response on one line              
                     2: full description on multiple lines [default]              
                     3: same as 2, but with debug information""")
+@click.option('--cache', 'cache_file', type=click.Path(dir_okay=False), default=None, help="A file where the parameters read are kept and shared between runs [default: no cache]")
+@click.option('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL[2], help=f"Seconds a parameter read is kept in the cache [default: {DEFAULT_CACHE_TTL[2]}]")
+@click.option('--capture', 'capture_file', type=click.Path(dir_okay=False), default=None, help="Record every byte sent and received in this capture file [default: no capture]")
+@click.option('--metrics', 'show_metrics', is_flag=True, help="Print a summary of the time spent in each stage of the transactions at the end")
+@click.option('--metrics-file', type=click.Path(dir_okay=False), default=None, help="Write the metrics to this file in the Prometheus text format, every 10 seconds and at the end")
+@click.option('--metrics-port', type=int, default=None, help="Serve the metrics in the Prometheus text format on this http port of localhost")
+@click.option('--catalog', 'catalog_file', type=click.Path(exists=True, dir_okay=False), default=None, help="Add the objects of this csv file to the bundled catalog of objects")
+@click.option('--broker', default=None, help="Send the requests through a broker started with the serve command (tcp://host:port or unix:///path) instead of opening --port")
+@click.option('--retries', type=click.IntRange(min=0), default=0, help="Times a request without valid response is sent again by read_property, write_property and shell [default: 0]")
 @click.pass_context
-def commands(ctx, port, bps, verb):
+def commands(ctx, port, bps, verb, cache_file, cache_ttl, capture_file, show_metrics, metrics_file, metrics_port, catalog_file, broker, retries):
     ctx.obj = {}
-    params = [port, bps, verb]
+    # The broker is used like a port, it's the one that opens the serial port
+    params = [port if broker is None else broker, bps, verb]
     ctx.obj['params'] = params  # Pass the parameters to the context
+    # The cache is opened only if a command uses it
+    ctx.obj['cache'] = lambda: None if cache_file is None else ctx.with_resource(contextlib.closing(PropertyCache({2: cache_ttl}, file_name=cache_file)))
+    ctx.obj['capture'] = lambda: None if capture_file is None else ctx.with_resource(CaptureWriter(capture_file))
+    # A command run once gives up after a single deadline unless it's asked to retry
+    ctx.obj['retry'] = RetryPolicy(attempts=retries + 1)
+    # The transactions are only measured if the metrics are used
+    metrics = None
+    if show_metrics or metrics_file or metrics_port:
+        metrics = ScomMetrics(file_name=metrics_file)
+        if metrics_port is not None:
+            ctx.call_on_close(metrics.serve_prometheus(metrics_port).shutdown)
+        ctx.call_on_close(lambda: show_metrics and click.echo(metrics.summary(), err=True))
+        ctx.call_on_close(lambda: metrics_file and metrics.write_prometheus())
+    ctx.obj['metrics'] = metrics
+    if catalog_file is not None:
+        try:
+            extend_catalog(catalog_file)
+        except ValueError as e:
+            raise click.ClickException(str(e))
 
 
 #Display current version informations
 @commands.command(name="version", help="Display current version informations")
 def version():
-    print("script version: 1.0.8")
+    print(f"script version: {VERSION}")
 
 
 # Try to find a connection and test it
 @commands.command(name="test", help="try to find a connection and test it")
+@click.option('--scan', 'ports', multiple=True, help="Port to probe instead of every serial port found (can be repeated)")
+@click.option('--timeout', type=float, default=0.3, help="Deadline in seconds to receive each response [default: 0.3]")
 @click.pass_context
-def test(ctx):
-    bps = ctx.obj['params'][1]
-    output_message = "scan port: "  # The message that will be be printed in the command invite
-    can_communicate = False         # Flag to see if the port can cmmunicate with the XT
-
-    for i in range(1, 21):
-        if platform.system() == "Windows":
-            port_name = f"COM{i}"
-        elif platform.system() == "Linux":
-            port_name = f"/dev/ttyUSB{i}"
-        output_message += port_name + " "
-        # Check if the port can connect to the XT
-        if can_open_port(port_name, bps):
-            print(output_message + "\n")
-            print(f"{port_name} opened with success, trying to communicate with the target...")
-            for dst_id in range(100, 101):
-                # Send and try to recieve data from the XT
-                tx_frame = encode_read_request(1, dst_id, 1, 3000, 1)
-                rx_frame = send_frame(tx_frame, port_name, 38400)
-                # Check if it has recieved data from the XT
-                if rx_frame:
-                    can_communicate = True
-                    frame = decode_response_frame(rx_frame, "float", True)
-                    value = round(frame.property_data, 2)
-                    print(f"inverter addr_id={frame.src_addr} with v_bat={value} detected")
-                output_message = "scan port: "
-             # If every requests failed, display an error message
-            if not can_communicate:
-                print(f"Port {port_name} was not able to communicate with the target")
-    print(output_message + "\n")
-    
+def test(ctx, ports, timeout):
+    ports = list(ports) or list_serial_ports()
+    print("scan port: " + " ".join(ports) + "\n")
+
+    # Every port is probed at the same time, at each baudrate until one answers
+    for port_name, baudrate, devices in discover_ports(ports, timeout=timeout):
+        if baudrate is None:
+            print(f"Port {port_name} was not able to communicate with the target")
+            continue
+        print(f"{port_name} opened with success at {baudrate} bps")
+        for dst_addr, device in devices.items():
+            print(f"{device} addr_id={dst_addr} detected")
+        if not devices:
+            print("no device detected")
+
 
 # Read the given property of the given device
 @commands.command(name="read_property", help="read an arbitrary property of an object\nread_property for multi-info format: (userRef:infoAssembly),(userRef:infoAssembly),etc...")
@@ -90,7 +509,7 @@ def test(ctx):
 @click.argument('object_type', type=int)    # The object's type id
 @click.argument('object_id', type=int)      # The object's id
 @click.argument('property_id', type=int)    # The property's id
-@click.argument('format', type=str)         # The format the returned data will be displayed
+@click.argument('format', type=str, required=False)     # The format the returned data will be displayed, the one of the catalog if not given
 @click.argument('property_data', required=False)    # The property's id
 @click.pass_context                         # This command has access to the context
 def read_property(ctx, dst_addr, object_type, object_id, property_id, format, property_data):
@@ -100,6 +519,8 @@ def read_property(ctx, dst_addr, object_type, object_id, property_id, format, pr
 
     port = ctx.obj['params'][0] 
     bps = ctx.obj['params'][1]
+    if format is None:
+        format = get_catalog_format(object_type, object_id, property_id)
 
     if debug:     
         print("\t********** debug data start **********")
@@ -113,18 +534,17 @@ def read_property(ctx, dst_addr, object_type, object_id, property_id, format, pr
         print("\tproperty_data\t ", property_data)
         print("\t********** debug data end ***********")
 
-    # Create the transmitted frame and get the returned frame
-    tx_frame = encode_read_request(1, dst_addr, object_type, object_id, property_id, property_data)
-    rx_frame = send_frame(tx_frame, port, bps)
+    # Get the returned frame, encoded and decoded by the session so the metrics measure it
+    with open_session(ctx) as session:
+        rx_frame = session.read_property(dst_addr, object_type, object_id, property_id, format, property_data)
 
-    if debug: 
-        print("tx_frame_raw :\t",tx_frame)
-        print("rx_frame_raw :\t",rx_frame)
-
-    if rx_frame:
-        # Turn both frame to the dataclass "Frame"
+    if rx_frame is not None:
+        # Turn the transmitted frame to the dataclass "Frame" too
+        tx_frame = encode_read_request(1, dst_addr, object_type, object_id, property_id, property_data)
+        if debug: 
+            print("tx_frame_raw :\t",tx_frame.hex())
+            print("rx_frame_raw :\t",rx_frame.full_frame.hex())
         tx_frame = decode_request_frame(tx_frame, format, True)
-        rx_frame = decode_response_frame(rx_frame, format, True)
 
         if debug: 
             print("\t********** debug data start **********")
@@ -134,8 +554,10 @@ def read_property(ctx, dst_addr, object_type, object_id, property_id, format, pr
 
         # Show the resulting message
         show_resume(tx_frame, rx_frame, format, ctx)
+        ctx.obj['result'] = rx_frame
     else:
         print("This requests has return nothing. Please check the syntaxe or the power of your installation")
+        ctx.obj['result'] = None
 
 
 # Write the given property of the given device
@@ -144,30 +566,254 @@ def read_property(ctx, dst_addr, object_type, object_id, property_id, format, pr
 @click.argument('object_type', type=int)                            # The object's type id
 @click.argument('object_id', type=int)                              # The object's id
 @click.argument('property_id', type=int)                            # The property's id
-@click.argument('format', type=str)                                 # The format the returned data will be displayed
-@click.argument('property_data') # The value that will be written
+@click.argument('format', type=str)                                 # The format the returned data will be displayed, or the value if it's the last argument
+@click.argument('property_data', required=False) # The value that will be written
 @click.pass_context                                                 # This command has access to the context
 def write_property(ctx, dst_addr, object_type, object_id, property_id, property_data, format):
     validate_parameters(ctx) # Validate the command's parameters
 
     if debug : print(" --- CMD: write_property") 
 
-    port = ctx.obj['params'][0] 
-    bps = ctx.obj['params'][1]
+    # With a single argument, it's the value: it's encoded and checked with the object of the catalog
+    encoding_format = format
+    if property_data is None:
+        property_data = format
+        format = get_catalog_format(object_type, object_id, property_id)
+        encoding_format = None
 
-    # Create the transmitted frame and get the returned frame
-    tx_frame = encode_write_request(1, dst_addr, object_type, object_id, property_id, property_data, format)
-    rx_frame = send_frame(tx_frame, port, bps)
+    # Get the returned frame, encoded and decoded by the session so the metrics measure it
+    with open_session(ctx) as session:
+        rx_frame = session.write_property(dst_addr, object_type, object_id, property_id, property_data, encoding_format)
 
-    if rx_frame:
-        # Turn both frame to the dataclass "Frame"
-        tx_frame = decode_request_frame(tx_frame, format, False)
-        rx_frame = decode_response_frame(rx_frame, format, False)
+    if rx_frame is not None:
+        # Turn the transmitted frame to the dataclass "Frame" too
+        tx_frame = decode_request_frame(encode_write_request(1, dst_addr, object_type, object_id, property_id, property_data, encoding_format), format, False)
 
         # Show the resulting message
         show_resume(tx_frame, rx_frame, format, ctx)
+        ctx.obj['result'] = rx_frame
     else:
         print("This requests has return nothing. Please check the syntaxe or the power of your installation")
+        ctx.obj['result'] = None
+
+
+# Read the properties of a file continuously, each one at its own period
+@commands.command(name="poll", help="""read the properties listed in a file continuously, each one at its own period\n
+                  Each line of the file is: dst_addr object_type object_id property_id format period [port]\n
+                  The period is in seconds, or followed by s, m or h (e.g. 101 1 3000 1 float 1s)\n
+                  The properties without a port are spread over the gateways, --port if there's none""")
+@click.argument('config_file', type=click.Path(exists=True, dir_okay=False))   # The file listing the properties to read
+@click.option('--duration', type=float, default=None, help="Stop after this number of seconds [default: never]")
+@click.option('--tolerance', type=float, default=0.5, help="A sample sent later than this number of seconds is reported as overdue [default: 0.5]")
+@click.option('--gateway', 'gateways', multiple=True, help="Port of a gateway the properties without a port can be read through (can be repeated)")
+@click.option('--skip-absent', is_flag=True, help="Look for the devices of each gateway first and never read the properties of absent devices")
+@click.option('--output', default=None, help="Write the samples to this file (or tcp://, udp://, unix:// socket for influx) instead of printing them")
+@click.option('--output-format', type=click.Choice(["jsonl", "csv", "influx", "parquet"]), default="jsonl", help="Format of the samples written to --output [default: jsonl]")
+@click.option('--batch-size', type=int, default=500, help="Samples written to --output at once [default: 500]")
+@click.pass_context
+def poll(ctx, config_file, duration, tolerance, gateways, skip_absent, output, output_format, batch_size):
+    validate_parameters(ctx) # Validate the command's parameters
+
+    if debug : print(" --- CMD poll")
+
+    port = ctx.obj['params'][0] 
+    bps = ctx.obj['params'][1]
+
+    items = load_poll_items(config_file)
+    # The samples are printed as they come, or written by batches to the output
+    on_sample = show_sample
+    if output is not None:
+        try:
+            on_sample = ctx.with_resource(SINKS[output_format](output, batch_size=batch_size))
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+    # Every gateway is polled by its own worker
+    manager = GatewayManager(gateways or [port], items, on_sample, bps, tolerance, skip_absent=skip_absent, capture=ctx.obj['capture'](), metrics=ctx.obj['metrics'])
+    try:
+        manager.run(duration)
+    except KeyboardInterrupt:
+        pass
+
+
+# Write the parameters listed in a file, skipping the ones already at their value
+@commands.command(name="apply", help="""write the parameters listed in a file over one connection, skipping the ones already at their value\n
+                  Each line of the file is: dst_addr object_id format value [ram|flash]""")
+@click.argument('config_file', type=click.Path(exists=True, dir_okay=False))   # The file listing the parameters to write
+@click.option('--policy', type=click.Choice(["flash", "ram"]), default="flash", help="Memory written when a line doesn't tell [default: flash]")
+@click.option('--no-verify', is_flag=True, help="Don't read the parameters again after writing them")
+@click.pass_context
+def apply(ctx, config_file, policy, no_verify):
+    validate_parameters(ctx) # Validate the command's parameters
+
+    if debug : print(" --- CMD apply")
+
+    writes = load_parameter_writes(config_file)
+    with open_session(ctx) as session:
+        results = session.apply(writes, policy, not no_verify)
+    for result in results:
+        print(f"addr_id={result.write.dst_addr} object_id={result.write.object_id} value={result.write.value} memory={result.memory} status={result.status}")
+
+
+# Decode the frames of a capture file
+@commands.command(name="replay", help="decode the frames recorded in a capture file (see --capture)")
+@click.argument('capture_file', type=click.Path(exists=True, dir_okay=False))  # The capture file to decode
+@click.option('--direction', type=click.Choice(["tx", "rx", "both"]), default="both", help="Frames to decode: sent (tx), received (rx) or both [default: both]")
+@click.option('--summary', is_flag=True, help="Only print the number of frames and errors instead of each frame")
+def replay(capture_file, direction, summary):
+    if debug : print(" --- CMD replay")
+
+    import datetime
+    directions = {"tx": (CAPTURE_TX,), "rx": (CAPTURE_RX,), "both": (CAPTURE_TX, CAPTURE_RX)}[direction]
+    frames = collections.Counter()
+    errors = collections.Counter()
+    for timestamp, frame_direction, frame in replay_capture(capture_file, directions):
+        name = "tx" if frame_direction == CAPTURE_TX else "rx"
+        frames[name] += 1
+        error = (get_error(frame.full_frame) or ["UNKNOWN_ERROR"])[0] if frame.service_flags & SERVICE_FLAG_ERROR else None
+        if error is not None:
+            errors[error] += 1
+        if not summary:
+            line = f"{datetime.datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds')} {name} src_addr={frame.src_addr} dst_addr={frame.dest_addr} service_id={frame.service_id} object_type={frame.object_type} object_id={frame.object_id} property_id={frame.property_id} "
+            print(line + (f"error={error}" if error is not None else f"data={frame.property_data.hex()}"))
+    if summary:
+        print(" ".join(f"{name}_frames={count}" for name, count in sorted(frames.items())) + "".join(f" {error}={count}" for error, count in errors.most_common()))
+
+
+# Find every device connected to the Xcom-232i
+@commands.command(name="inventory", help="find every device connected to the xcom-232i and their addresses")
+@click.option('--timeout', type=float, default=1, help="Deadline in seconds to receive each response [default: 1]")
+@click.pass_context
+def inventory(ctx, timeout):
+    validate_parameters(ctx) # Validate the command's parameters
+
+    if debug : print(" --- CMD inventory")
+
+    with open_session(ctx) as session:
+        device_map = session.inventory(refresh=True, timeout=timeout)
+    if not device_map.devices:
+        print("This requests has return nothing. Please check the connection or the power of your installation")
+        return
+    for dst_addr, device in device_map.devices.items():
+        print(f"addr_id={dst_addr} device={device}")
+    for dst_addr, device in device_map.multicast_addrs.items():
+        print(f"addr_id={dst_addr} device={device} multicast")
+
+
+# Run many commands over one open port, one line of a file or of the standard input after the other
+@commands.command(name="shell", help="""run many commands over one open port, one per line of a file or of the standard input\n
+                  Each line is a command and its arguments (e.g. read_property 101 1 3000 1), everything after a # is ignored.
+                  A json object is printed for each command: line, command, ok, value, error and the output of the command""")
+@click.argument('script', type=click.File("r"), default="-")    # The file of the commands, the standard input if not given
+@click.pass_context
+def shell(ctx, script):
+    validate_parameters(ctx) # Validate the command's parameters
+
+    if debug : print(" --- CMD shell")
+
+    import json
+    import shlex
+    import io
+
+    port = ctx.obj['params'][0] 
+    bps = ctx.obj['params'][1]
+
+    # The port is opened by the first request sent, every command of the script uses the same session
+    ctx.obj['session'] = ctx.with_resource(contextlib.closing(ScomSession(port, bps, cache=ctx.obj['cache'](), retry=ctx.obj['retry'], capture=ctx.obj['capture'](), metrics=ctx.obj['metrics'])))
+    for line_number, line in enumerate(script, 1):
+        args = shlex.split(line, comments=True)
+        if not args:
+            continue
+        ctx.obj.pop('result', None)
+        output = io.StringIO()
+        error = None
+        try:
+            command = commands.get_command(ctx, args[0])
+            if command is None:
+                raise click.UsageError(f"no such command {args[0]}")
+            if args[0] in SHELL_EXCLUDED_COMMANDS:
+                raise click.UsageError(f"{args[0]} can't be run in the shell")
+            with contextlib.redirect_stdout(output):
+                with command.make_context(args[0], args[1:], parent=ctx) as command_ctx:
+                    command.invoke(command_ctx)
+        except click.exceptions.Exit:
+            pass
+        except click.ClickException as e:
+            error = e.format_message()
+        except (ScomError, ValueError, OSError) as e:
+            error = str(e)
+        print(json.dumps(shell_result(line_number, args, ctx.obj, output.getvalue(), error), default=str), flush=True)
+
+
+# Return the result of a command of the shell as a dict
+def shell_result(line_number, args, obj, output, error):
+    
+    """Return the result of a command of the shell as a dict\n
+    A command that reads or writes a property leaves its decoded "Frame" in obj["result"], None if nothing was returned."""
+
+    value = None
+    if error is None and "result" in obj:
+        frame = obj["result"]
+        if frame is None:
+            error = "NO_RESPONSE"
+        elif frame.service_flags & SERVICE_FLAG_ERROR:
+            error = (get_error(frame.full_frame) or ["UNKNOWN_ERROR"])[0]
+        elif isinstance(frame.property_data, MultiInfoResult):
+            value = [list(record) for record in frame.property_data]
+        else:
+            value = frame.property_data
+    return {"line": line_number, "command": " ".join(args), "ok": error is None, "value": value, "error": error, "output": output.strip()}
+
+
+# Return the session a command uses: the one of the shell, or a new one on the port of the command line
+def open_session(ctx):
+    
+    """Return the session a command uses: the one of the shell, or a new one on the port of the command line\n
+    The session is used with "with", the one of the shell stays open at the end of the command.
+    The port is only opened by the first request sent, not when the response is in the cache."""
+
+    session = ctx.obj.get('session')
+    if session is not None:
+        return contextlib.nullcontext(session)
+    return contextlib.closing(ScomSession(ctx.obj['params'][0], ctx.obj['params'][1], cache=ctx.obj['cache'](), retry=ctx.obj['retry'], capture=ctx.obj['capture'](), metrics=ctx.obj['metrics']))
+
+
+# Return the format of a property in the catalog, stop the command if it isn't there
+def get_catalog_format(object_type, object_id, property_id):
+    
+    """Return the format of a property in the catalog, stop the command if it isn't there"""
+
+    obj = get_catalog_object(object_type, object_id, property_id)
+    if obj is None:
+        raise click.UsageError(f"the property {property_id} of the object {object_type}:{object_id} isn't in the catalog, its format must be given")
+    return obj.format
+
+
+# Own the port and send the requests of many local clients through it
+@commands.command(name="serve", help="""own the port and send the requests of many local clients through it\n
+                  The other commands use it with --broker, instead of opening the port themselves.
+                  Writes are sent before the reads waiting for their turn, identical reads are sent once""")
+@click.option('--listen', default=DEFAULT_BROKER_ADDRESS, help=f"Address the clients connect to, tcp://host:port or unix:///path/of/socket [default: {DEFAULT_BROKER_ADDRESS}]")
+@click.option('--max-age', type=float, default=1, help="Seconds a response read is given again to the clients without sending the request [default: 1]")
+@click.pass_context
+def serve(ctx, listen, max_age):
+    validate_parameters(ctx) # Validate the command's parameters
+
+    if debug : print(" --- CMD serve")
+
+    port = ctx.obj['params'][0] 
+    bps = ctx.obj['params'][1]
+
+    cache = ctx.obj['cache']() or PropertyCache({1: max_age, 2: max_age})
+    with ScomSession(port, bps, cache=cache, capture=ctx.obj['capture'](), metrics=ctx.obj['metrics']) as session:
+        broker = ScomBroker(session, listen)
+        click.echo(f"broker of {port} listening on {listen}", err=True)
+        try:
+            broker.run()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.close()
+        click.echo(f"{broker.sent_requests} requests sent, {broker.cached_requests} answered by the cache, {broker.merged_requests} merged with an identical read", err=True)
 
 
 # Make sure that the port name is valid
@@ -220,122 +866,2192 @@ def send_frame(tx_frame, port_name, baudrate):
     """Send the given frame the the XT from the COM port"""
 
     if debug : print(" --- send_frame")
-    
-    # Open the serial communication on the given port
-    ser = serial.serial_for_url(url=port_name, baudrate=baudrate, timeout=3, write_timeout=3, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1)
-    # Send the frame in parameter to the XT
-    ser.write(bytes.fromhex(tx_frame))
-    
-    rx_frame = ""
 
-    # Will read the returned frame until it's empty
-    while (True):
-        data = ser.read()   # Read the frame returned
-        if data != b'':
-            rx_frame += data.hex()
+    # Open a session for this single frame only
+    with ScomSession(port_name, baudrate) as session:
+        return session.send_frame(tx_frame)
+
+
+# Stops sending requests to a device that keeps failing
+class CircuitBreaker:
+
+    """Stops sending requests to a device that keeps failing\n
+    After failure_threshold failures in a row, the breaker is open and allow() returns False.
+    Once reset_timeout seconds are over, a single request is allowed again: a success closes
+    the breaker, a failure keeps it open for another reset_timeout."""
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0           # Failures in a row
+        self.opened_at = None       # time.monotonic() when the breaker was opened or last tried, None if it's closed
+
+    # Whether a request can be sent
+    def allow(self):
+        """Whether a request can be sent"""
+
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        if now - self.opened_at >= self.reset_timeout:
+            self.opened_at = now
+            return True
+        return False
+
+    # Close the breaker after a response of the device
+    def record_success(self):
+        """Close the breaker after a response of the device"""
+
+        self.failures = 0
+        self.opened_at = None
+
+    # Count a failure, open the breaker after failure_threshold of them
+    def record_failure(self):
+        """Count a failure, open the breaker after failure_threshold of them"""
+
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+# Durations counted in fixed buckets
+class Histogram:
+
+    """Durations counted in fixed buckets"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)    # Number of durations of each bucket, not cumulative
+        self.sum = 0.0
+        self.count = 0
+
+    # Count a duration in its bucket
+    def observe(self, value):
+        """Count a duration in its bucket"""
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # Add the counts of another histogram having the same buckets
+    def merge(self, other):
+        """Add the counts of another histogram having the same buckets"""
+
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    # Return the upper bound of the bucket holding the given quantile (0 to 1)
+    def quantile(self, q):
+        """Return the upper bound of the bucket holding the given quantile (0 to 1)"""
+
+        rank = q * self.count
+        for bound, total in zip(self.buckets, itertools.accumulate(self.counts)):
+            if total >= rank:
+                return bound
+        return math.inf
+
+
+# Opt-in measurements of the transactions of one or several sessions
+class ScomMetrics:
+
+    """Opt-in measurements of the transactions of one or several sessions\n
+    The durations of each stage (encode, port_open, first_byte, full_frame and decode) are kept
+    in a "Histogram" for each device and object. Retries, checksum errors and the errors answered
+    are counted the same way. After each transaction, callback is called with its "TransactionRecord".
+    The measurements can be exported in the Prometheus text format with to_prometheus(), a file
+    rewritten every file_interval seconds or an http endpoint (serve_prometheus).
+    A session without metrics doesn't measure anything.\n
+    metrics = ScomMetrics()
+    with ScomSession("COM3", 38400, metrics=metrics) as session:
+        ...
+    print(metrics.summary())"""
+
+    def __init__(self, callback=None, file_name=None, file_interval=10):
+        self.callback = callback
+        self.file_name = file_name
+        self.file_interval = file_interval
+        self.histograms = {}    # "Histogram" of each (stage, dst_addr, object_id)
+        self.counters = collections.Counter()   # Number of each (name, dst_addr, object_id, error)
+        self.lock = threading.Lock()    # The sessions of several threads can share the metrics
+        self.last_write = time.monotonic()
+
+    # Count the duration of a stage of a transaction
+    def observe(self, stage, seconds, dst_addr=None, object_id=None):
+        """Count the duration of a stage of a transaction"""
+
+        with self.lock:
+            histogram = self.histograms.get((stage, dst_addr, object_id))
+            if histogram is None:
+                histogram = self.histograms[(stage, dst_addr, object_id)] = Histogram()
+            histogram.observe(seconds)
+
+    # Add to a counter
+    def count(self, name, dst_addr=None, object_id=None, error=None, increment=1):
+        """Add to a counter"""
+
+        with self.lock:
+            self.counters[(name, dst_addr, object_id, error)] += increment
+
+    # Count a whole transaction and give it to the callback
+    def record_transaction(self, record):
+        """Count a whole transaction and give it to the callback"""
+
+        self.count("transactions", record.dst_addr, record.object_id, record.error)
+        if self.callback is not None:
+            self.callback(record)
+        if self.file_name is not None and time.monotonic() - self.last_write >= self.file_interval:
+            self.write_prometheus()
+
+    # Return the measurements in the Prometheus text format
+    def to_prometheus(self):
+        """Return the measurements in the Prometheus text format"""
+
+        with self.lock:
+            histograms = sorted(self.histograms.items(), key=lambda item: str(item[0]))
+            counters = sorted(self.counters.items(), key=lambda item: str(item[0]))
+
+        lines = ["# HELP scom_stage_seconds Duration of each stage of the SCOM transactions", "# TYPE scom_stage_seconds histogram"]
+        for (stage, dst_addr, object_id), histogram in histograms:
+            labels = f'stage="{stage}",dst_addr="{dst_addr or ""}",object_id="{object_id or ""}"'
+            for bound, total in zip(histogram.buckets, itertools.accumulate(histogram.counts)):
+                lines.append(f'scom_stage_seconds_bucket{{{labels},le="{"+Inf" if bound == math.inf else bound}"}} {total}')
+            lines.append(f"scom_stage_seconds_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"scom_stage_seconds_count{{{labels}}} {histogram.count}")
+        names = sorted({name for (name, dst_addr, object_id, error), value in counters})
+        for name in names:
+            lines.append(f"# TYPE scom_{name}_total counter")
+            for (counter_name, dst_addr, object_id, error), value in counters:
+                if counter_name == name:
+                    lines.append(f'scom_{name}_total{{dst_addr="{dst_addr or ""}",object_id="{object_id or ""}",error="{error or ""}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    # Write the measurements to the Prometheus text file
+    def write_prometheus(self, file_name=None):
+        """Write the measurements to the Prometheus text file\n
+        The file is replaced at once, a scraper never reads half of it."""
+
+        file_name = file_name or self.file_name
+        with open(file_name + ".tmp", "w") as file:
+            file.write(self.to_prometheus())
+        os.replace(file_name + ".tmp", file_name)
+        self.last_write = time.monotonic()
+
+    # Serve the measurements in the Prometheus text format over http, return the server
+    def serve_prometheus(self, port, host="127.0.0.1"):
+        """Serve the measurements in the Prometheus text format over http, return the server\n
+        The server runs in its own thread until its shutdown() is called"""
+
+        import http.server
+        metrics = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    # Return a summary of the measurements, one line per stage and per counter
+    def summary(self):
+        """Return a summary of the measurements, one line per stage and per counter"""
+
+        with self.lock:
+            stages = {}
+            for (stage, dst_addr, object_id), histogram in self.histograms.items():
+                stages.setdefault(stage, Histogram()).merge(histogram)
+            totals = collections.Counter()
+            for (name, dst_addr, object_id, error), value in self.counters.items():
+                totals[name if error is None else f"{name} error={error}"] += value
+
+        lines = []
+        for stage in METRICS_STAGES:
+            histogram = stages.get(stage)
+            if histogram is not None and histogram.count:
+                lines.append(f"{stage}: count={histogram.count} mean={histogram.sum / histogram.count * 1000:.3f}ms p50<={histogram.quantile(0.5) * 1000:g}ms p99<={histogram.quantile(0.99) * 1000:g}ms")
+        lines += [f"{name}: {value}" for name, value in sorted(totals.items())]
+        return "\n".join(lines)
+
+
+# Serial connection to an Xcom-232i that stays open between frames
+class ScomSession:
+
+    """Serial connection to an Xcom-232i that stays open between frames\n
+    The port is opened once and every frame is sent over the same handle.
+    Any url supported by pyserial can be used (COM3, /dev/ttyUSB0, loop://, socket://host:port)\n
+    with ScomSession("COM3", 38400) as session:
+        rx_frame = session.read_property(101, 1, 3000, 1, "float")\n
+    When a "PropertyCache" is given, the responses of reads are kept and written objects are invalidated.
+    "transact" retries and stops sending to failing devices according to the "RetryPolicy".
+    When a "CaptureWriter" is given, every byte sent and received is recorded in it.
+    A port named "replay://capture_file" answers with the bytes received in a capture (see "CaptureReplayPort").
+    A port named "tcp://host:port" or "unix:///path/of/socket" is a "ScomBroker" (see "BrokerPort").
+    When a "ScomMetrics" is given, the time of each stage of the transactions is measured.
+    The methods can be called from several threads, each exchange on the port holding the session's
+    lock. When a "SingleFlight" is given, identical reads made at the same time share one transaction and its "Frame"."""
+
+    def __init__(self, port_name, baudrate, timeout=3, cache=None, retry=None, capture=None, metrics=None, single_flight=None):
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.timeout = timeout      # Deadline in seconds to receive a whole frame
+        self.ser = None
+        self.parser = FrameParser()     # Bytes received but not yet part of a returned frame
+        self.rx_frames = collections.deque()    # Frames received but not yet returned
+        self.tx_buffer = bytearray(FRAME_OVERHEAD)  # Reused to encode the frames sent by the session
+        self.device_map = None      # "DeviceMap" of the last inventory
+        self.cache = cache
+        self.retry = RetryPolicy() if retry is None else retry
+        self.breakers = {}      # "CircuitBreaker" of each destination address
+        self.capture = capture
+        self.metrics = metrics
+        self.first_byte_at = None   # time.perf_counter() when the first byte of the current response was received, if metrics are on
+        self.single_flight = single_flight
+        self.lock = threading.RLock()   # Held by the thread whose requests are being sent, methods calling each other take it again
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Open the serial communication on the session's port
+    def open(self):
+        """Open the serial communication on the session's port"""
+
+        if debug : print(" --- ScomSession.open")
+
+        import serial
+        if self.ser is None and self.metrics is not None:
+            started = time.perf_counter()
+        if self.ser is None and self.port_name.startswith("replay://"):
+            self.ser = CaptureReplayPort(self.port_name[len("replay://"):], min(self.timeout, READ_POLL_INTERVAL))
+        elif self.ser is None and self.port_name.startswith(("tcp://", "unix://")):
+            self.ser = BrokerPort(self.port_name, min(self.timeout, READ_POLL_INTERVAL))
+        elif self.ser is None:
+            # Reads return at least every READ_POLL_INTERVAL, so the deadline of a frame can be checked without reconfiguring the port
+            self.ser = serial.serial_for_url(url=self.port_name, baudrate=self.baudrate, timeout=min(self.timeout, READ_POLL_INTERVAL), write_timeout=self.timeout, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1)
+            if self.metrics is not None:
+                self.metrics.observe("port_open", time.perf_counter() - started)
+        return self
+
+    # Close the serial communication
+    def close(self):
+        """Close the serial communication"""
+
+        if debug : print(" --- ScomSession.close")
+
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+    # Send the given frame over the opened port and return the response
+    def send_frame(self, tx_frame):
+        """Send the given frame over the opened port and return the response"""
+
+        if isinstance(tx_frame, str):
+            tx_frame = bytes.fromhex(tx_frame)
+
+        with self.lock:
+            request = decode_frame(tx_frame)
+            key = None
+            if self.cache is not None:
+                if request.service_id == SERVICE_WRITE_PROPERTY:
+                    self.cache.invalidate(request.object_type, request.object_id)
+                # Multi-info requests carry data, their responses are never cached
+                elif not request.property_data:
+                    key = (request.dest_addr, request.object_type, request.object_id, request.property_id)
+                    rx_frame = self.cache.get(key)
+                    if rx_frame is not None:
+                        return rx_frame
+
+            self.open()
+            # Drop whatever is left from a previous response before sending a new request
+            self.ser.reset_input_buffer()
+            self.parser.clear()
+            self.rx_frames.clear()
+            if self.metrics is not None:
+                sent_at = time.perf_counter()
+                self.first_byte_at = None
+            # Send the frame in parameter to the XT
+            self.ser.write(tx_frame)
+            if self.capture is not None:
+                self.capture.write(CAPTURE_TX, tx_frame)
+
+            # Return the bytes of the returned frame, the frames answering another request are dropped
+            rx_frame = self._receive_response(request, time.monotonic() + self.timeout)
+            if self.metrics is not None:
+                self._observe_exchange(tx_frame, sent_at, rx_frame)
+            if key is not None and rx_frame and not check_frame_has_error(rx_frame):
+                self.cache.put(key, rx_frame)
+            return rx_frame
+
+    # Return the first frame answering the request before the deadline, empty bytes if there's none
+    def _receive_response(self, request, deadline):
+        """Return the first frame answering the request before the deadline, empty bytes if there's none
+
+        A late response to a previous request that timed out is dropped instead of being returned."""
+
+        while True:
+            frame = self._receive_frame(deadline)
+            if frame is None:
+                return b""
+            if match_response(frame, [request], [0]) is not None:
+                return frame.full_frame
+
+    # Count the time to the first byte and to the whole response of an exchange
+    def _observe_exchange(self, tx_frame, sent_at, rx_frame):
+        """Count the time to the first byte and to the whole response of an exchange"""
+
+        received_at = time.perf_counter()
+        request = FRAME_LAYOUT.unpack_from(tx_frame)
+        dst_addr, object_id = request[3], request[10]
+        if self.first_byte_at is not None:
+            self.metrics.observe("first_byte", self.first_byte_at - sent_at, dst_addr, object_id)
+        if rx_frame:
+            self.metrics.observe("full_frame", received_at - sent_at, dst_addr, object_id)
+
+    # Send a request and return its response, retrying the errors that may be temporary
+    def transact(self, tx_frame):
+        """Send a request and return its response, retrying the errors that may be temporary\n
+        No response, a checksum error, RESPONSE_TIMEOUT and SCOM_ERROR_GATEWAY_BUSY are retried up
+        to retry.attempts times, waiting longer before each retry. Each destination address has a
+        "CircuitBreaker": once a device failed to answer retry.failure_threshold times in a row,
+        its requests fail at once with CircuitOpenError, so it doesn't delay the other devices.
+        Raise the "ScomError" of the last attempt when there's no valid response"""
+
+        if isinstance(tx_frame, str):
+            tx_frame = bytes.fromhex(tx_frame)
+
+        with self.lock:
+            dst_addr = FRAME_HEADER.unpack_from(tx_frame)[3]
+            breaker = self.breakers.get(dst_addr)
+            if breaker is None:
+                breaker = self.breakers[dst_addr] = CircuitBreaker(self.retry.failure_threshold, self.retry.reset_timeout)
+            if not breaker.allow():
+                raise CircuitOpenError(f"the last {breaker.failures} requests to the device {dst_addr} failed, it's not tried again before {self.retry.reset_timeout}s")
+
+            if self.metrics is not None:
+                started = time.perf_counter()
+            for attempt in range(1, self.retry.attempts + 1):
+                checksum_errors = self.parser.checksum_errors
+                try:
+                    rx_frame = self.send_frame(tx_frame)
+                    if not rx_frame and self.parser.checksum_errors > checksum_errors:
+                        raise ChecksumError(f"the response of the device {dst_addr} was corrupted")
+                    if not rx_frame:
+                        raise NoResponseError(f"the device {dst_addr} didn't answer within {self.timeout}s")
+                    raise_for_error(rx_frame)
+                    breaker.record_success()
+                    if self.metrics is not None:
+                        self._record_transaction(tx_frame, attempt, started, None)
+                    return rx_frame
+                except ScomError as e:
+                    if self.metrics is not None:
+                        self._count_error(tx_frame, e, e.retryable and attempt < self.retry.attempts)
+                    if not e.retryable or attempt == self.retry.attempts:
+                        # An error answered by the device itself shows it's alive
+                        if isinstance(e, (UnavailableError, ChecksumError, DeviceNotFoundError, ResponseTimeoutError)):
+                            breaker.record_failure()
+                        else:
+                            breaker.record_success()
+                        if self.metrics is not None:
+                            self._record_transaction(tx_frame, attempt, started, e.name)
+                        raise
+                time.sleep(self.retry.delay(attempt))
+
+    # Count the error of one attempt of a transaction, and the retry when another attempt follows
+    def _count_error(self, tx_frame, error, retried):
+        """Count the error of one attempt of a transaction, and the retry when another attempt follows"""
+
+        request = FRAME_LAYOUT.unpack_from(tx_frame)
+        if isinstance(error, ChecksumError):
+            self.metrics.count("checksum_errors", request[3], request[10])
         else:
-            break
+            self.metrics.count("errors", request[3], request[10], error.name)
+        if retried:
+            self.metrics.count("retries", request[3], request[10])
+
+    # Give the "TransactionRecord" of a finished transaction to the metrics
+    def _record_transaction(self, tx_frame, attempts, started, error):
+        """Give the "TransactionRecord" of a finished transaction to the metrics"""
+
+        request = FRAME_LAYOUT.unpack_from(tx_frame)
+        self.metrics.record_transaction(TransactionRecord(self.port_name, request[3], request[9], request[10], request[11], attempts, time.perf_counter() - started, error))
+
+    # Read exactly one frame from the port, return empty bytes if the deadline is reached
+    def read_frame(self, timeout=None):
+        """Read exactly one frame from the port, return empty bytes if the deadline is reached\n
+        The parser tells how many bytes are missing: the 14 bytes header first, then
+        the number of bytes given by its "data_length". No byte is read after the frame."""
+
+        if timeout is None:
+            timeout = self.timeout
+
+        frame = self._receive_frame(time.monotonic() + timeout)
+        return b"" if frame is None else frame.full_frame
+
+    # Return the next "Frame" received before the deadline, None if there's none
+    def _receive_frame(self, deadline):
+        """Return the next "Frame" received before the deadline, None if there's none\n
+        A corrupted frame followed by silence on the line returns None at once, without waiting for the deadline."""
+
+        checksum_errors = self.parser.checksum_errors
+        while not self.rx_frames:
+            if time.monotonic() >= deadline:
+                return None
+            data = self.ser.read(self.parser.bytes_needed)
+            if self.metrics is not None and data and self.first_byte_at is None:
+                self.first_byte_at = time.perf_counter()
+            if self.capture is not None and data:
+                self.capture.write(CAPTURE_RX, data)
+            elif not data and self.parser.checksum_errors > checksum_errors and not self.parser.buffer:
+                return None
+            self.rx_frames.extend(self.parser.feed(data))
+
+        return self.rx_frames.popleft()
+
+    # Send many frames, keeping up to "depth" of them waiting for their response at once
+    def send_pipelined(self, tx_frames, depth=4, timeout=None, retries=1):
+        """Send many frames, keeping up to "depth" of them waiting for their response at once\n
+        Responses are matched to their request by (src_addr, object_type, object_id, property_id).
+        A request without response before its timeout, or answered by SCOM_ERROR_GATEWAY_BUSY,
+        is sent again up to "retries" times. After SCOM_ERROR_GATEWAY_BUSY, no more requests than
+        the ones still waiting for their response are sent at once.
+        The requests don't go through "transact": they aren't measured by the metrics, and the
+        circuit breakers neither stop them nor count their failures.\n
+        Return the responses in the same order as tx_frames, empty bytes when there was none"""
+
+        if debug : print(" --- ScomSession.send_pipelined")
+
+        if timeout is None:
+            timeout = self.timeout
+        tx_frames = [bytes.fromhex(tx_frame) if isinstance(tx_frame, str) else bytes(tx_frame) for tx_frame in tx_frames]
+        requests = [decode_frame(tx_frame) for tx_frame in tx_frames]
+        responses = [b""] * len(tx_frames)
+        attempts = [0] * len(tx_frames)
+        waiting = collections.deque(range(len(tx_frames)))   # Requests to send
+        in_flight = {}      # Deadline of each request sent, in the order they were sent
+        limit = depth       # Requests sent at once, lowered to the ones the gateway accepted when it's busy
+
+        with self.lock:
+            self.open()
+            self.ser.reset_input_buffer()
+            self.parser.clear()
+            self.rx_frames.clear()
+
+            while waiting or in_flight:
+                # Fill the pipeline
+                while waiting and len(in_flight) < limit:
+                    index = waiting.popleft()
+                    self.ser.write(tx_frames[index])
+                    if self.capture is not None:
+                        self.capture.write(CAPTURE_TX, tx_frames[index])
+                    attempts[index] += 1
+                    in_flight[index] = time.monotonic() + timeout
+
+                frame = self._receive_frame(min(in_flight.values()))
+                if frame is None:
+                    # Every request whose deadline is over is retried or abandoned
+                    now = time.monotonic()
+                    for index in [index for index, deadline in in_flight.items() if deadline <= now]:
+                        del in_flight[index]
+                        if attempts[index] <= retries:
+                            waiting.append(index)
+                    continue
+
+                index = match_response(frame, requests, in_flight)
+                if index is None:
+                    continue
+                del in_flight[index]
+                if get_error_code(frame.full_frame) == ERROR_GATEWAY_BUSY and attempts[index] <= retries:
+                    waiting.appendleft(index)
+                    limit = max(1, len(in_flight))
+                    # Nothing else is answered before the gateway is free again
+                    if not in_flight:
+                        time.sleep(self.retry.delay(attempts[index]))
+                else:
+                    responses[index] = frame.full_frame
+
+            return responses
+
+    # Find the devices connected to the gateway, return them as a "DeviceMap"
+    def inventory(self, refresh=False, depth=4, timeout=None):
+        """Find the devices connected to the gateway, return them as a "DeviceMap"\n
+        The first user info of each family is read from its multicast address: a family
+        answered by DEVICE_NOT_FOUND has no device and its addresses are skipped. Then every
+        address of the other families is read, all requests being pipelined. An address that
+        answers without error has a device. The Xcom-232i is probed along with the families,
+        with a multi-info request to its own address. The map is kept by the session and only
+        built again when refresh is True."""
+
+        if debug : print(" --- ScomSession.inventory")
+
+        with self.lock:
+            if self.device_map is not None and not refresh:
+                return self.device_map
+
+            families = [family for family in OBJECT_FAMILIES if family.object_type == 1]
+            tx_frames = [encode_read_request(1, family.multicast_addr, 1, family.first_id, 1) for family in families]
+            # The Xcom-232i has no user info of its own, it answers the multi-info service
+            tx_frames.append(bytes(self._encode(SERVICE_READ_PROPERTY, XCOM_ADDR, MULTI_INFO_OBJECT_TYPE, MULTI_INFO_OBJECT_ID, 1,
+                                                encode_multi_info_items([(families[0].first_id, 0)]))))
+            responses = self.send_pipelined(tx_frames, depth, timeout)
+            xcom_response = responses.pop()
+            candidates = [(dst_addr, family) for family, rx_frame in zip(families, responses)
+                          if not rx_frame or get_error_code(rx_frame) != ERROR_DEVICE_NOT_FOUND
+                          for dst_addr in DEVICE_ADDRESSES[family.device]]
+
+            tx_frames = [encode_read_request(1, dst_addr, 1, family.first_id, 1) for dst_addr, family in candidates]
+            devices = {}
+            multicast_addrs = {}
+            for (dst_addr, family), rx_frame in zip(candidates, self.send_pipelined(tx_frames, depth, timeout)):
+                if rx_frame and not check_frame_has_error(rx_frame):
+                    devices[dst_addr] = family.device
+                    multicast_addrs[family.multicast_addr] = family.device
+            if xcom_response and not check_frame_has_error(xcom_response):
+                devices[XCOM_ADDR] = "Xcom-232i"
+
+            self.device_map = DeviceMap(dict(sorted(devices.items())), dict(sorted(multicast_addrs.items())), time.time())
+            return self.device_map
+
+    # Write many parameters, skipping the ones already at their value
+    def apply(self, writes, policy="flash", verify=True, depth=4):
+        """Write many parameters, skipping the ones already at their value\n
+        The current value of every parameter is read first, all the reads being pipelined.
+        A write to a multicast address is compared with every device of the family found by
+        "inventory", and isn't sent if the family has none. The parameters already at their value aren't written, the others are
+        written to the memory of the "ParameterWrite", or to the policy ("flash" or "ram") if
+        it has none. With verify, the parameters written are read again.
+        Return a "WriteResult" for each write, in the same order"""
+
+        if debug : print(" --- ScomSession.apply")
+
+        with self.lock:
+            multicast_addrs = {family.multicast_addr: family.device for family in OBJECT_FAMILIES}
+            data = [encode_property_data(write.value, write.format) for write in writes]
+            # Addresses each write is compared with
+            targets = []
+            for write in writes:
+                if write.dst_addr in multicast_addrs:
+                    devices = self.inventory().devices
+                    targets.append([dst_addr for dst_addr, device in devices.items() if device == multicast_addrs[write.dst_addr]])
+                else:
+                    targets.append([write.dst_addr])
+
+            current = self._read_parameter_values(writes, targets, depth)
+            # A family without any device isn't written, there would be nothing to verify
+            results = [WriteResult(write, write.memory or policy, "UNCHANGED" if targets[index] else "DEVICE_NOT_FOUND") for index, write in enumerate(writes)]
+            changed = [index for index in range(len(writes)) if targets[index] and any(value != data[index] for value in current[index])]
+
+            tx_frames = [encode_write_request(1, writes[index].dst_addr, 2, writes[index].object_id, PARAMETER_PROPERTIES[results[index].memory], writes[index].value, writes[index].format)
+                         for index in changed]
+            for index, rx_frame in zip(changed, self.send_pipelined(tx_frames, depth)):
+                if self.cache is not None:
+                    self.cache.invalidate(2, writes[index].object_id)
+                if not rx_frame:
+                    results[index].status = "NO_RESPONSE"
+                elif check_frame_has_error(rx_frame):
+                    results[index].status = (get_error(rx_frame) or ["UNKNOWN_ERROR"])[0]
+                else:
+                    results[index].status = "WRITTEN"
+
+            if verify:
+                written = [index for index in changed if results[index].status == "WRITTEN"]
+                values = self._read_parameter_values([writes[index] for index in written], [targets[index] for index in written], depth)
+                for index, value in zip(written, values):
+                    results[index].status = "VERIFIED" if all(current == data[index] for current in value) else "VERIFY_FAILED"
+
+            return results
+
+    # Read the value of parameters at many addresses, return their bytes, None if it couldn't be read
+    def _read_parameter_values(self, writes, targets, depth):
+        """Read the value of parameters at many addresses, return their bytes, None if it couldn't be read"""
+
+        requests = [(dst_addr, write.object_id) for write, addresses in zip(writes, targets) for dst_addr in addresses]
+        tx_frames = [encode_read_request(1, dst_addr, 2, object_id, PARAMETER_PROPERTIES["flash"]) for dst_addr, object_id in requests]
+        values = iter(decode_frame(rx_frame).property_data if rx_frame and not check_frame_has_error(rx_frame) else None
+                      for rx_frame in self.send_pipelined(tx_frames, depth))
+        return [[next(values) for _ in addresses] for addresses in targets]
+
+    # Find how many requests the gateway accepts at once before answering SCOM_ERROR_GATEWAY_BUSY
+    def probe_pipeline_depth(self, tx_frame, max_depth=16, timeout=None):
+        """Find how many requests the gateway accepts at once before answering SCOM_ERROR_GATEWAY_BUSY\n
+        The given frame is sent 1, 2, ... max_depth times at once, without retry.
+        Return the largest number of copies that were all answered without being busy"""
+
+        if debug : print(" --- ScomSession.probe_pipeline_depth")
+
+        with self.lock:
+            for depth in range(1, max_depth + 1):
+                responses = self.send_pipelined([tx_frame] * depth, depth, timeout, retries=0)
+                if not all(responses) or any(get_error_code(response) == ERROR_GATEWAY_BUSY for response in responses):
+                    return depth - 1
+            return max_depth
+
+    # Read a property and return the response as a "Frame", None if nothing was returned
+    def read_property(self, dst_addr, object_type, object_id, property_id, format=None, property_data=None):
+        """Read a property and return the response as a "Frame", None if nothing was returned\n
+        The request is sent with "transact", an error answered is returned as a "Frame" too.
+        Without a format, the one of the object in the catalog is used."""
+
+        data = b"" if property_data is None else encode_multi_info(property_data)
+        try:
+            return self._read_frame(dst_addr, object_type, object_id, property_id, format, data)
+        except ScomResponseError as e:
+            return self._decode(e.frame, format, True)
+        except (UnavailableError, ChecksumError):
+            return None
+
+    # Read a property and return its value, raise a "ScomError" if it can't be read
+    def read_value(self, dst_addr, object_type, object_id, property_id, format=None):
+        """Read a property and return its value, raise a "ScomError" if it can't be read"""
+
+        return self._read_frame(dst_addr, object_type, object_id, property_id, format).property_data
+
+    # Read a property with "transact" and return the response as a "Frame"
+    def _read_frame(self, dst_addr, object_type, object_id, property_id, format, data=b""):
+        """Read a property with "transact" and return the response as a "Frame"\n
+        With a "SingleFlight", identical reads share the same transaction and "Frame"."""
+
+        if self.single_flight is None or data:
+            return self._read_once(dst_addr, object_type, object_id, property_id, format, data)
+        return self.single_flight.do((dst_addr, object_type, object_id, property_id, format),
+                                     lambda: self._read_once(dst_addr, object_type, object_id, property_id, format, data))
+
+    # Send a read request with "transact" and decode its response
+    def _read_once(self, dst_addr, object_type, object_id, property_id, format, data):
+        """Send a read request with "transact" and decode its response"""
+
+        with self.lock:
+            rx_frame = self.transact(self._encode(SERVICE_READ_PROPERTY, dst_addr, object_type, object_id, property_id, data))
+        return self._decode(rx_frame, format, True)
+
+    # Write a property and return the response as a "Frame", None if nothing was returned
+    def write_property(self, dst_addr, object_type, object_id, property_id, property_data, format=None):
+        """Write a property and return the response as a "Frame", None if nothing was returned\n
+        Without a format, the value is encoded and checked with the object of the catalog."""
+
+        if format is None:
+            data = require_catalog_object(object_type, object_id, property_id).encode(property_data)
+        else:
+            data = encode_property_data(property_data, format)
+        with self.lock:
+            rx_frame = self.transact_frame(self._encode(SERVICE_WRITE_PROPERTY, dst_addr, object_type, object_id, property_id, data))
+        # The values read before the write are outdated
+        if self.single_flight is not None:
+            self.single_flight.clear()
+        if rx_frame:
+            return self._decode(rx_frame, format, False)
+        return None
+
+    # Send a request with "transact", return the response even if it's an error, empty bytes if there's none
+    def transact_frame(self, tx_frame):
+        """Send a request with "transact", return the response even if it's an error, empty bytes if there's none"""
 
-    ser.close()
-    # Return a string of the frame of HEX values
-    return rx_frame
+        try:
+            return self.transact(tx_frame)
+        except ScomResponseError as e:
+            return e.frame
+        except (UnavailableError, ChecksumError):
+            return b""
+
+    # Read many user infos and parameters with as few requests as possible
+    def read_many(self, items):
+        """Read many user infos and parameters with as few requests as possible\n
+        items: list of (object_id, assembly) or (object_id, assembly, format)
+        assembly is "Master", "Average", "Sum", "Uid1" to "Uid15" or the id of one of them.
+        User infos are read by groups of up to MULTI_INFO_MAX_ITEMS with the multi-info service,
+        parameters and objects it doesn't support are read one by one (with the format of the catalog
+        if not given, "float" if the object isn't in the catalog either).\n
+        Return a dict of the value of each item, None if it couldn't be read.
+        Raise a FrameError, before any request is sent, for an item whose assembly is neither an id nor a name"""
+
+        if debug : print(" --- ScomSession.read_many")
+
+        for item in items:
+            if not isinstance(item[1], (int, str)):
+                raise FrameError(f"the assembly of the item {item!r} must be an id or a name")
+
+        values = {}
+        multi_info_items = []
+        # The same item is only read once
+        for item in dict.fromkeys(items):
+            assembly_id = item[1] if isinstance(item[1], int) else convert_assembly_to_id(item[1])
+            family = get_object_family(item[0])
+            if family is not None and family.object_type == 1 and assembly_id is not None:
+                multi_info_items.append((item, assembly_id))
+            else:
+                values[item] = self._read_single_item(item, family, assembly_id)
 
+        for start in range(0, len(multi_info_items), MULTI_INFO_MAX_ITEMS):
+            values.update(self._read_multi_info_items(multi_info_items[start:start + MULTI_INFO_MAX_ITEMS]))
 
-# Build the frame of HEX values from the command's parameters to use the "read_property" service
-def encode_read_request(src_addr, dst_addr, object_type, object_id, property_id, property_data=None):    
-    """Build the frame of HEX values from the command's parameters to use the "read_property" service"""
+        return {item: values[item] for item in items}
 
-    if debug :
-        print(" --- encode_read_request")
-        print("\t********** debug data start **********")
-        print("\tproperty_data : ", property_data)                
-        print("\t********** debug data end ************")
-
-    frame_request = ""
-    
-    hex_start = 'aa'            # Start byte is always "AA"
-    hex_frame_flags = '00'
-    hex_src_addr = convert_int32_to_hex(src_addr, 4)
-    hex_dst_addr = convert_int32_to_hex(dst_addr, 4)
-    hex_service_flags = '00'    # Specify that it's not a response nor an error
-    hex_service_id = '01'       # Specify that the frame use the "read_property" service
-    hex_object_type = convert_int32_to_hex(object_type, 2)
-    hex_object_id = convert_int32_to_hex(object_id, 4)
-    hex_property_id = convert_int32_to_hex(property_id, 2)
-    # Calculate the number of byte in the frame_data
-    data_size = int((len(hex_service_flags) + len(hex_service_id) + len(hex_object_type) + len(hex_object_id) + len(hex_property_id)) / 2)
-    
-    if debug :
-        print("\t********** debug data start **********")
-        print("\tproperty_data : ", property_data)                
-        print("\t********** debug data end ************")
+    # Read a group of user infos with one multi-info request
+    def _read_multi_info_items(self, items):
+        """Read a group of user infos with one multi-info request
 
-    if property_data is not None:
-        hex_property_data = encode_multi_info(property_data)
-        data_size += int((len(hex_property_data) / 2))
-    hex_data_size = convert_int32_to_hex(data_size, 2)
-    # Put together the bytes use to calculate the header and data checksum
-    header_hex = hex_frame_flags + hex_src_addr + hex_dst_addr + hex_data_size    
+        The request is sent with "transact". When there's no response, an error, a response to
+        another request or one that can't be decoded, the user infos are read one by one."""
 
-    data_hex = hex_service_flags + hex_service_id + hex_object_type + hex_object_id + hex_property_id
-    if property_data is not None:
-        data_hex += hex_property_data
+        values = dict.fromkeys(item for item, assembly_id in items)
+        data = encode_multi_info_items([(item[0], assembly_id) for item, assembly_id in items])
+        try:
+            with self.lock:
+                tx_frame = self._encode(SERVICE_READ_PROPERTY, XCOM_ADDR, MULTI_INFO_OBJECT_TYPE, MULTI_INFO_OBJECT_ID, 1, data)
+                request = decode_frame(tx_frame)
+                rx_frame = self.transact_frame(tx_frame)
+            result = None
+            if rx_frame and not check_frame_has_error(rx_frame):
+                frame = decode_frame(rx_frame)
+                if match_response(frame, [request], [0]) is not None:
+                    result = decode_byte_stream(frame.property_data)
+        except (ScomError, struct.error, ValueError):
+            result = None
+
+        if result is not None:
+            # The values are identified by their user info reference and assembly
+            items_by_ref = {(item[0], assembly_id): item for item, assembly_id in items}
+            for info_ref, assembly_id, value in result:
+                if (info_ref, assembly_id) in items_by_ref:
+                    values[items_by_ref[(info_ref, assembly_id)]] = value
+        else:
+            # The user infos of a single device can still be read one by one
+            for item, assembly_id in items:
+                values[item] = self._read_single_item(item, get_object_family(item[0]), assembly_id)
+
+        return values
+
+    # Read a single item of read_many with the "read_property" service
+    def _read_single_item(self, item, family, assembly_id):
+        """Read a single item of read_many with the "read_property" service, None if it can't be read"""
+
+        # Only the master or a single device can be read, not an average or a sum
+        if family is None or assembly_id is None or assembly_id > MAX_DEVICES_PER_FAMILY:
+            return None
+        dst_addr = family.multicast_addr + assembly_id
+        property_id = 1 if family.object_type == 1 else 5
+        format = item[2] if len(item) > 2 else None
+        if format is None and get_catalog_object(family.object_type, item[0], property_id) is None:
+            format = "float"
+
+        frame = self.read_property(dst_addr, family.object_type, item[0], property_id, format)
+        if frame is None or check_frame_has_error(frame.full_frame):
+            return None
+        return frame.property_data
+
+    # Encode a request in the session's buffer and return a view on it
+    def _encode(self, service_id, dst_addr, object_type, object_id, property_id, property_data):
+        """Encode a request in the session's buffer and return a view on it"""
+
+        if self.metrics is not None:
+            started = time.perf_counter()
+        if len(self.tx_buffer) < FRAME_OVERHEAD + len(property_data):
+            self.tx_buffer = bytearray(FRAME_OVERHEAD + len(property_data))
+        length = encode_frame_into(self.tx_buffer, 1, dst_addr, service_id, object_type, object_id, property_id, property_data)
+        if self.metrics is not None:
+            self.metrics.observe("encode", time.perf_counter() - started, dst_addr, object_id)
+        return memoryview(self.tx_buffer)[:length]
+
+    # Decode a response, measuring the time it takes if metrics are on
+    def _decode(self, rx_frame, format, is_read):
+        """Decode a response, measuring the time it takes if metrics are on"""
+
+        if self.metrics is None:
+            return decode_response_frame(rx_frame, format, is_read)
+        started = time.perf_counter()
+        frame = decode_response_frame(rx_frame, format, is_read)
+        self.metrics.observe("decode", time.perf_counter() - started, frame.src_addr, frame.object_id)
+        return frame
+
+
+# Responses of reads kept for a while, in memory or in a sqlite file
+class PropertyCache:
+
+    """Responses of reads kept for a while, in memory or in a sqlite file\n
+    The responses are identified by (dst_addr, object_type, object_id, property_id) and kept
+    ttl[object_type] seconds (not at all if it's 0 or missing). When there are more than
+    max_entries, the least recently used ones are dropped. Writing an object invalidates
+    it at every address, its multicast address included.
+    With a file name, the responses are stored in a sqlite file that separate runs can share."""
+
+    def __init__(self, ttl=None, max_entries=1024, file_name=None):
+        self.ttl = DEFAULT_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()    # (expiry, rx_frame) of each key, the least recently used first
+        self.hits = 0       # Reads answered with a response kept
+        self.db = None
+        self.used = {}      # Time each key of the sqlite file was last read, written to the file by the next put
+        if file_name is not None:
+            import sqlite3
+            # The connection is used by the threads of a session, one at a time as they hold its lock
+            self.db = sqlite3.connect(file_name, timeout=5, isolation_level=None, check_same_thread=False)
+            self.db.execute("""CREATE TABLE IF NOT EXISTS responses (dst_addr INTEGER, object_type INTEGER, object_id INTEGER, property_id INTEGER,
+                               rx_frame BLOB, expiry REAL, used REAL, PRIMARY KEY (dst_addr, object_type, object_id, property_id))""")
+
+    # Return the response kept for the key, None if there's none or it expired
+    def get(self, key):
+        """Return the response kept for the key, None if there's none or it expired"""
+
+        now = time.time()
+        if self.db is not None:
+            row = self.db.execute("SELECT rx_frame, expiry FROM responses WHERE dst_addr=? AND object_type=? AND object_id=? AND property_id=?", key).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            # A read doesn't write to the file, the least recently used ones only matter when one is dropped
+            self.used[key] = now
+            self.hits += 1
+            return row[0]
+
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= now:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    # Keep the response of a read
+    def put(self, key, rx_frame):
+        """Keep the response of a read"""
+
+        ttl = self.ttl.get(key[1], 0)
+        if ttl <= 0:
+            return
+        now = time.time()
+        if self.db is not None:
+            self._write_used()
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)", (*key, bytes(rx_frame), now + ttl, now))
+            self.db.execute("DELETE FROM responses WHERE rowid IN (SELECT rowid FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            return
+
+        self.entries[key] = (now + ttl, bytes(rx_frame))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    # Write the time the responses were last read to the sqlite file, in one transaction
+    def _write_used(self):
+        """Write the time the responses were last read to the sqlite file, in one transaction"""
+
+        if self.used:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE responses SET used=? WHERE dst_addr=? AND object_type=? AND object_id=? AND property_id=?",
+                                [(used, *key) for key, used in self.used.items()])
+            self.db.execute("COMMIT")
+            self.used.clear()
+
+    # Forget the responses of an object at every address
+    def invalidate(self, object_type, object_id):
+        """Forget the responses of an object at every address"""
+
+        if self.db is not None:
+            self.db.execute("DELETE FROM responses WHERE object_type=? AND object_id=?", (object_type, object_id))
+            return
+
+        for key in [key for key in self.entries if key[1] == object_type and key[2] == object_id]:
+            del self.entries[key]
+
+    # Forget every response
+    def clear(self):
+        """Forget every response"""
+
+        self.entries.clear()
+        self.used.clear()
+        if self.db is not None:
+            self.db.execute("DELETE FROM responses")
+
+    # Close the sqlite file, if any
+    def close(self):
+        """Close the sqlite file, if any"""
+
+        if self.db is not None:
+            self._write_used()
+            self.db.close()
+            self.db = None
+
+
+# Calls sharing their result with the identical calls made while they run
+class SingleFlight:
+
+    """Calls sharing their result with the identical calls made while they run\n
+    The first call of a key runs the function, the calls of the same key made before it
+    returns wait for it and get the same result, or the same exception. With a freshness
+    window, a result is also given to the calls made up to freshness seconds after it.
+    do() is used from threads, do_async() from the coroutines of an event loop.\n
+    single_flight = SingleFlight(freshness=0.2)
+    frame = single_flight.do((101, 1, 3000, 1), lambda: session.read_property(101, 1, 3000, 1))"""
+
+    def __init__(self, freshness=0, max_entries=1024):
+        self.freshness = freshness
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.calls = {}         # "concurrent.futures.Future" of each key running in a thread
+        self.async_calls = {}   # "asyncio.Future" of each key running in a coroutine
+        self.results = {}       # (time.monotonic(), result) of the last call of each key, within the freshness window
+        self.shared_calls = 0   # Calls that got the result of another call
+
+    # Run the function once for all the identical calls, return its result
+    def do(self, key, function):
+        """Run the function once for all the identical calls, return its result"""
+
+        import concurrent.futures
+        with self.lock:
+            result = self._fresh_result(key)
+            if result is not None:
+                return result
+            future = self.calls.get(key)
+            if future is None:
+                future = self.calls[key] = concurrent.futures.Future()
+                leader = True
+            else:
+                self.shared_calls += 1
+                leader = False
+        if not leader:
+            return future.result()
 
-    # Calculate both checksum
-    hex_header_checksum = calc_checksum(header_hex, len(header_hex))
-    hex_data_checksum = calc_checksum(data_hex, len(data_hex))
+        try:
+            result = function()
+        except BaseException as e:
+            with self.lock:
+                del self.calls[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.calls[key]
+            self._keep_result(key, result)
+        future.set_result(result)
+        return result
+
+    # Await the coroutine function once for all the identical calls, return its result
+    async def do_async(self, key, function):
+        """Await the coroutine function once for all the identical calls, return its result"""
+
+        import asyncio
+        with self.lock:
+            result = self._fresh_result(key)
+        if result is not None:
+            return result
+        future = self.async_calls.get(key)
+        if future is not None:
+            self.shared_calls += 1
+            # A waiting call that's cancelled doesn't cancel the one running
+            return await asyncio.shield(future)
+
+        future = self.async_calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await function()
+        except BaseException as e:
+            del self.async_calls[key]
+            future.set_exception(e)
+            future.exception()      # Nobody may be waiting for it
+            raise
+        del self.async_calls[key]
+        with self.lock:
+            self._keep_result(key, result)
+        future.set_result(result)
+        return result
+
+    # Forget the results kept, the next calls run again
+    def clear(self):
+        """Forget the results kept, the next calls run again"""
+
+        with self.lock:
+            self.results.clear()
+
+    # Return the result of the key if it's within the freshness window, None otherwise
+    def _fresh_result(self, key):
+        """Return the result of the key if it's within the freshness window, None otherwise"""
+
+        entry = self.results.get(key)
+        if entry is None or time.monotonic() - entry[0] > self.freshness:
+            return None
+        self.shared_calls += 1
+        return entry[1]
+
+    # Keep a result for the freshness window
+    def _keep_result(self, key, result):
+        """Keep a result for the freshness window, the expired ones are dropped when there are too many"""
+
+        if not self.freshness or result is None:
+            return
+        now = time.monotonic()
+        if len(self.results) >= self.max_entries:
+            self.results = {key: entry for key, entry in self.results.items() if now - entry[0] <= self.freshness}
+        self.results[key] = (now, result)
+
+
+# Fixed rate scheduler that reads properties over an opened session
+class Poller:
+
+    """Fixed rate scheduler that reads properties over an opened session\n
+    Each "PollItem" is read every "period" seconds. The deadlines are fixed: a late
+    sample doesn't delay the next ones, and samples that can't be sent in time anymore
+    are skipped. Items sharing the same period are spread over it instead of being
+    sent all at once. Every sample is given to the on_sample callback as a "PollSample".
+    When a "DeviceMap" is given, the items of absent devices are reported once with the
+    error DEVICE_NOT_FOUND and never sent."""
+
+    def __init__(self, session, items, on_sample, tolerance=0.5, stop_event=None, device_map=None):
+        self.session = session
+        self.items = items
+        self.device_map = device_map
+        self.on_sample = on_sample
+        self.tolerance = tolerance      # A sample sent later than this is reported as overdue
+        self.stop_event = stop_event or threading.Event()   # Set to stop the poller from another thread
+
+    # Read the items until the duration is over, forever if it's None
+    def run(self, duration=None):
+        """Read the items until the duration is over, forever if it's None"""
+
+        if debug : print(" --- Poller.run")
+
+        start = time.monotonic()
+        end = None if duration is None else start + duration
+
+        items = self.items
+        if self.device_map is not None:
+            items = [item for item in self.items if item.dst_addr in self.device_map]
+            for item in self.items:
+                if item.dst_addr not in self.device_map:
+                    self.on_sample(PollSample(start, item.dst_addr, item.object_type, item.object_id, item.property_id, None, "DEVICE_NOT_FOUND", 0, False, 0, self.session.port_name))
+
+        # The first deadline of the items having the same period are evenly spread over it
+        items_by_period = {}
+        for index, item in enumerate(items):
+            items_by_period.setdefault(item.period, []).append(index)
+        schedule = []
+        for period, indexes in items_by_period.items():
+            for rank, index in enumerate(indexes):
+                schedule.append((start + period * rank / len(indexes), index))
+        heapq.heapify(schedule)
+
+        while schedule and not self.stop_event.is_set():
+            deadline, index = schedule[0]
+            if end is not None and deadline >= end:
+                return
+            now = time.monotonic()
+            if deadline > now:
+                if self.stop_event.wait(deadline - now):
+                    return
+                now = time.monotonic()
+
+            item = items[index]
+            # Every deadline that already passed except the last one is skipped
+            skipped = int((now - deadline) // item.period)
+            deadline += skipped * item.period
+            heapq.heapreplace(schedule, (deadline + item.period, index))
+
+            self.on_sample(self.read_item(item, now - deadline, skipped))
+
+    # Read a single item and return the resulting "PollSample"
+    def read_item(self, item, lateness=0, skipped=0):
+        """Read a single item and return the resulting "PollSample\""""
+
+        value = None
+        error = None
+        try:
+            value = self.session.read_value(item.dst_addr, item.object_type, item.object_id, item.property_id, item.format)
+        except ScomError as e:
+            error = e.name
+
+        return PollSample(time.monotonic(), item.dst_addr, item.object_type, item.object_id, item.property_id, value, error, lateness, lateness > self.tolerance, skipped, self.session.port_name)
+
+
+# Poll properties through several gateways at once, one thread per port
+class GatewayManager:
+
+    """Poll properties through several gateways at once, one thread per port\n
+    Items having a "port" are read through that gateway, the others are spread over
+    the given ports so that every gateway sends about the same number of requests per second.
+    Each gateway has its own session and "Poller": a slow or failing gateway never delays
+    the others. When a port fails, its items are reported with the error "PORT_ERROR" and
+    the port is opened again after reconnect_delay seconds. The samples of every gateway are
+    merged into one stream, given to on_sample from the thread that calls run().
+    With skip_absent, the installation behind each gateway is inventoried when its port
+    is opened and the properties of absent devices are never sent."""
+
+    def __init__(self, ports, items, on_sample, baudrate=38400, tolerance=0.5, reconnect_delay=5, skip_absent=False, capture=None, metrics=None):
+        self.ports = list(dict.fromkeys(list(ports) + [item.port for item in items if item.port is not None]))
+        self.on_sample = on_sample
+        self.baudrate = baudrate
+        self.tolerance = tolerance
+        self.reconnect_delay = reconnect_delay
+        self.skip_absent = skip_absent
+        self.capture = capture      # "CaptureWriter" shared by the sessions of every gateway
+        self.metrics = metrics      # "ScomMetrics" shared by the sessions of every gateway
+        self.items_by_port = self.spread_items(items, list(ports) or self.ports)
+        self.samples = queue.Queue()    # Samples of every gateway, in the order they were received
+        self.stop_event = threading.Event()
+
+    # Assign every item to a gateway, return the items of each port
+    def spread_items(self, items, gateways):
+        """Assign every item to a gateway, return the items of each port\n
+        The items without a port go to one of the given gateways, the one having the lowest load (requests per second)."""
+
+        if debug : print(" --- GatewayManager.spread_items")
+
+        items_by_port = {port: [] for port in self.ports}
+        loads = dict.fromkeys(self.ports, 0)
+        for item in items:
+            if item.port is not None:
+                items_by_port[item.port].append(item)
+                loads[item.port] += 1 / item.period
+        # The fastest items are placed first so that the slow ones fill the gaps
+        for item in sorted((item for item in items if item.port is None), key=lambda item: item.period):
+            port = min(gateways, key=loads.get)
+            items_by_port[port].append(item)
+            loads[port] += 1 / item.period
+        return items_by_port
+
+    # Poll every gateway until the duration is over, forever if it's None
+    def run(self, duration=None):
+        """Poll every gateway until the duration is over, forever if it's None"""
+
+        if debug : print(" --- GatewayManager.run")
+
+        end = None if duration is None else time.monotonic() + duration
+        self.stop_event.clear()
+        threads = [threading.Thread(target=self._run_gateway, args=(port, items, end), name=f"gateway {port}", daemon=True)
+                   for port, items in self.items_by_port.items() if items]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads) or not self.samples.empty():
+                try:
+                    self.on_sample(self.samples.get(timeout=READ_POLL_INTERVAL))
+                except queue.Empty:
+                    pass
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    # Ask every gateway to stop, can be called from any thread
+    def stop(self):
+        """Ask every gateway to stop, can be called from any thread"""
+
+        self.stop_event.set()
+
+    # Poll the items of one gateway, open the port again each time it fails
+    def _run_gateway(self, port, items, end):
+        """Poll the items of one gateway, open the port again each time it fails"""
+
+        import serial
+        while not self.stop_event.is_set():
+            duration = None if end is None else end - time.monotonic()
+            if duration is not None and duration <= 0:
+                return
+            try:
+                with ScomSession(port, self.baudrate, capture=self.capture, metrics=self.metrics) as session:
+                    device_map = session.inventory() if self.skip_absent else None
+                    Poller(session, items, self.samples.put, self.tolerance, self.stop_event, device_map).run(duration)
+                return
+            except (serial.SerialException, OSError):
+                now = time.monotonic()
+                for item in items:
+                    self.samples.put(PollSample(now, item.dst_addr, item.object_type, item.object_id, item.property_id, None, "PORT_ERROR", 0, False, 0, port))
+                self.stop_event.wait(self.reconnect_delay)
+
+
+# Read the list of items to poll from a file
+def load_poll_items(file_name):
     
-    # Put together all the string of HEX value to build the frame
-    frame_request = hex_start + hex_frame_flags + hex_src_addr + hex_dst_addr + hex_data_size + hex_header_checksum.to_bytes(2, byteorder='big').hex()
-    frame_request += hex_service_flags + hex_service_id + hex_object_type + hex_object_id + hex_property_id
-    if property_data is not None:
-        frame_request += hex_property_data
-    frame_request += hex_data_checksum.to_bytes(2, byteorder='big').hex()
+    """Read the list of items to poll from a file\n
+    Each line is: dst_addr object_type object_id property_id [format] period [port]
+    Without a format, the property is decoded with the one of the catalog.
+    Only the formats of a single value (bool, short_enum, long_enum, int32, float) can be polled.
+    Empty lines and everything after a # are ignored"""
+
+    if debug : print(" --- load_poll_items")
+
+    items = []
+    with open(file_name) as file:
+        for line_number, line in enumerate(file, 1):
+            fields = line.split("#")[0].split()
+            if not fields:
+                continue
+            try:
+                # The format is optional, it's told apart from a period by its name
+                if len(fields) > 4 and not check_format(fields[4]):
+                    fields.insert(4, None)
+                if len(fields) not in (6, 7):
+                    raise ValueError(f"expected 5 to 7 fields, got {len(fields) - (fields[4] is None)}")
+                dst_addr, object_type, object_id, property_id, format, period = fields[:6]
+                port = fields[6] if len(fields) == 7 else None
+                if format is None:
+                    if get_catalog_object(int(object_type), int(object_id), int(property_id)) is None:
+                        raise ValueError(f"no format given and the object {object_type}:{object_id} isn't in the catalog")
+                else:
+                    format = format.lower()
+                    # The samples hold a single value, the outputs can't write bytes or a multi-info result
+                    if format not in PROPERTY_FORMATS:
+                        raise ValueError(f"the format {format} can't be polled, expected one of {', '.join(PROPERTY_FORMATS)}")
+                items.append(PollItem(int(dst_addr), int(object_type), int(object_id), int(property_id), format, parse_period(period), port))
+            except ValueError as e:
+                raise click.ClickException(f"{file_name} line {line_number}: {e}")
+    return items
+
+
+# Read the list of parameters to write from a file
+def load_parameter_writes(file_name):
+    
+    """Read the list of parameters to write from a file\n
+    Each line is: dst_addr object_id [format] value [ram|flash]
+    Without a format, the one of the catalog is used and the value is checked against its range.
+    Empty lines and everything after a # are ignored"""
+
+    if debug : print(" --- load_parameter_writes")
+
+    writes = []
+    with open(file_name) as file:
+        for line_number, line in enumerate(file, 1):
+            fields = line.split("#")[0].split()
+            if not fields:
+                continue
+            try:
+                # The format is optional, the one of the catalog is used without it
+                catalog_object = None
+                if len(fields) > 2 and fields[2].lower() not in PROPERTY_FORMATS:
+                    catalog_object = get_catalog_object(2, int(fields[1]), PARAMETER_PROPERTIES["flash"])
+                    if catalog_object is None:
+                        raise ValueError(f"unknown format {fields[2]}, and the parameter {fields[1]} isn't in the catalog")
+                    fields.insert(2, catalog_object.format)
+                if len(fields) not in (4, 5):
+                    raise ValueError(f"expected 4 or 5 fields, got {len(fields) - (catalog_object is not None)}")
+                dst_addr, object_id, format, value = fields[:4]
+                memory = fields[4].lower() if len(fields) == 5 else None
+                if memory not in (None, *PARAMETER_PROPERTIES):
+                    raise ValueError(f"unknown memory {fields[4]}, expected ram or flash")
+                value = float(value) if format.lower() == "float" else int(value)
+                if catalog_object is not None:
+                    catalog_object.encode(value)
+                writes.append(ParameterWrite(int(dst_addr), int(object_id), format.lower(), value, memory))
+            except ValueError as e:
+                raise click.ClickException(f"{file_name} line {line_number}: {e}")
+    return writes
+
+
+# Convert a period (e.g. 10, 1.5s, 10m, 1h) into seconds
+def parse_period(period):
+    
+    """Convert a period (e.g. 10, 1.5s, 10m, 1h) into seconds"""
 
-    return frame_request
+    units = {"s": 1, "m": 60, "h": 3600}
+    multiplier = units.get(period[-1].lower(), None)
+    seconds = float(period[:-1]) * multiplier if multiplier else float(period)
+    if seconds <= 0:
+        raise ValueError(f"the period {period} must be greater than 0")
+    return seconds
 
 
-# Build the frame of HEX values from the command's parameters to use the "write_property" service
-def encode_write_request(src_addr, dst_addr, object_type, object_id, property_id, property_data, format):
-    """Build the frame of HEX values from the command's parameters to use the "write_property" service"""
+# Print a "PollSample" on one line
+def show_sample(sample):
     
-    if debug : print(" --- encode_write_request")
+    """Print a "PollSample" on one line"""
+
+    import datetime
+    line = f"{datetime.datetime.now().isoformat(timespec='milliseconds')} port={sample.port} device_addr={sample.dst_addr} object_type={sample.object_type} object_id={sample.object_id} property_id={sample.property_id} "
+    if sample.error is None:
+        line += f"data={sample.value}"
+    else:
+        line += f"error={sample.error}"
+    if sample.overdue:
+        line += f" overdue={sample.lateness:.3f}s"
+    if sample.skipped:
+        line += f" skipped={sample.skipped}"
+    print(line, flush=True)
+
 
-    frame_request = ""
+# Base of the sinks, the samples are kept in a buffer and written by batches
+class SampleSink(abc.ABC):
+
+    """Base of the sinks, the samples are kept in a buffer and written by batches\n
+    A sink is called with each "PollSample", so it can be given as on_sample to "Poller" or
+    "GatewayManager". The buffer is written when it holds batch_size samples, or when a sample
+    comes flush_interval seconds after the last write, and when the sink is closed.
+    Subclasses implement write_batch(samples) and close_output().\n
+    with JsonLinesSink("samples.jsonl") as sink:
+        GatewayManager(["COM3"], items, sink).run()"""
+
+    fields = ["timestamp", "port", "dst_addr", "object_type", "object_id", "property_id", "value", "error", "lateness", "overdue", "skipped"]
+
+    def __init__(self, batch_size=500, flush_interval=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __call__(self, sample):
+        self.buffer.append(sample)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    # Write every sample of the buffer
+    def flush(self):
+        """Write every sample of the buffer"""
+
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    # Write the remaining samples and close the output
+    def close(self):
+        """Write the remaining samples and close the output"""
+
+        self.flush()
+        self.close_output()
+
+    # Write a batch of samples to the output
+    @abc.abstractmethod
+    def write_batch(self, samples):
+        """Write a batch of samples to the output"""
+
+    def close_output(self):
+        pass
+
+
+# Sink writing one json object per sample and per line
+class JsonLinesSink(SampleSink):
+
+    """Sink writing one json object per sample and per line"""
+
+    def __init__(self, file_name, **kwargs):
+        super().__init__(**kwargs)
+        self.file = open(file_name, "a")
+
+    def write_batch(self, samples):
+        import json
+        self.file.write("".join(json.dumps({field: getattr(sample, field) for field in self.fields}) + "\n" for sample in samples))
+        self.file.flush()
+
+    def close_output(self):
+        self.file.close()
+
+
+# Sink writing one sample per line of a csv file, the header is written in a new file
+class CsvSink(SampleSink):
+
+    """Sink writing one sample per line of a csv file, the header is written in a new file"""
+
+    def __init__(self, file_name, **kwargs):
+        super().__init__(**kwargs)
+        import csv
+        self.file = open(file_name, "a", newline="")
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(self.fields)
+
+    def write_batch(self, samples):
+        self.writer.writerows([getattr(sample, field) for field in self.fields] for sample in samples)
+        self.file.flush()
+
+    def close_output(self):
+        self.file.close()
+
+
+# Sink writing the InfluxDB line protocol to a file or a socket
+class InfluxSink(SampleSink):
+
+    """Sink writing the InfluxDB line protocol to a file or a socket\n
+    target is a file name, "tcp://host:port", "udp://host:port" or "unix:///path/of/socket".
+    Each sample is a line of the measurement, tagged with its port and object. Its value is
+    in the "value" field (an integer, float or boolean), its error in the "error" field. The
+    monotonic time of the samples is turned into nanoseconds since the epoch."""
+
+    def __init__(self, target, measurement="scom", **kwargs):
+        super().__init__(**kwargs)
+        import socket
+        self.measurement = measurement
+        self.epoch_offset = time.time() - time.monotonic()    # Turns a time.monotonic() into a time.time()
+        self.file = None
+        self.socket = None
+        scheme, _, address = target.partition("://")
+        if not address:
+            self.file = open(target, "a")
+        elif scheme == "unix":
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.connect(address)
+        elif scheme in ("tcp", "udp"):
+            host, _, port = address.rpartition(":")
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM if scheme == "tcp" else socket.SOCK_DGRAM)
+            self.socket.connect((host, int(port)))
+        else:
+            raise ValueError(f"unknown scheme {scheme}, expected tcp, udp or unix")
+
+    # Return the line of a sample
+    def format_line(self, sample):
+        """Return the line of a sample"""
+
+        import re
+        port = re.sub(r"([,= \\])", r"\\\1", str(sample.port))     # Commas, equal signs and spaces of a tag are escaped
+        tags = f"{self.measurement},port={port},dst_addr={sample.dst_addr},object_type={sample.object_type},object_id={sample.object_id},property_id={sample.property_id}"
+        if sample.error is not None:
+            field = f'error="{sample.error}"'
+        elif isinstance(sample.value, bool):
+            field = f"value={'true' if sample.value else 'false'}"
+        elif isinstance(sample.value, int):
+            field = f"value={sample.value}i"
+        else:
+            field = f"value={sample.value!r}"
+        return f"{tags} {field} {int((sample.timestamp + self.epoch_offset) * 1e9)}\n"
+
+    def write_batch(self, samples):
+        import socket
+        data = "".join(self.format_line(sample) for sample in samples)
+        if self.file is not None:
+            self.file.write(data)
+            self.file.flush()
+        elif self.socket.type == socket.SOCK_DGRAM:
+            # A datagram must stay small, each line is sent on its own
+            for line in data.splitlines(keepends=True):
+                self.socket.send(line.encode())
+        else:
+            self.socket.sendall(data.encode())
+
+    def close_output(self):
+        if self.file is not None:
+            self.file.close()
+        if self.socket is not None:
+            self.socket.close()
+
+
+# Sink writing the samples in the columns of a Parquet file, needs pyarrow
+class ParquetSink(SampleSink):
+
+    """Sink writing the samples in the columns of a Parquet file, needs pyarrow\n
+    Each batch is a row group of the file. The values are stored as float64 (booleans,
+    enums and int32 fit in it exactly) and are null for the samples having an error."""
+
+    def __init__(self, file_name, **kwargs):
+        super().__init__(**kwargs)
+        # pyarrow is optional, it's only needed when a parquet file is written
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("pyarrow is needed to write parquet files (pip install pyarrow)")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ("timestamp", pyarrow.float64()), ("port", pyarrow.string()), ("dst_addr", pyarrow.uint32()),
+            ("object_type", pyarrow.uint16()), ("object_id", pyarrow.uint32()), ("property_id", pyarrow.uint16()),
+            ("value", pyarrow.float64()), ("error", pyarrow.string()), ("lateness", pyarrow.float64()),
+            ("overdue", pyarrow.bool_()), ("skipped", pyarrow.uint32()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(file_name, self.schema)
+
+    def write_batch(self, samples):
+        columns = {field: [getattr(sample, field) for sample in samples] for field in self.fields}
+        columns["value"] = [None if value is None else float(value) for value in columns["value"]]
+        self.writer.write_table(self.pyarrow.table(columns, schema=self.schema))
+
+    def close_output(self):
+        self.writer.close()
+
+
+# Sink class of each output format
+SINKS = {
+    "jsonl": JsonLinesSink,
+    "csv": CsvSink,
+    "influx": InfluxSink,
+    "parquet": ParquetSink,
+}
+
+
+# asyncio client of an Xcom-232i, many clients can share the same event loop
+class AsyncScomClient:
+
+    """asyncio client of an Xcom-232i, many clients can share the same event loop\n
+    "socket://host:port" urls use asyncio's own streams, every other port needs
+    the optional pyserial-asyncio package. Requests of a client are sent one at a time.
+    When a "SingleFlight" is given, identical reads made at the same time share one request and its "Frame".\n
+    async with AsyncScomClient("socket://192.168.1.10:4001") as client:
+        rx_frame = await client.read_property(101, 1, 3000, 1, "float")"""
+
+    def __init__(self, port_name, baudrate=38400, timeout=3, single_flight=None):
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.timeout = timeout      # Deadline in seconds to receive a whole frame
+        self.single_flight = single_flight
+        self.reader = None
+        self.writer = None
+        self.parser = FrameParser()
+        self.lock = None            # Created in the event loop that uses the client
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    # Open the stream to the port
+    async def open(self):
+        """Open the stream to the port"""
+
+        if debug : print(" --- AsyncScomClient.open")
+
+        import asyncio
+        import serial
+        if self.writer is None:
+            if self.port_name.startswith("socket://"):
+                host, port = self.port_name[len("socket://"):].rsplit(":", 1)
+                self.reader, self.writer = await asyncio.open_connection(host, int(port))
+            else:
+                try:
+                    import serial_asyncio
+                except ImportError:
+                    raise RuntimeError(f"pyserial-asyncio is needed to open {self.port_name}, only socket:// urls work without it")
+                self.reader, self.writer = await serial_asyncio.open_serial_connection(url=self.port_name, baudrate=self.baudrate, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1)
+        return self
+
+    # Close the stream
+    async def close(self):
+        """Close the stream"""
+
+        if debug : print(" --- AsyncScomClient.close")
+
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.reader = None
+            self.writer = None
+
+    # Send the given frame and return the response, empty bytes if the deadline is reached
+    async def send_frame(self, tx_frame):
+        """Send the given frame and return the response, empty bytes if the deadline is reached"""
+
+        import asyncio
+        # Only one request at a time, the first one also opens the stream
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            await self.open()
+            # Drop whatever is left from a previous response before sending a new request
+            self.parser.clear()
+            self.writer.write(tx_frame)
+            await self.writer.drain()
+            try:
+                return await asyncio.wait_for(self._read_frame(decode_frame(tx_frame)), self.timeout)
+            except asyncio.TimeoutError:
+                return b""
+
+    # Read from the stream until a whole frame answering the request is received
+    async def _read_frame(self, request):
+        """Read from the stream until a whole frame answering the request is received
+
+        The late response to a request that timed out is still in the stream, it's dropped."""
+
+        while True:
+            data = await self.reader.read(self.parser.bytes_needed)
+            if not data:
+                raise ConnectionError(f"{self.port_name} was closed")
+            for frame in self.parser.feed(data):
+                if match_response(frame, [request], [0]) is not None:
+                    return frame.full_frame
+
+    # Read a property and return the response as a "Frame", None if nothing was returned
+    async def read_property(self, dst_addr, object_type, object_id, property_id, format=None, property_data=None):
+        """Read a property and return the response as a "Frame", None if nothing was returned"""
+
+        if self.single_flight is not None and property_data is None:
+            return await self.single_flight.do_async((dst_addr, object_type, object_id, property_id, format),
+                                                     lambda: self._read_property(dst_addr, object_type, object_id, property_id, format, property_data))
+        return await self._read_property(dst_addr, object_type, object_id, property_id, format, property_data)
+
+    # Send a read request and decode its response
+    async def _read_property(self, dst_addr, object_type, object_id, property_id, format, property_data):
+        """Send a read request and decode its response"""
+
+        rx_frame = await self.send_frame(encode_read_request(1, dst_addr, object_type, object_id, property_id, property_data))
+        if rx_frame:
+            return decode_response_frame(rx_frame, format, True)
+        return None
+
+    # Write a property and return the response as a "Frame", None if nothing was returned
+    async def write_property(self, dst_addr, object_type, object_id, property_id, property_data, format=None):
+        """Write a property and return the response as a "Frame", None if nothing was returned"""
+
+        rx_frame = await self.send_frame(encode_write_request(1, dst_addr, object_type, object_id, property_id, property_data, format))
+        if self.single_flight is not None:
+            self.single_flight.clear()
+        if rx_frame:
+            return decode_response_frame(rx_frame, format, False)
+        return None
+
+
+# Incremental parser that turns a stream of bytes into frames
+class FrameParser:
+
+    """Incremental parser that turns a stream of bytes into frames\n
+    Bytes can be given in chunks of any size, frames are returned as soon as they're complete.
+    A frame must start with "AA" and have valid header and data checksums,
+    anything else is dropped until the next possible start of a frame.\n
+    parser = FrameParser()
+    for frame in parser.feed(chunk):
+        print(frame.object_id, frame.property_data)"""
+
+    def __init__(self):
+        self.buffer = bytearray()   # Bytes received but not yet part of a frame
+        self.dropped_bytes = 0      # Number of bytes dropped while looking for a frame
+        self.checksum_errors = 0    # Number of header or data checksums that didn't match, or of data too short for a service
+
+    # Add the given bytes and return every frame they complete
+    def feed(self, data):
+        """Add the given bytes and return every frame they complete\n
+        The property_data of the returned frames are bytes, see decode_property_data"""
+
+        self.buffer += data
+        frames = []
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    # Drop every byte that was received
+    def clear(self):
+        """Drop every byte that was received"""
+
+        self.buffer.clear()
+
+    # Number of bytes that are missing to complete the next frame
+    @property
+    def bytes_needed(self):
+        """Number of bytes that are missing to complete the next frame, at least 1"""
+
+        if len(self.buffer) < FRAME_HEADER.size + CHECKSUM.size:
+            return FRAME_HEADER.size + CHECKSUM.size - len(self.buffer)
+        frame_length = FRAME_OVERHEAD - SERVICE_HEADER.size + FRAME_HEADER.unpack_from(self.buffer)[4]
+        return max(1, frame_length - len(self.buffer))
+
+    # Take the next valid frame out of the buffer, None if it isn't complete yet
+    def _next_frame(self):
+        """Take the next valid frame out of the buffer, None if it isn't complete yet"""
+
+        buffer = self.buffer
+        while True:
+            # Drop everything before the next start byte
+            start = buffer.find(START_BYTE)
+            if start != 0:
+                dropped = len(buffer) if start < 0 else start
+                del buffer[:dropped]
+                self.dropped_bytes += dropped
+            if len(buffer) < FRAME_HEADER.size + CHECKSUM.size:
+                return None
+
+            # A wrong header checksum means this start byte was line noise
+            if calc_checksum(buffer[1:12]) != CHECKSUM.unpack_from(buffer, 12)[0]:
+                self._drop_start_byte()
+                continue
+
+            # The header gives the length of the data, followed by its checksum
+            data_length = FRAME_HEADER.unpack_from(buffer)[4]
+            # The data always hold a service, a shorter one can't be a frame
+            if data_length < SERVICE_HEADER.size:
+                self._drop_start_byte()
+                continue
+            frame_length = FRAME_OVERHEAD - SERVICE_HEADER.size + data_length
+            if len(buffer) < frame_length:
+                return None
+            if calc_checksum(buffer[14:frame_length - 2]) != CHECKSUM.unpack_from(buffer, frame_length - 2)[0]:
+                self._drop_start_byte()
+                continue
+
+            frame = decode_frame(buffer[:frame_length])
+            del buffer[:frame_length]
+            return frame
+
+    # Drop the start byte of a frame that failed its checksums or its length, to look for the next one
+    def _drop_start_byte(self):
+        """Drop the start byte of a frame that failed its checksums or its length, to look for the next one"""
+
+        del self.buffer[0]
+        self.dropped_bytes += 1
+        self.checksum_errors += 1
+
+
+# Records the bytes sent and received by a session in a capture file
+class CaptureWriter:
+
+    """Records the bytes sent and received by a session in a capture file\n
+    The file starts with CAPTURE_MAGIC, followed by one record per write or read of the port:
+    a CAPTURE_RECORD header (time.time(), CAPTURE_TX or CAPTURE_RX, length) and the bytes.
+    Records are appended through a buffered file, the writer can be shared by several threads."""
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "ab")
+        self.lock = threading.Lock()
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Append the bytes of one direction
+    def write(self, direction, data):
+        """Append the bytes of one direction"""
+
+        with self.lock:
+            self.file.write(CAPTURE_RECORD.pack(time.time(), direction, len(data)))
+            self.file.write(data)
+
+    # Close the capture file
+    def close(self):
+        """Close the capture file"""
+
+        with self.lock:
+            self.file.close()
+
+
+# Return every (timestamp, direction, data) record of a capture file
+def read_capture(file_name):
+    
+    """Return every (timestamp, direction, data) record of a capture file\n
+    The file is memory-mapped, the records are read one after the other without loading the whole file."""
+
+    if debug : print(" --- read_capture")
+
+    import mmap
+    with open(file_name, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as capture:
+            if capture[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+                raise FrameError(f"{file_name} isn't a capture file")
+            offset = len(CAPTURE_MAGIC)
+            end = len(capture)
+            while offset + CAPTURE_RECORD.size <= end:
+                timestamp, direction, length = CAPTURE_RECORD.unpack_from(capture, offset)
+                offset += CAPTURE_RECORD.size
+                yield timestamp, direction, capture[offset:offset + length]
+                offset += length
+
+
+# Decode the frames of a capture file, return (timestamp, direction, "Frame") for each of them
+def replay_capture(file_name, directions=(CAPTURE_TX, CAPTURE_RX)):
     
-    hex_start = 'aa'            # Start byte is always "AA"
-    hex_frame_flags = '00'
-    hex_src_addr = convert_int32_to_hex(src_addr, 4)
-    hex_dst_addr = convert_int32_to_hex(dst_addr, 4)
-    hex_service_flags = '00'    # Specify that it's not a response nor an error
-    hex_service_id = '02'       # Specify that the frame use the "write_property" service
-    hex_object_type = convert_int32_to_hex(object_type, 2)
-    hex_object_id = convert_int32_to_hex(object_id, 4)
-    hex_property_id = convert_int32_to_hex(property_id, 2)    
-    hex_property_data = convert_to_hex_from_format(property_data, format)
+    """Decode the frames of a capture file, return (timestamp, direction, "Frame") for each of them\n
+    Each direction has its own "FrameParser", the timestamp of a frame is the one of its last bytes.
+    The property_data of the frames are bytes, see decode_property_data"""
+
+    if debug : print(" --- replay_capture")
+
+    parsers = {direction: FrameParser() for direction in directions}
+    for timestamp, direction, data in read_capture(file_name):
+        parser = parsers.get(direction)
+        if parser is not None:
+            for frame in parser.feed(data):
+                yield timestamp, direction, frame
+
+
+# Serial port that answers with the bytes received in a capture
+class CaptureReplayPort:
+
+    """Serial port that answers with the bytes received in a capture\n
+    A request written gets the bytes received after the same request in the capture, the
+    next time it was sent. The capture is read as far as needed to find it, so requests can
+    come in another order than they were recorded. A request that isn't in the capture
+    gets nothing. read() waits up to timeout when there's nothing to read, like a serial port."""
+
+    def __init__(self, file_name, timeout=READ_POLL_INTERVAL):
+        self.timeout = timeout
+        self.records = read_capture(file_name)
+        self.next_record = next(self.records, None)
+        self.responses = {}             # Bytes received after each request read from the capture but not yet written
+        self.rx_data = bytearray()      # Bytes that can be read
+
+    # Make the bytes received after the same request of the capture readable
+    def write(self, data):
+        """Make the bytes received after the same request of the capture readable"""
+
+        data = bytes(data)
+        while not self.responses.get(data) and self._read_exchange():
+            pass
+        if self.responses.get(data):
+            self.rx_data += self.responses[data].popleft()
+        return len(data)
+
+    # Read the next request of the capture and the bytes received after it, False at the end of the capture
+    def _read_exchange(self):
+        """Read the next request of the capture and the bytes received after it, False at the end of the capture"""
+
+        # Bytes received before any request are line noise
+        while self.next_record is not None and self.next_record[1] != CAPTURE_TX:
+            self.next_record = next(self.records, None)
+        if self.next_record is None:
+            return False
+        request = bytes(self.next_record[2])
+        response = bytearray()
+        self.next_record = next(self.records, None)
+        while self.next_record is not None and self.next_record[1] != CAPTURE_TX:
+            response += self.next_record[2]
+            self.next_record = next(self.records, None)
+        self.responses.setdefault(request, collections.deque()).append(bytes(response))
+        return True
+
+    # Return up to size bytes, empty bytes after timeout if there's none
+    def read(self, size=1):
+        """Return up to size bytes, empty bytes after timeout if there's none"""
+
+        if not self.rx_data:
+            time.sleep(self.timeout)
+            return b""
+        data = bytes(self.rx_data[:size])
+        del self.rx_data[:size]
+        return data
+
+    # Drop the bytes that weren't read
+    def reset_input_buffer(self):
+        """Drop the bytes that weren't read"""
+
+        self.rx_data.clear()
+
+    # Close the capture file
+    def close(self):
+        """Close the capture file"""
+
+        self.records.close()
+
+
+# Share one session between many local clients, its requests are sent one at a time by priority
+class ScomBroker:
+
+    """Share one session between many local clients, its requests are sent one at a time by priority\n
+    The broker listens on "tcp://host:port" or "unix:///path/of/socket". A client sends request
+    frames and gets the response frames in the same order, as if it was connected to the Xcom-232i
+    itself: a session uses the broker as its port (see "BrokerPort"). Writes are sent before the
+    reads waiting for their turn. A read that's already waiting or being sent isn't sent again, its
+    response is given to every client that asked for it (see "SingleFlight"). Give the session a "PropertyCache" to
+    answer recent reads without sending them. When the Xcom-232i doesn't answer, the client gets
+    the error RESPONSE_TIMEOUT instead of waiting for its own timeout."""
+
+    def __init__(self, session, address=DEFAULT_BROKER_ADDRESS):
+        self.session = session
+        self.address = address
+        self.requests = queue.PriorityQueue()   # (priority, sequence, tx_frame, future) of the requests waiting for their turn
+        self.sequence = itertools.count()       # Keeps the requests of the same priority in the order they came
+        self.single_flight = SingleFlight()     # Identical reads share the response of the first one
+        self.stop_event = threading.Event()
+        self.sent_requests = 0      # Requests sent to the Xcom-232i
+        self.cached_requests = 0    # Reads answered by the cache of the session, without being sent
+        self.socket = open_listening_socket(address)
+
+    # Accept clients and send their requests until stop() is called
+    def run(self):
+        """Accept clients and send their requests until stop() is called\n
+        The clients are served by background threads, the session is only used by the calling thread.
+        An unexpected error of a request is raised by its future, a client gets RESPONSE_TIMEOUT instead."""
+
+        if debug : print(" --- ScomBroker.run")
+
+        threading.Thread(target=self._accept, name=f"broker {self.address}", daemon=True).start()
+        while not self.stop_event.is_set():
+            try:
+                priority, sequence, tx_frame, future = self.requests.get(timeout=READ_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            try:
+                future.set_result(self._transact(tx_frame))
+            except Exception as e:
+                # An unexpected error only fails its own request, the next ones are still sent
+                future.set_exception(e)
+
+    # Number of reads answered with the response of an identical read
+    @property
+    def merged_requests(self):
+        return self.single_flight.shared_calls
+
+    # Send a request when its turn comes and return its response, can be called from any thread
+    def request(self, tx_frame):
+        """Send a request when its turn comes and return its response, can be called from any thread\n
+        A read identical to one waiting or being sent gets the same response."""
+
+        tx_frame = bytes(tx_frame)
+        if is_txFrame_read(tx_frame):
+            return self.single_flight.do(tx_frame, lambda: self.submit(tx_frame).result())
+        return self.submit(tx_frame).result()
+
+    # Queue a request, return the "concurrent.futures.Future" of its response
+    def submit(self, tx_frame):
+        """Queue a request, return the "concurrent.futures.Future" of its response"""
+
+        import concurrent.futures
+        future = concurrent.futures.Future()
+        priority = BROKER_PRIORITY_READ if is_txFrame_read(tx_frame) else BROKER_PRIORITY_WRITE
+        self.requests.put((priority, next(self.sequence), bytes(tx_frame), future))
+        return future
+
+    # Stop sending the requests, can be called from any thread
+    def stop(self):
+        """Stop sending the requests, can be called from any thread"""
+
+        self.stop_event.set()
+
+    # Stop accepting clients, the requests left get no response
+    def close(self):
+        """Stop accepting clients, the requests left get no response"""
+
+        self.stop()
+        self.socket.close()
+        if self.address.startswith("unix://"):
+            with contextlib.suppress(OSError):
+                os.remove(self.address[len("unix://"):])
+        while not self.requests.empty():
+            self.requests.get()[3].set_result(b"")
+
+    # Send a request with the session, return its response or an error response if there's none
+    def _transact(self, tx_frame):
+        """Send a request with the session, return its response or an error response if there's none"""
+
+        import serial
+        cache = self.session.cache
+        hits = 0 if cache is None else cache.hits
+        try:
+            return bytes(self.session.transact(tx_frame))
+        except ScomResponseError as e:
+            return bytes(e.frame)
+        except FrameError:
+            error_code = ERROR_INVALID_FRAME
+        except ScomError:
+            error_code = ERROR_RESPONSE_TIMEOUT
+        except (serial.SerialException, OSError):
+            # The port is opened again by the next request
+            self.session.close()
+            error_code = ERROR_RESPONSE_TIMEOUT
+        finally:
+            if cache is not None and cache.hits > hits:
+                self.cached_requests += 1
+            else:
+                self.sent_requests += 1
+        return self._error_response(tx_frame, error_code)
+
+    # Build the response of the gateway answering the given error to a request
+    def _error_response(self, tx_frame, error_code):
+        """Build the response of the gateway answering the given error to a request"""
+
+        request = decode_frame(tx_frame)
+        rx_frame = bytearray(FRAME_OVERHEAD + ERROR_CODE.size)
+        encode_frame_into(rx_frame, request.dest_addr, request.src_addr, request.service_id, request.object_type, request.object_id,
+                          request.property_id, ERROR_CODE.pack(error_code), SERVICE_FLAG_RESPONSE | SERVICE_FLAG_ERROR)
+        return bytes(rx_frame)
+
+    # Serve every new client in its own thread
+    def _accept(self):
+        """Serve every new client in its own thread"""
+
+        import socket
+        while not self.stop_event.is_set():
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                return
+            if connection.family != socket.AF_UNIX:
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    # Answer the requests of a client until it's gone
+    def _serve(self, connection):
+        """Answer the requests of a client until it's gone"""
+
+        parser = FrameParser()
+        with connection:
+            try:
+                while True:
+                    data = connection.recv(4096)
+                    if not data:
+                        return
+                    # Pipelined requests are answered in the same order
+                    for frame in parser.feed(data):
+                        try:
+                            rx_frame = self.request(frame.full_frame)
+                        except Exception:
+                            # The client still gets a response for each of its requests
+                            rx_frame = self._error_response(frame.full_frame, ERROR_RESPONSE_TIMEOUT)
+                        connection.sendall(rx_frame)
+            except OSError:
+                pass
+
+
+# Serial port that sends the frames through a "ScomBroker"
+class BrokerPort:
+
+    """Serial port that sends the frames through a "ScomBroker"\n
+    address is "tcp://host:port" or "unix:///path/of/socket". read() waits up to timeout
+    when there's nothing to read, like a serial port."""
+
+    def __init__(self, address, timeout=READ_POLL_INTERVAL):
+        self.timeout = timeout
+        self.socket = connect_socket(address)
+        self.socket.settimeout(timeout)
+
+    # Send the bytes to the broker
+    def write(self, data):
+        """Send the bytes to the broker"""
+
+        self.socket.sendall(data)
+        return len(data)
+
+    # Return up to size bytes, empty bytes after timeout if there's none
+    def read(self, size=1):
+        """Return up to size bytes, empty bytes after timeout if there's none"""
+
+        import socket
+        try:
+            return self.socket.recv(size)
+        except socket.timeout:
+            return b""
 
-    # Calculate the number of byte in the frame_data
-    data_size = int((len(hex_service_flags) + len(hex_service_id) + len(hex_object_type) + len(hex_object_id) + len(hex_property_id) + len(hex_property_data)) / 2)
-    hex_data_size = convert_int32_to_hex(data_size, 2)
-    # Put together the bytes use to calculate the header and data checksum
-    header_hex = hex_frame_flags + hex_src_addr + hex_dst_addr + hex_data_size    
-    data_hex = hex_service_flags + hex_service_id + hex_object_type + hex_object_id + hex_property_id + hex_property_data
+    # Drop the bytes that weren't read
+    def reset_input_buffer(self):
+        """Drop the bytes that weren't read"""
+
+        self.socket.setblocking(False)
+        try:
+            while self.socket.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        finally:
+            self.socket.settimeout(self.timeout)
+
+    # Close the connection to the broker
+    def close(self):
+        """Close the connection to the broker"""
+
+        self.socket.close()
+
+
+# Open a socket listening on "tcp://host:port" or "unix:///path/of/socket"
+def open_listening_socket(address):
+    
+    """Open a socket listening on "tcp://host:port" or "unix:///path/of/socket\""""
+
+    import socket
+    scheme, _, location = address.partition("://")
+    if scheme == "unix":
+        # A socket file left by a broker that didn't stop properly
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(location)
+        listening_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listening_socket.bind(location)
+        listening_socket.listen()
+        return listening_socket
+    if scheme == "tcp":
+        host, _, port = location.rpartition(":")
+        return socket.create_server((host, int(port)))
+    raise ValueError(f"unknown address {address}, expected tcp://host:port or unix:///path/of/socket")
+
+
+# Connect to "tcp://host:port" or "unix:///path/of/socket"
+def connect_socket(address):
     
-    # Calculate both checksum
-    hex_header_checksum = calc_checksum(header_hex, len(header_hex))
-    hex_data_checksum = calc_checksum(data_hex, len(data_hex))    
+    """Connect to "tcp://host:port" or "unix:///path/of/socket\""""
+
+    import socket
+    scheme, _, location = address.partition("://")
+    if scheme == "unix":
+        client_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client_socket.connect(location)
+        return client_socket
+    if scheme == "tcp":
+        host, _, port = location.rpartition(":")
+        client_socket = socket.create_connection((host, int(port)))
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client_socket
+    raise ValueError(f"unknown address {address}, expected tcp://host:port or unix:///path/of/socket")
+
+
+# Build the frame from the command's parameters to use the "read_property" service
+def encode_read_request(src_addr, dst_addr, object_type, object_id, property_id, property_data=None):    
+    """Build the frame from the command's parameters to use the "read_property" service"""
 
-    # Put together all the string of HEX value to build the frame
-    frame_request = hex_start + hex_frame_flags + hex_src_addr + hex_dst_addr + hex_data_size + str(hex(hex_header_checksum))[2:]
-    frame_request += hex_service_flags + hex_service_id + hex_object_type + hex_object_id + hex_property_id + hex_property_data + str(hex(hex_data_checksum))[2:]
+    # Only the multi-info service has property data in a read request
+    data = b"" if property_data is None else encode_multi_info(property_data)
+
+    frame_request = bytearray(FRAME_OVERHEAD + len(data))
+    encode_frame_into(frame_request, src_addr, dst_addr, SERVICE_READ_PROPERTY, object_type, object_id, property_id, data)
+    return bytes(frame_request)
+
+
+# Build the frame from the command's parameters to use the "write_property" service
+def encode_write_request(src_addr, dst_addr, object_type, object_id, property_id, property_data, format=None):
+    """Build the frame from the command's parameters to use the "write_property" service\n
+    Without a format, the property is encoded with the one of its object in the catalog."""
+
+    if format is None:
+        data = require_catalog_object(object_type, object_id, property_id).encode(property_data)
+    else:
+        data = encode_property_data(property_data, format)
 
-    return frame_request
+    frame_request = bytearray(FRAME_OVERHEAD + len(data))
+    encode_frame_into(frame_request, src_addr, dst_addr, SERVICE_WRITE_PROPERTY, object_type, object_id, property_id, data)
+    return bytes(frame_request)
 
 
-# Convert multi-info parameter into their HEX value
+# Write a whole frame into the given buffer and return its length
+def encode_frame_into(buffer, src_addr, dst_addr, service_id, object_type, object_id, property_id, property_data=b"", service_flags=0):
+    """Write a whole frame into the given buffer and return its length\n
+    The buffer must be at least FRAME_OVERHEAD + len(property_data) bytes long.
+    It can be reused from one frame to the next to avoid any allocation.
+    service_flags is 0 for a request: it's not a response nor an error."""
+
+    data_length = SERVICE_HEADER.size + len(property_data)
+    data_end = FRAME_HEADER.size + CHECKSUM.size + data_length
+
+    with memoryview(buffer) as view:
+        # Header, followed by its checksum
+        FRAME_HEADER.pack_into(view, 0, START_BYTE, 0, src_addr, dst_addr, data_length)
+        CHECKSUM.pack_into(view, 12, calc_checksum(view[1:12]))
+        # Service data, followed by its checksum
+        SERVICE_HEADER.pack_into(view, 14, service_flags, service_id, object_type, object_id, property_id)
+        view[24:data_end] = property_data
+        CHECKSUM.pack_into(view, data_end, calc_checksum(view[14:data_end]))
+
+    return data_end + CHECKSUM.size
+
+
+# Convert a value to the bytes of the given format
+def encode_property_data(data, format):
+    """Convert a value to the bytes of the given format"""
+
+    format = format.lower()
+    try:
+        if format == "float":
+            return PROPERTY_FORMATS[format].pack(float(data))
+        return PROPERTY_FORMATS[format].pack(int(data))
+    except (KeyError, ValueError, TypeError, struct.error) as e:
+        raise FrameError(f"{data!r} can't be encoded as {format}: {e}") from e
+
+
+# Convert multi-info parameter into their bytes
 def encode_multi_info(original_str):
     
-    """Convert multi-info parameter into their HEX value"""
+    """Convert multi-info parameter into their bytes"""
 
     if debug :
         print(" --- encode_multi_info")
@@ -343,72 +3059,93 @@ def encode_multi_info(original_str):
         print("\tencode original string passed : ",original_str)
         print("\t********** debug data end ***********")
 
-    hex_data = ""
+    import re
     # Delete all ( ) in the string passed as parameter
     original_str = original_str.replace("(", "").replace(")", "")
 
     # Split the string at ":" and "," to get list with only datas
     all_datas = re.split(r'[:,]', original_str)
 
-    # Browse the previously initiated list
+    # Browse the previously initiated list, user info references and assemblies are placed one after the other
     try:
-        for index, data in enumerate(all_datas):
-            # Assemblies are placed every two items of the list. 
-            if index % 2 == 1:
-                # Convert Assembly text to hex
-                hex_data += convert_int32_to_hex(convert_assembly_to_id(data), 1)
-            else:
-                hex_data += convert_int32_to_hex(int(data), 2)
-        return hex_data
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
+        items = [(int(all_datas[index]), convert_assembly_to_id(all_datas[index + 1])) for index in range(0, len(all_datas) - 1, 2)]
+        return encode_multi_info_items(items)
+    except (IndexError, ValueError, TypeError, struct.error) as e:
+        raise FrameError(f"invalid multi-info request {original_str!r}: {e}") from e
 
 
-# Turn the returned frame into an instance of the "Frame" dataclass
-def decode_response_frame(frame, format, is_read):  
+# Convert a list of (user info reference, assembly id) into the bytes of a multi-info request
+def encode_multi_info_items(items):
     
-    """Turn the returned frame into an instance of the "Frame" dataclass"""
+    """Convert a list of (user info reference, assembly id) into the bytes of a multi-info request"""
 
-    if debug : print(" --- decode_response_frame")
+    data = bytearray(MULTI_INFO_REQUEST_ITEM.size * len(items))
+    for index, (info_ref, assembly_id) in enumerate(items):
+        MULTI_INFO_REQUEST_ITEM.pack_into(data, index * MULTI_INFO_REQUEST_ITEM.size, info_ref, assembly_id)
+    return bytes(data)
 
-    format = format.lower()    
-    # Decode in the right format the part of the frame that correspond each variable
-    src_addr = struct.unpack("<i", bytes.fromhex(frame[4:12].zfill(8)))[0]
-    dest_addr = struct.unpack("<i", bytes.fromhex(frame[12:20].zfill(8)))[0]
-    data_length = struct.unpack("<h", bytes.fromhex(frame[20:24].zfill(4)))[0]
-    object_type = struct.unpack("<h", bytes.fromhex(frame[32:36].zfill(4)))[0]
-    object_id = struct.unpack("<i", bytes.fromhex(frame[36:44].zfill(8)))[0]
-    property_id = struct.unpack("<h", bytes.fromhex(frame[44:48].zfill(4)))[0]
 
-    # This will decode the property data in the given format
-    if check_format(format):
-        # Decode for bool format
-        try:
-            if format == "bool":
-                data_bool = struct.unpack("<b", bytes.fromhex(frame[48:50]))[0]
-                property_data = None
-                if data_bool == 0:
-                    property_data = False
-                elif data_bool == 1:
-                    property_data = True
-            # Decode for short_enum format
-            elif format == "short_enum" or format == "long_enum" and not is_read or format == "int32" and not is_read:
-                property_data = struct.unpack("<h", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(4)))[0]
-            # Decode for long_enum format
-            elif format == "long_enum" and is_read or format == "int32" and is_read:
-                property_data = struct.unpack("<i", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(4)))[0]
-            # Decode for float format
-            elif format == "float":
-                property_data = struct.unpack("<f", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(8)))[0]
-            # Decode for byte_stream format
-            elif format == "byte_stream":
-                property_data = decode_byte_stream(frame[48:(48 + (data_length - 10) * 2)])
-            
-            return Frame(src_addr, dest_addr, data_length - 10, object_type, object_id, property_id, property_data, frame)
-        except Exception as e:
-            print(e.message if hasattr(e, 'message') else e)
-            exit()
+# Turn the given frame into an instance of the "Frame" dataclass, its property_data are left as bytes
+def decode_frame(frame):
+    
+    """Turn the given frame into an instance of the "Frame" dataclass, its property_data are left as bytes\n
+    Every field of the header and of the service is read at once.
+    Raise a FrameError if the frame is too short to hold a service"""
+
+    try:
+        (start_byte, frame_flags, src_addr, dest_addr, data_length, header_checksum_a, header_checksum_b,
+         service_flags, service_id, object_type, object_id, property_id) = FRAME_LAYOUT.unpack_from(frame)
+    except struct.error as e:
+        raise FrameError(f"the frame is too short: {e}") from e
+    if data_length < SERVICE_HEADER.size:
+        raise FrameError(f"the data_length {data_length} is shorter than a service")
+    property_data = bytes(frame[FRAME_LAYOUT.size:FRAME_HEADER.size + CHECKSUM.size + data_length])
+
+    return Frame(src_addr, dest_addr, data_length - SERVICE_HEADER.size, object_type, object_id, property_id, property_data, bytes(frame), service_flags, service_id)
+
+
+# Decode the bytes of a property in the given format
+def decode_property_data(data, format):
+    
+    """Decode the bytes of a property in the given format\n
+    Return None if there's no data"""
+
+    if not data:
+        return None
+    # Only 0 and 1 are valid boolean values
+    if format == "bool":
+        return {0: False, 1: True}.get(data[0])
+    if format == "byte_stream":
+        return decode_byte_stream(data)
+    if format in PROPERTY_FORMATS:
+        return PROPERTY_FORMATS[format].unpack_from(data)[0]
+    # Formats without a fixed layout are kept as bytes
+    return bytes(data)
+
+
+# Turn the returned frame into an instance of the "Frame" dataclass
+def decode_response_frame(frame, format=None, is_read=True):  
+    
+    """Turn the returned frame into an instance of the "Frame" dataclass\n
+    The property_data of an error response is its error code.
+    Without a format, the property is decoded with the one of its object in the catalog."""
+
+    if format is not None:
+        format = format.lower()
+        if not check_format(format):
+            raise FrameError(f"unknown format {format}")
+
+    try:
+        response = decode_frame(frame)
+        if response.service_flags & SERVICE_FLAG_ERROR:
+            response.property_data = ERROR_CODE.unpack_from(response.property_data)[0]
+        elif format is None:
+            response.property_data = require_catalog_object(response.object_type, response.object_id, response.property_id).decode(response.property_data)
+        else:
+            response.property_data = decode_property_data(response.property_data, format)
+        return response
+    except (ValueError, struct.error) as e:
+        raise FrameError(f"the response can't be decoded as {format}: {e}") from e
 
     
 # Turn the sended frame into an instance of the "Frame" dataclass
@@ -416,66 +3153,53 @@ def decode_request_frame(frame, format, read_request):
     
     """Turn the sended frame into an instance of the "Frame" dataclass"""
 
-    if debug : print(" --- decode_request_frame")
-
-    # Decode in the right format the part of the frame that correspond each variable
-    src_addr = struct.unpack("<i", bytes.fromhex(frame[4:12]))[0]
-    dest_addr = struct.unpack("<i", bytes.fromhex(frame[12:20]))[0]
-    data_length = struct.unpack("<h", bytes.fromhex(frame[20:24]))[0]
-    object_type = struct.unpack("<h", bytes.fromhex(frame[32:36]))[0]
-    object_id = struct.unpack("<i", bytes.fromhex(frame[36:44]))[0]
-    property_id = struct.unpack("<h", bytes.fromhex(frame[44:48]))[0]
-    # A frame using the "read_property" service isn't supposed to have "property_data" bytes
-    if not read_request:
-        try:
-            if check_format(format):
-                # Decode for bool format
-                if format == "bool":
-                    data_bool = struct.unpack("<b", bytes.fromhex(frame[48:50]))[0]
-                    property_data = None
-                    if data_bool == 0:
-                        property_data = False
-                    elif data_bool == 1:
-                        property_data = True
-                # Decode for enum format
-                elif format == "short_enum":
-                    property_data = struct.unpack("<h", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(4)))[0]
-                elif format == "long_enum":
-                    property_data = struct.unpack("<i", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(4)))[0]
-                # Decode for float format
-                elif format == "float":
-                    property_data = struct.unpack("<f", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(8)))[0]
-                # Decode for int format    
-                elif format == "int32":
-                    property_data = struct.unpack("<i", bytes.fromhex(frame[48:(48 + (data_length - 10) * 2)].zfill(8)))[0]
-        except Exception as e:
-            print(e.message if hasattr(e, 'message') else e)
-            exit()
-    else: 
-        # Nullify the property_data if it isn't a write request
-        property_data = None
-
-    return Frame(src_addr, dest_addr, data_length - 10, object_type, object_id, property_id, property_data, frame)
-
-
-# Decode the response's byte_stream to a formated string of it's data
-def decode_byte_stream(byte_stream):
-    
-    """Decode the response's byte_stream to a formated string of it's data"""
+    try:
+        request = decode_frame(frame)
+        # A frame using the "read_property" service isn't supposed to have "property_data" bytes
+        if not read_request and check_format(format):
+            request.property_data = decode_property_data(request.property_data, format.lower())
+        else:
+            # Nullify the property_data if it isn't a write request
+            request.property_data = None
+    except (ValueError, struct.error) as e:
+        raise FrameError(f"the request can't be decoded as {format}: {e}") from e
+
+    return request
 
-    if debug : print(" --- decode_byte_stream")
 
-    # The 16th first characters (8th first bytes) don't correspond to the datas and their values
-    result_data = byte_stream[16:]
-    # Split the remaining characters every 14 characters (length of a data)
-    all_data_splited = [result_data[i:i+14] for i in range(0, len(result_data), 14)]
+# Decode the response's byte_stream into a "MultiInfoResult"
+def decode_byte_stream(byte_stream):
+    
+    """Decode the response's byte_stream into a "MultiInfoResult"\n
+    The 8 bytes context is read at once and every 7 bytes value with a single iter_unpack"""
+
+    import datetime
+    xcom_flags, devices_flags, reserved, timestamp = MULTI_INFO_CONTEXT.unpack_from(byte_stream)
+    records = MULTI_INFO_RESPONSE_ITEM.iter_unpack(byte_stream[MULTI_INFO_CONTEXT.size:])
+    info_refs, aggregations, values = list(zip(*records)) or ((), (), ())
+
+    return MultiInfoResult(
+        datetime.datetime.fromtimestamp(timestamp),
+        "Xcom-GSM" if xcom_flags & 0b00001000 else "Xcom-LAN",
+        xcom_flags & 0b00001111,        # The 4 LSB are the current version
+        bool(xcom_flags & 0b00000100),
+        bool(xcom_flags & 0b00000010),
+        bool(xcom_flags & 0b00000001),
+        bool(devices_flags & 0b10000000),
+        array.array("H", info_refs),
+        array.array("B", aggregations),
+        array.array("f", values),
+    )
+
+
+# Format the values of a "MultiInfoResult" into a string, one value per line
+def format_byte_stream(result):
+    
+    """Format the values of a "MultiInfoResult" into a string, one value per line"""
 
     returned_string = "\n"
-    for datas in all_data_splited:
-        hex_info_ref = struct.unpack("<h", bytes.fromhex(datas[0:4]))[0]
-        hex_aggreg = struct.unpack(">h", bytes.fromhex(datas[4:6].zfill(4)))[0]
-        hex_value = struct.unpack("<f", bytes.fromhex(datas[6:14].zfill(8)))[0]
-        returned_string += f"Information reference: {hex_info_ref}\t| Aggregation: {convert_id_to_assembly(hex_aggreg)}\t| Value : {hex_value}\n"
+    for info_ref, aggregation, value in result:
+        returned_string += f"Information reference: {info_ref}\t| Aggregation: {convert_id_to_assembly(aggregation)}\t| Value : {value}\n"
 
     return returned_string
 
@@ -508,8 +3232,8 @@ def show_resume(tx_frame, rx_frame, format, ctx):
     if verb==3:        
         show_tx_info += "send property request: \n"
         show_rx_info += "response: \n"
-        show_tx_frame = get_hex_resume(tx_frame.full_frame)
-        show_rx_frame = get_hex_resume(rx_frame.full_frame)
+        show_tx_frame = get_hex_resume(tx_frame.full_frame.hex())
+        show_rx_frame = get_hex_resume(rx_frame.full_frame.hex())
 
     # Doesn't show the property_data of the sended frame if it's empty. Otherwise it show the hex value of it
     property_data = "" if tx_frame.property_data is None else get_hex_resume(convert_to_hex_from_format(tx_frame.property_data, format))
@@ -519,20 +3243,16 @@ def show_resume(tx_frame, rx_frame, format, ctx):
         show_tx_info += f"device_addr={tx_frame.dest_addr}{separator_char}object_type={tx_frame.object_type}{separator_char}object_id={tx_frame.object_id}{separator_char}"
         show_tx_info += f"property_id={tx_frame.property_id}{separator_char}length={tx_frame.data_length}{separator_char}data={separator_char}{property_data} \n"
     
-    try:
-        # Doesn't show the property_data of the returned frame if it's empty. Otherwise it show it's value
-        property_data = "" if rx_frame.property_data is None else rx_frame.property_data
-    
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
-    
+    # Doesn't show the property_data of the returned frame if it's empty. Otherwise it show it's value
+    property_data = "" if rx_frame.property_data is None else rx_frame.property_data
+    if isinstance(property_data, MultiInfoResult):
+        property_data = format_byte_stream(property_data)
 
     # Check if the returned frame don't contain any error
     if not check_frame_has_error(rx_frame.full_frame):
 
         if format.lower() == "byte_stream" and verb == 3:
-            print(get_byte_stream_context(rx_frame.full_frame[48:(48 + (rx_frame.data_length - 10) * 2)]))
+            print(get_byte_stream_context(rx_frame.property_data))
 
         #Only show the property data if the verbose level is on 0
         if verb >= 1:
@@ -589,6 +3309,48 @@ def get_hex_resume(frame):
     return trame_resume
 
 
+# Return the error code of the given frame, None if it isn't an error response
+def get_error_code(frame):
+    
+    """Return the error code of the given frame, None if it isn't an error response"""
+
+    if not check_frame_has_error(frame):
+        return None
+    return ERROR_CODE.unpack_from(frame, FRAME_LAYOUT.size)[0]
+
+
+# Raise the "ScomResponseError" of the error code answered in the given frame, if any
+def raise_for_error(frame):
+    
+    """Raise the "ScomResponseError" of the error code answered in the given frame, if any"""
+
+    error_code = get_error_code(frame)
+    if error_code is not None:
+        raise ERROR_EXCEPTIONS.get(error_code, ScomResponseError)(error_code, bytes(frame))
+
+
+# Find the request in flight that the given response answers
+def match_response(response, requests, in_flight):
+    
+    """Find the request in flight that the given response answers\n
+    requests: the decoded request frames
+    in_flight: the indexes of the requests waiting for a response, the oldest first\n
+    The response comes from the request's dst_addr and has the same object_type, object_id and property_id.
+    Multicast requests are answered by one of the devices, so if no address matches the oldest request
+    for the same object is used. Return None if no request matches"""
+
+    object_key = (response.object_type, response.object_id, response.property_id)
+    fallback = None
+    for index in in_flight:
+        request = requests[index]
+        if (request.object_type, request.object_id, request.property_id) == object_key:
+            if request.dest_addr == response.src_addr:
+                return index
+            if fallback is None:
+                fallback = index
+    return fallback
+
+
 # Return the error's name and description generated in the given frame
 def get_error(frame):
     
@@ -596,117 +3358,115 @@ def get_error(frame):
     error[0]: Error name (e.g: READ_PROPERTY_FAILED)\n
     error[1]: Error description (e.g: reading is possible, but failed)\n"""
 
-    if debug : print(" --- read_propertyget_error")
-
-    # It contains every existing error code with it's name and description 
-    all_errors =    {
-                        "0001": ["INVALID_FRAME", "malformed frame"],
-                        "0002": ["DEVICE_NOT_FOUND", "wrong dst_addr field"],
-                        "0003": ["RESPONSE_TIMEOUT", "no response of the server"],
-                        "0011": ["SERVICE_NOT_SUPPORTED", "wrong service_id field"],
-                        "0012": ["INVALID_SERVICE_ARGUMENT", "wrong service_data"],
-                        "0013": ["SCOM_ERROR_GATEWAY_BUSY", "gateway (for example XCOM-232i) busy"],
-                        "0021": ["TYPE_NOT_SUPPORTED", "the object_type requested doesn't exist"],
-                        "0022": ["OBJECT_ID_NOT_FOUND", "no object with this object_id was found"],
-                        "0023": ["PROPERTY_NOT_SUPPORTED", "the property identified by property_id doesn't exist"],
-                        "0024": ["INVALID_DATA_LENGTH", "the field property_data has an invalid number of bytes"],
-                        "0025": ["PROPERTY_IS_READ_ONLY", "a writing to this property is not allowed"],
-                        "0026": ["INVALID_DATA", "this value is impossible for this property"],
-                        "0027": ["DATA_TOO_SMALL", "the value is below the minimum limit"],
-                        "0028": ["DATA_TOO_BIG", "the value is above the maximum limit"],
-                        "0029": ["WRITE_PROPERTY_FAILED", "writing is possible, but failed"],
-                        "002A": ["READ_PROPERTY_FAILED", "reading is possible, but failed"],
-                        "002B": ["ACCESS_DENIED", "insufficient user access"],
-                        "002C": ["SCOM_ERROR_OBJECT_NOT_SUPPORTED", "this object id, through existant, is not supported by the current implementation of the gateway"],
-                        "002D": ["SCOM_ERROR_MULTICAST_READ_NOT_SUPPORTED", "Read operation is not supported when used on multicast adresses."],
-                        "002E": ["OBJECT_PROPERTY_INVALID", "During a file transfer, the use of this property was unexpected"],
-                        "002F": ["FILE_OR_DIR_NOT_PRESENT", "Attempt to download a file not present on the sd card"],
-                        "0030": ["FILE_CORRUPTED", "A read error ocurred during the download of a file"],
-                        "0081": ["INVALID_SHELL_ARG", "the command line tool used received the wrong arguments"]
-                    }
-    # Find the error code (in HEX) in the frame
-    error_code = frame[48:52][2:] + frame[48:52][:2]    
-    # Browse the "all_errors" dict and try to match 
-    # the error code from the given frame and
-    # one of the possible error code. 
-    # If there's a match, it return the error's name and description
-    for error in all_errors:
-        if error.upper() == error_code.upper():
-            return all_errors[error]
-
-
-# Decode the response's byte_stream to a formated string of it's data
-def get_byte_stream_context(byte_stream):
-    
-    """Decode the response's byte_stream to a formated string of it's data"""
+    # Find the error code in the frame
+    error_code = ERROR_CODE.unpack_from(frame, FRAME_LAYOUT.size)[0]
+    # If the error code is known, it return the error's name and description
+    return SCOM_ERRORS.get(error_code)
+
+
+# Format the context of a "MultiInfoResult" into a string
+def get_byte_stream_context(result):
+    
+    """Format the context of a "MultiInfoResult" into a string"""
 
     if debug : print(" --- get_byte_stream_context ")
 
-    # The 16th first characters (8th first bytes) don't correspond to the datas and their values
-    result_data = byte_stream[:16]
-    # The 8th first character contains the installation information
-    context_bytes = result_data[:8]
-    # The 8th last character contains the installation time
-    time_bytes = result_data[8:]
+    xcom_context = f"\n==={result.timestamp}===\n{result.xcom_type} version: {result.xcom_version}\n - Xt present: {result.xtender_present}\n - BSP present: {result.bsp_present}\n - Vt present: {result.variotrack_present}\n - VS present: {result.variostring_present}"
 
-    # Convert the datetime posix bytes to a datetime
-    datetime_posix = datetime.datetime.fromtimestamp(int(struct.unpack('<i', bytes.fromhex(time_bytes))[0])) 
+    return xcom_context
 
-    # Get the first and second bit of the installation's informations
-    fst_context_byte = [context_bytes[i:i+2] for i in range(0, len(context_bytes), 2)][0]
-    snd_context_byte = [context_bytes[i:i+2] for i in range(0, len(context_bytes), 2)][1]
 
-    byte_value = int(fst_context_byte, 16)      # Convert hex string of the first byte to integer
-    bit_string = format(byte_value, '08b')      # Convert int to binary string
-    fst_bits = [char for char in bit_string]    # Convert bits string into a list
+# Calculate the checksum for the given bytes
+def calc_checksum(data, length=None):
     
-    #the 4 LSB are the current version
-    xcom_version = int(byte_value & 0b00001111)
+    """Calculate the checksum for the given bytes, on the whole data if no length is given\n
+    A starts at 0xFF and adds each byte, B adds each successive value of A.
+    Both are only reduced to a byte at the end, so the running sums are built by
+    itertools.accumulate and there's no python loop over the bytes."""
 
-    byte_value = int(snd_context_byte, 16)      # Convert hex string of the second byte to integer
-    bit_string = format(byte_value, '08b')      # Convert int to binary string
-    snd_bits = [char for char in bit_string]    # Convert bits string into a list
-    
-    # Convert the value of bit to a corresponding boolean
-    for index in range(0, 8):
-        fst_bits[index] = True if int(fst_bits[index]) == 1 else False
-        snd_bits[index] = True if int(snd_bits[index]) == 1 else False
+    if length is not None:
+        data = data[:length]
 
-    if fst_bits[4]:
-        xcom = "Xcom-GSM"
-    else:
-        xcom = "Xcom-LAN"
-    
-    xcom_context = f"\n==={datetime_posix}===\n{xcom} version: {xcom_version}\n - Xt present: {fst_bits[5]}\n - BSP present: {fst_bits[6]}\n - Vt present: {fst_bits[7]}\n - VS present: {snd_bits[0]}"
+    # Every successive value of A, the first one is its initial value
+    all_A = list(itertools.accumulate(data, initial=0xFF))
+    A = all_A[-1] & 0xFF
+    B = (sum(all_A) - 0xFF) & 0xFF
 
-    return xcom_context
+    return (A << 8) | B
 
 
-# Calculate the checksum for the given data and length
-def calc_checksum(data, length):
+# Check the header and data checksums of many frames at once
+def verify_checksums(frames):
     
-    """Calculate the checksum for the given data and length"""
+    """Check the header and data checksums of many frames at once\n
+    frames can be a 2D numpy array of uint8 (one frame per row) or any sequence of frames as bytes.
+    Frames of the same length are checked together with numpy when it's installed.
+    Return two lists of booleans: (header_is_valid, data_is_valid)\n
+    A numpy array input returns two numpy arrays instead."""
 
-    if debug : print(" --- calc_checksum")    
+    if debug : print(" --- verify_checksums")
 
     try:
-        A = 0xFF
-        B = 0
-        # For each byte, it updates the variables A and B by performing bitwise operations. 
-        # It returns a value obtained by shifting the bits of A by 8 positions to the left 
-        # and performing a bitwise OR operation with B.
-        for i in range(0, length, 2):
-            value = data[i] + data[i + 1]
-            A = (A + int(value, 16)) & 0xFF
-            B = (B + A) & 0xFF
-
-        return (A << 8) | B
-    except ValueError as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None and isinstance(frames, numpy.ndarray):
+        return _verify_checksums_array(numpy, frames)
+
+    frames = list(frames)
+    header_is_valid = [False] * len(frames)
+    data_is_valid = [False] * len(frames)
+
+    # Group the frames by length, each group is a single 2D array
+    indexes_by_length = {}
+    for index, frame in enumerate(frames):
+        indexes_by_length.setdefault(len(frame), []).append(index)
+
+    for length, indexes in indexes_by_length.items():
+        if length < FRAME_OVERHEAD:
+            continue
+        if numpy is not None:
+            block = numpy.frombuffer(b"".join(frames[index] for index in indexes), dtype=numpy.uint8).reshape(len(indexes), length)
+            header_results, data_results = _verify_checksums_array(numpy, block)
+            header_results, data_results = header_results.tolist(), data_results.tolist()
+        else:
+            header_results = [calc_checksum(frames[index][1:12]) == CHECKSUM.unpack_from(frames[index], 12)[0] for index in indexes]
+            data_results = [FRAME_HEADER.unpack_from(frames[index])[4] + 16 == length and calc_checksum(frames[index][14:-2]) == CHECKSUM.unpack_from(frames[index], length - 2)[0] for index in indexes]
+        for index, header_result, data_result in zip(indexes, header_results, data_results):
+            header_is_valid[index] = header_result
+            data_is_valid[index] = data_result
+
+    return header_is_valid, data_is_valid
+
+
+# Check the checksums of every row of a 2D array of frames having the same length
+def _verify_checksums_array(numpy, frames):
+    
+    """Check the checksums of every row of a 2D array of frames having the same length"""
+
+    frames = numpy.asarray(frames, dtype=numpy.uint8)
+    length = frames.shape[1]
+    received_header_checksum = frames[:, 12].astype(numpy.int64) << 8 | frames[:, 13]
+    received_data_checksum = frames[:, -2].astype(numpy.int64) << 8 | frames[:, -1]
+    # The data_length field must match the length of the rows
+    data_length = frames[:, 10].astype(numpy.int64) | frames[:, 11].astype(numpy.int64) << 8
+
+    header_is_valid = _calc_checksum_array(numpy, frames[:, 1:12]) == received_header_checksum
+    data_is_valid = (data_length + 16 == length) & (_calc_checksum_array(numpy, frames[:, 14:length - 2]) == received_data_checksum)
+    return header_is_valid, data_is_valid
+
+
+# Calculate the checksum of every row of a 2D array of bytes
+def _calc_checksum_array(numpy, block):
+    
+    """Calculate the checksum of every row of a 2D array of bytes, see calc_checksum"""
+
+    length = block.shape[1]
+    weights = numpy.arange(length, 0, -1, dtype=numpy.int64)
+    A = (0xFF + block.sum(axis=1, dtype=numpy.int64)) & 0xFF
+    B = (0xFF * length + block.astype(numpy.int64) @ weights) & 0xFF
+    return A << 8 | B
 
 
 # Convert a float value to a HEX code
@@ -719,12 +3479,8 @@ def convert_float_to_hex(float_value):
     try:
         binary = struct.pack('<f', float_value)
         return binary.hex().zfill(8)
-    except ValueError as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
+    except (ValueError, TypeError, struct.error) as e:
+        raise FrameError(f"{float_value!r} isn't a float: {e}") from e
 
 
 # Convert a int value to a HEX code
@@ -736,12 +3492,8 @@ def convert_int32_to_hex(int_value, byte_length):
 
     try:
         return int_value.to_bytes(byte_length, byteorder='little').hex()
-    except ValueError as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
+    except (ValueError, TypeError, OverflowError) as e:
+        raise FrameError(f"{int_value!r} doesn't fit in {byte_length} bytes: {e}") from e
 
 
 # Convert a boolean value to a HEX code
@@ -754,12 +3506,8 @@ def convert_bool_to_hex(bool_value):
     try:
         binary = struct.pack('<?', bool_value)
         return binary.hex()    
-    except ValueError as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
-    except Exception as e:
-        print(e.message if hasattr(e, 'message') else e)
-        exit()
+    except (ValueError, TypeError, struct.error) as e:
+        raise FrameError(f"{bool_value!r} isn't a boolean: {e}") from e
 
 
 # Convert a value to a specified format
@@ -791,8 +3539,6 @@ def convert_assembly_to_id(assembly):
     
     """Get the given assembly's id"""
 
-    if debug : print("   --- convert_assembly_to_id")
-
     if assembly.lower() == "average":
         return 253
     elif assembly.lower() == "sum":
@@ -810,8 +3556,6 @@ def convert_id_to_assembly(id):
     
     """Get the given assembly's id"""
 
-    if debug : print("   --- convert_id_to_assembly")
-
     if id == 253:
         return "Average"
     elif id == 254:
@@ -829,20 +3573,101 @@ def is_txFrame_read(tx_frame):
 
     if debug : print(" --- is_txframe_read")
 
-    service_id = tx_frame[30:32]
-    if service_id == "01":
+    service_id = tx_frame[15]
+    if service_id == SERVICE_READ_PROPERTY:
         return True
-    elif service_id == "02":
+    elif service_id == SERVICE_WRITE_PROPERTY:
         return False
 
 
+# Return the family of devices the given object id belongs to, None if it's unknown
+def get_object_family(object_id):
+    
+    """Return the family of devices the given object id belongs to, None if it's unknown"""
+
+    for family in OBJECT_FAMILIES:
+        if family.first_id <= object_id <= family.last_id:
+            return family
+    return None
+
+
+_catalog = None     # Objects of the catalog by (object_type, object_id), loaded the first time one is needed
+
+
+# Read the objects of a catalog file, return them by (object_type, object_id)
+def load_catalog(file_name=CATALOG_FILE):
+    
+    """Read the objects of a catalog file, return them by (object_type, object_id)\n
+    The file is a csv with the columns: object_type, object_id, format, unit, minimum, maximum, name
+    Only the formats of a single value (bool, short_enum, long_enum, int32, float) can be used,
+    raise a ValueError for a row that can't be read"""
+
+    if debug : print(" --- load_catalog")
+
+    import csv
+    objects = {}
+    with open(file_name, newline="") as file:
+        for line_number, row in enumerate(csv.DictReader(file), 2):
+            try:
+                format = row["format"].lower()
+                if format not in PROPERTY_FORMATS:
+                    raise ValueError(f"the format {row['format']} of the object {row['object_id']} can't be used, expected one of {', '.join(PROPERTY_FORMATS)}")
+                number = float if format == "float" else int
+                minimum = number(row["minimum"]) if row["minimum"] else None
+                maximum = number(row["maximum"]) if row["maximum"] else None
+                obj = CatalogObject(int(row["object_type"]), int(row["object_id"]), format, row["unit"], minimum, maximum, row["name"])
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"{file_name} line {line_number}: {e}") from e
+            objects[(obj.object_type, obj.object_id)] = obj
+    return objects
+
+
+# Add the objects of a catalog file to the ones of the bundled catalog
+def extend_catalog(file_name):
+    
+    """Add the objects of a catalog file to the ones of the bundled catalog, they replace the bundled ones having the same id"""
+
+    get_catalog().update(load_catalog(file_name))
+
+
+# Return every object of the catalog by (object_type, object_id), the bundled file is read on the first call
+def get_catalog():
+    
+    """Return every object of the catalog by (object_type, object_id), the bundled file is read on the first call"""
+
+    global _catalog
+    if _catalog is None:
+        _catalog = load_catalog()
+    return _catalog
+
+
+# Return the object of the catalog having the given type and id, None if it isn't in the catalog
+def get_catalog_object(object_type, object_id, property_id=None):
+    
+    """Return the object of the catalog having the given type and id, None if it isn't in the catalog\n
+    With a property_id, None is also returned if that property doesn't have the format of the object"""
+
+    if property_id is not None and property_id not in CATALOG_PROPERTIES.get(object_type, ()):
+        return None
+    return get_catalog().get((object_type, object_id))
+
+
+# Return the object of the catalog a property is encoded with, raise a "FrameError" if there's none
+def require_catalog_object(object_type, object_id, property_id):
+    
+    """Return the object of the catalog a property is encoded with, raise a "FrameError" if there's none"""
+
+    obj = get_catalog_object(object_type, object_id, property_id)
+    if obj is None:
+        raise FrameError(f"no format given and the property {property_id} of the object {object_type}:{object_id} isn't in the catalog")
+    return obj
+
+
 # Check if the given format is usable
 def check_format(format_string):
     
     """Check if the given format is usable"""
 
-    if debug : print(" --- check_format") 
-
     formats = ["bool", "format", "enum", "short_enum", "long_enum", "error", "int32", "float", "string", "dynamic", "byte_stream"]
     if format_string.lower() in formats:
         return True
@@ -854,32 +3679,81 @@ def check_frame_has_error(frame):
     
     """Check if the given frame has an error"""
 
-    if debug : print(" --- check_frame_has_error")
-
-    service_flags = frame[28:30]
-    # If the frame has an error, the "service_flags" will always be "03"
-    if service_flags == "03":
+    service_flags = frame[14]
+    # If the frame has an error, the "service_flags" will always be 0x03
+    if service_flags == SERVICE_FLAG_RESPONSE | SERVICE_FLAG_ERROR:
         return True
-    elif service_flags == "02":
+    elif service_flags == SERVICE_FLAG_RESPONSE:
         return False
     
 
 # Check if the given port with the given baudrate can be opened
 def can_open_port(name, baudrate):
     # Check if the given port with the given baudrate can be opened
-    """Check if the given frame has an error"""
+    """Check if the given port with the given baudrate can be opened"""
 
     if debug : print(" --- can_open_port")
 
+    import serial
     try:
-        serial.serial_for_url(url=name, baudrate=baudrate, timeout=3, write_timeout=3, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1)
-        return True
-    except:
+        with serial.serial_for_url(url=name, baudrate=baudrate, timeout=3, write_timeout=3, bytesize=8, parity=serial.PARITY_EVEN, stopbits=1):
+            return True
+    except (serial.SerialException, OSError, ValueError):
         return False
 
 
+# Return the name of every serial port of the computer
+def list_serial_ports():
+    """Return the name of every serial port of the computer"""
+
+    if debug : print(" --- list_serial_ports")
+
+    import serial.tools.list_ports
+    return sorted(port.device for port in serial.tools.list_ports.comports())
+
+
+# Look for an Xcom-232i on a port, return its baudrate and devices
+def probe_port(port_name, baudrates=(38400, 115200), timeout=0.3):
+    """Look for an Xcom-232i on a port, return its baudrate and devices\n
+    A read of the battery voltage of the first Xtender is sent at each baudrate: any
+    response, even an error, means an Xcom-232i is there. Its devices are then listed
+    with "ScomSession.inventory". Return (None, {}) if nothing answered or the port can't be opened."""
+
+    if debug : print(" --- probe_port")
+
+    import serial
+    for baudrate in baudrates:
+        try:
+            with ScomSession(port_name, baudrate, timeout) as session:
+                if session.read_property(101, 1, 3000, 1, "float") is not None:
+                    return baudrate, session.inventory(timeout=timeout).devices
+        except (serial.SerialException, OSError, ValueError):
+            return None, {}
+    return None, {}
+
+
+# Probe many ports at once, return (port_name, baudrate, devices) for each of them
+def discover_ports(ports=None, baudrates=(38400, 115200), timeout=0.3):
+    """Probe many ports at once, return (port_name, baudrate, devices) for each of them\n
+    Every serial port of the computer is probed if ports is None. Each port is probed
+    by its own thread with "probe_port", the ports are returned in the given order."""
+
+    if debug : print(" --- discover_ports")
+
+    import concurrent.futures
+    ports = list_serial_ports() if ports is None else list(ports)
+    if not ports:
+        return []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        results = executor.map(lambda port_name: probe_port(port_name, baudrates, timeout), ports)
+        return [(port_name, *result) for port_name, result in zip(ports, results)]
+
+
 # Execute commands methode when executing this script
 if __name__ == '__main__':
-    commands()
+    try:
+        commands()
+    except ScomError as e:
+        raise SystemExit(f"Error: {e}")
     
 
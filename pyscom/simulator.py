@@ -0,0 +1,407 @@
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import threading
+import time
+import click
+from dataclasses import dataclass
+from typing import Union
+
+import pyscom
+
+
+
+
+# Dataclass used to store an object of the simulated installation
+@dataclass
+class SimulatedObject:
+    object_type : int       # 1: user info, 2: parameter
+    object_id : int
+    format : str
+    value : Union[int, float, bool]
+    minimum : Union[int, float, None] = None
+    maximum : Union[int, float, None] = None
+
+
+# Devices present in the default installation
+DEFAULT_DEVICES = [101, 102, 301, 601, 701]
+
+# Objects of the default installation, every device of a family has its own copy
+DEFAULT_OBJECTS = [
+    SimulatedObject(1, 3000, "float", 51.2),            # Battery voltage [Vdc]
+    SimulatedObject(1, 3005, "float", 12.5),            # Battery charge current [Adc]
+    SimulatedObject(1, 3055, "short_enum", 0),          # Relay aux 2 mode
+    SimulatedObject(1, 3080, "float", 4.2),
+    SimulatedObject(2, 1125, "bool", True, 0, 1),       # Charger allowed
+    SimulatedObject(2, 1138, "float", 60.0, 0.0, 200.0),    # Battery charge current [Adc]
+    SimulatedObject(2, 1206, "int32", 480, 0, 1439),    # Start hour (AUX 1)
+    SimulatedObject(2, 1287, "int32", 0, 0, 1),         # Restore factory settings
+    SimulatedObject(2, 1311, "long_enum", 1, 1, 8),     # Operating mode (AUX 2)
+    SimulatedObject(1, 7000, "float", 51.1),            # Battery voltage [Vdc]
+    SimulatedObject(1, 11000, "float", 51.3),           # Battery voltage [Vdc]
+    SimulatedObject(1, 11004, "float", 1.8),
+    SimulatedObject(1, 15000, "float", 51.4),           # Battery voltage [Vdc]
+    SimulatedObject(1, 15010, "float", 2.4),
+    SimulatedObject(2, 14002, "long_enum", 1, 1, 8),    # Configuration of PV modules (VS-120)
+]
+
+BITS_PER_BYTE = 11      # Start bit, 8 data bits, even parity and stop bit
+
+
+# Software Xcom-232i answering SCOM requests with the values of a simulated installation
+class XcomSimulator:
+
+    """Software Xcom-232i answering SCOM requests with the values of a simulated installation\n
+    handle_frame() answers a single request. serve_tcp() and open_pty() make the simulator
+    reachable like a real gateway, with "socket://host:port" or the name of the pty.
+    The time to transmit each frame at the given baudrate and the turnaround latency are simulated,
+    at most queue_depth requests wait for their turn, the next ones get SCOM_ERROR_GATEWAY_BUSY.
+    corruption_rate is the probability that a response has one of its bits flipped."""
+
+    def __init__(self, devices=None, objects=None, baudrate=38400, turnaround=0.02, queue_depth=4, corruption_rate=0.0, seed=None):
+        self.devices = set(DEFAULT_DEVICES if devices is None else devices)
+        self.objects = {(obj.object_type, obj.object_id): obj for obj in (DEFAULT_OBJECTS if objects is None else objects)}
+        self.baudrate = baudrate
+        self.turnaround = turnaround        # Seconds between the end of a request and the start of its response
+        self.queue_depth = queue_depth
+        self.corruption_rate = corruption_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Value of each object on each device, with its flash writes
+        self.values = {}
+        self.flash_writes = {}
+        # Statistics of the simulation
+        self.requests = 0
+        self.busy_responses = 0
+        self.corrupted_responses = 0
+
+    # Create a simulator from a json file of its devices and objects
+    @classmethod
+    def from_file(cls, file_name, **kwargs):
+        """Create a simulator from a json file of its devices and objects\n
+        {"devices": [101, 301], "objects": [{"object_type": 2, "object_id": 1138, "format": "float", "value": 60, "minimum": 0, "maximum": 200}]}"""
+
+        with open(file_name) as file:
+            config = json.load(file)
+        objects = [SimulatedObject(**obj) for obj in config["objects"]] if "objects" in config else None
+        return cls(config.get("devices"), objects, **kwargs)
+
+    # Return the time needed to transmit the given number of bytes at the simulated baudrate
+    def wire_time(self, length):
+        """Return the time needed to transmit the given number of bytes at the simulated baudrate"""
+
+        return length * BITS_PER_BYTE / self.baudrate
+
+    # Answer a single request, return the bytes of the response
+    def handle_frame(self, tx_frame):
+        """Answer a single request, return the bytes of the response"""
+
+        request = pyscom.decode_frame(tx_frame)
+        with self.lock:
+            self.requests += 1
+            try:
+                if request.dest_addr == pyscom.XCOM_ADDR and request.object_type == pyscom.MULTI_INFO_OBJECT_TYPE:
+                    data = self._read_multi_info(request)
+                elif request.service_id == pyscom.SERVICE_READ_PROPERTY:
+                    data = self._read_property(request)
+                elif request.service_id == pyscom.SERVICE_WRITE_PROPERTY:
+                    data = self._write_property(request)
+                else:
+                    raise SimulatedError(0x0011)    # SERVICE_NOT_SUPPORTED
+                return self.encode_response(request, data)
+            except SimulatedError as e:
+                return self.encode_response(request, pyscom.ERROR_CODE.pack(e.error_code), pyscom.SERVICE_FLAG_ERROR)
+
+    # Build the response to the given request
+    def encode_response(self, request, data, service_flags=0):
+        """Build the response to the given request"""
+
+        rx_frame = bytearray(pyscom.FRAME_OVERHEAD + len(data))
+        pyscom.encode_frame_into(rx_frame, request.dest_addr, request.src_addr, request.service_id, request.object_type, request.object_id, request.property_id, data, pyscom.SERVICE_FLAG_RESPONSE | service_flags)
+        return bytes(rx_frame)
+
+    # Flip a random bit of the response, according to the corruption rate
+    def corrupt(self, rx_frame):
+        """Flip a random bit of the response, according to the corruption rate"""
+
+        if self.corruption_rate and self.random.random() < self.corruption_rate:
+            self.corrupted_responses += 1
+            rx_frame = bytearray(rx_frame)
+            rx_frame[self.random.randrange(1, len(rx_frame))] ^= 1 << self.random.randrange(8)
+            return bytes(rx_frame)
+        return rx_frame
+
+    # Return the devices a request to the given address is for, the master first
+    def _get_devices(self, dst_addr, object_id):
+        """Return the devices a request to the given address is for, the master first"""
+
+        family = pyscom.get_object_family(object_id)
+        if family is None:
+            raise SimulatedError(0x0022)    # OBJECT_ID_NOT_FOUND
+        if dst_addr == family.multicast_addr:
+            devices = sorted(device for device in self.devices if family.multicast_addr < device <= family.multicast_addr + pyscom.MAX_DEVICES_PER_FAMILY)
+        elif dst_addr in self.devices and family.multicast_addr < dst_addr <= family.multicast_addr + pyscom.MAX_DEVICES_PER_FAMILY:
+            devices = [dst_addr]
+        else:
+            devices = []
+        if not devices:
+            raise SimulatedError(pyscom.ERROR_DEVICE_NOT_FOUND)
+        return devices
+
+    # Return the object of the request, checking its type
+    def _get_object(self, request):
+        """Return the object of the request, checking its type"""
+
+        if request.object_type not in (1, 2):
+            raise SimulatedError(0x0021)    # TYPE_NOT_SUPPORTED
+        obj = self.objects.get((request.object_type, request.object_id))
+        if obj is None:
+            raise SimulatedError(0x0022)    # OBJECT_ID_NOT_FOUND
+        return obj
+
+    # Return the value of an object on a device
+    def _get_value(self, device, obj):
+        """Return the value of an object on a device"""
+
+        return self.values.get((device, obj.object_type, obj.object_id), obj.value)
+
+    # Answer the "read_property" service
+    def _read_property(self, request):
+        """Answer the "read_property" service"""
+
+        devices = self._get_devices(request.dest_addr, request.object_id)
+        obj = self._get_object(request)
+        # A user info only has its value, a parameter its value, minimum and maximum
+        if obj.object_type == 1 and request.property_id == 1 or obj.object_type == 2 and request.property_id == 5:
+            value = self._get_value(devices[0], obj)
+        elif obj.object_type == 2 and request.property_id == 6 and obj.minimum is not None:
+            value = obj.minimum
+        elif obj.object_type == 2 and request.property_id == 7 and obj.maximum is not None:
+            value = obj.maximum
+        else:
+            raise SimulatedError(0x0023)    # PROPERTY_NOT_SUPPORTED
+        return pyscom.PROPERTY_FORMATS[obj.format].pack(value)
+
+    # Answer the "write_property" service
+    def _write_property(self, request):
+        """Answer the "write_property" service"""
+
+        devices = self._get_devices(request.dest_addr, request.object_id)
+        obj = self._get_object(request)
+        if obj.object_type == 1:
+            raise SimulatedError(0x0025)    # PROPERTY_IS_READ_ONLY
+        if request.property_id not in (5, 13):
+            raise SimulatedError(0x0023)    # PROPERTY_NOT_SUPPORTED
+        if len(request.property_data) != pyscom.PROPERTY_FORMATS[obj.format].size:
+            raise SimulatedError(0x0024)    # INVALID_DATA_LENGTH
+
+        value = pyscom.decode_property_data(request.property_data, obj.format)
+        if obj.minimum is not None and value < obj.minimum:
+            raise SimulatedError(0x0027)    # DATA_TOO_SMALL
+        if obj.maximum is not None and value > obj.maximum:
+            raise SimulatedError(0x0028)    # DATA_TOO_BIG
+
+        for device in devices:
+            self.values[(device, obj.object_type, obj.object_id)] = value
+            if request.property_id == 5:
+                self.flash_writes[(device, obj.object_id)] = self.flash_writes.get((device, obj.object_id), 0) + 1
+        return b""
+
+    # Answer the multi-info service
+    def _read_multi_info(self, request):
+        """Answer the multi-info service"""
+
+        present = {family.device for family in pyscom.OBJECT_FAMILIES for device in self.devices if family.multicast_addr < device <= family.multicast_addr + pyscom.MAX_DEVICES_PER_FAMILY}
+        xcom_flags = 0b0100 * ("Xtender" in present) | 0b0010 * ("BSP" in present) | 0b0001 * ("VarioTrack" in present)
+        devices_flags = 0b10000000 * ("VarioString" in present)
+        data = bytearray(pyscom.MULTI_INFO_CONTEXT.pack(xcom_flags, devices_flags, 0, int(time.time())))
+
+        for info_ref, assembly_id in pyscom.MULTI_INFO_REQUEST_ITEM.iter_unpack(request.property_data):
+            obj = self.objects.get((1, info_ref))
+            family = pyscom.get_object_family(info_ref)
+            if obj is None or family is None:
+                continue
+            devices = sorted(device for device in self.devices if family.multicast_addr < device <= family.multicast_addr + pyscom.MAX_DEVICES_PER_FAMILY)
+            values = [self._get_value(device, obj) for device in devices]
+            if not values:
+                continue
+            # Master, average, sum or a single device
+            if assembly_id == 0:
+                value = values[0]
+            elif assembly_id == 253:
+                value = statistics.mean(values)
+            elif assembly_id == 254:
+                value = sum(values)
+            elif family.multicast_addr + assembly_id in devices:
+                value = self._get_value(family.multicast_addr + assembly_id, obj)
+            else:
+                continue
+            data += pyscom.MULTI_INFO_RESPONSE_ITEM.pack(info_ref, assembly_id, value)
+        return bytes(data)
+
+    # Answer the requests received on a stream until it's closed
+    def serve_stream(self, receive, send):
+        """Answer the requests received on a stream until it's closed\n
+        receive(): return the next bytes received, empty bytes once the stream is closed
+        send(data): send the given bytes"""
+
+        requests = queue.Queue()
+        send_lock = threading.Lock()
+
+        # Requests are processed one after the other, each response takes the time to transmit it
+        def process_requests():
+            while True:
+                received_at, tx_frame = requests.get()
+                if tx_frame is None:
+                    return
+                rx_frame = self.handle_frame(tx_frame)
+                delay = received_at + self.turnaround + self.wire_time(len(rx_frame)) - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    with send_lock:
+                        send(self.corrupt(rx_frame))
+                except OSError:
+                    # The client is gone, the responses still queued are dropped
+                    return
+
+        worker = threading.Thread(target=process_requests, daemon=True)
+        worker.start()
+        parser = pyscom.FrameParser()
+        line_free_at = 0    # When the last request received is completely transmitted
+        try:
+            while True:
+                data = receive()
+                if not data:
+                    return
+                for request in parser.feed(data):
+                    # Requests are transmitted one after the other on the line, even if they were sent at once
+                    line_free_at = max(time.monotonic(), line_free_at) + self.wire_time(len(request.full_frame))
+                    if requests.qsize() >= self.queue_depth:
+                        with self.lock:
+                            self.busy_responses += 1
+                        try:
+                            with send_lock:
+                                send(self.encode_response(request, pyscom.ERROR_CODE.pack(pyscom.ERROR_GATEWAY_BUSY), pyscom.SERVICE_FLAG_ERROR))
+                        except OSError:
+                            return
+                    else:
+                        requests.put((line_free_at, request.full_frame))
+        finally:
+            requests.put((0, None))
+
+    # Make the simulator reachable with "socket://host:port", return the server
+    def serve_tcp(self, host="127.0.0.1", port=0):
+        """Make the simulator reachable with "socket://host:port", return the server\n
+        The server runs in background threads, port 0 uses any free port (see server.port)"""
+
+        return SimulatorServer(self, host, port)
+
+    # Make the simulator reachable through a pseudo terminal, return its name (posix only)
+    def open_pty(self):
+        """Make the simulator reachable through a pseudo terminal, return its name (posix only)"""
+
+        import tty
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        threading.Thread(target=self.serve_stream, args=(lambda: os.read(master, 1024), lambda data: os.write(master, data)), daemon=True).start()
+        return os.ttyname(slave)
+
+
+# Error answered by the simulator instead of a value
+class SimulatedError(Exception):
+
+    """Error answered by the simulator instead of a value"""
+
+    def __init__(self, error_code):
+        super().__init__(f"error {error_code:#06x}")
+        self.error_code = error_code
+
+
+# TCP server of a simulator, each connection is answered by the same simulated installation
+class SimulatorServer:
+
+    """TCP server of a simulator, each connection is answered by the same simulated installation"""
+
+    def __init__(self, simulator, host="127.0.0.1", port=0):
+        self.simulator = simulator
+        self.socket = socket.create_server((host, port))
+        self.host, self.port = self.socket.getsockname()[:2]
+        self.url = f"socket://{self.host}:{self.port}"
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Stop accepting connections
+    def close(self):
+        """Stop accepting connections"""
+
+        # Closing alone doesn't wake the thread waiting in accept, the port would still take a connection
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    # Serve every new connection in its own thread
+    def _accept(self):
+        """Serve every new connection in its own thread"""
+
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                return
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    # Answer the requests of a connection until it's closed
+    def _serve(self, connection):
+        """Answer the requests of a connection until it's closed"""
+
+        with connection:
+            try:
+                self.simulator.serve_stream(lambda: connection.recv(1024), connection.sendall)
+            except OSError:
+                pass
+
+
+# Run a simulated Xcom-232i
+@click.command(help="Run a simulated Xcom-232i, reachable with socket://host:port or through a pseudo terminal")
+@click.option('--tcp', 'tcp_port', type=int, default=None, help="Listen on this TCP port")
+@click.option('--host', default="127.0.0.1", help="The address to listen on with --tcp [default: 127.0.0.1]")
+@click.option('--pty', 'use_pty', is_flag=True, help="Open a pseudo terminal and print its name")
+@click.option('--config', 'config_file', type=click.Path(exists=True, dir_okay=False), default=None, help="json file of the simulated devices and objects")
+@click.option('--bps', type=int, default=38400, help="The simulated baudrate [default: 38400]")
+@click.option('--turnaround', type=float, default=0.02, help="Seconds between a request and its response [default: 0.02]")
+@click.option('--queue-depth', type=int, default=4, help="Requests processed at once before answering SCOM_ERROR_GATEWAY_BUSY [default: 4]")
+@click.option('--corruption', type=float, default=0.0, help="Probability that a response has one of its bits flipped [default: 0]")
+def main(tcp_port, host, use_pty, config_file, bps, turnaround, queue_depth, corruption):
+    options = dict(baudrate=bps, turnaround=turnaround, queue_depth=queue_depth, corruption_rate=corruption)
+    simulator = XcomSimulator.from_file(config_file, **options) if config_file else XcomSimulator(**options)
+
+    if tcp_port is None and not use_pty:
+        raise click.UsageError("use --tcp, --pty or both")
+    if tcp_port is not None:
+        server = simulator.serve_tcp(host, tcp_port)
+        print(f"simulated Xcom-232i on {server.url}", flush=True)
+    if use_pty:
+        print(f"simulated Xcom-232i on {simulator.open_pty()}", flush=True)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"requests={simulator.requests} busy={simulator.busy_responses} corrupted={simulator.corrupted_responses}")
+
+
+# Execute the simulator when executing this script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1223 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import csv
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import struct
+import time
+import urllib.request
+import pytest
+import serial
+
+from click.testing import CliRunner
+
+import pyscom
+from simulator import XcomSimulator
+
+
+
+
+# Build the bytes of a frame, independently of pyscom
+def encode_frame(src_addr, dst_addr, service_flags, service_id, object_type, object_id, property_id, data=b""):
+    header = struct.pack("<BIIH", 0, src_addr, dst_addr, 10 + len(data))
+    body = struct.pack("<BBHIH", service_flags, service_id, object_type, object_id, property_id) + data
+    return b"\xaa" + header + checksum(header) + body + checksum(body)
+
+
+# Return the two checksum bytes of the given bytes
+def checksum(data):
+    a, b = 0xFF, 0
+    for byte in data:
+        a = (a + byte) % 256
+        b = (b + a) % 256
+    return bytes([a, b])
+
+
+# Simulated serial port of an Xcom-232i, answering each request as soon as it's written
+class FakeGateway:
+
+    def __init__(self, values, infos=None):
+        self.values = dict(values)      # property_data of each (dst_addr, object_type, object_id, property_id)
+        self.infos = infos              # Value of each (user info reference, assembly) of the multi-info service, None if it isn't supported
+        self.requests = []              # Every frame written
+        self.pending = bytearray()      # Bytes of the responses not read yet
+
+    def write(self, data):
+        self.requests.append(bytes(data))
+        self.pending += self.answer(bytes(data))
+        return len(data)
+
+    def read(self, size=1):
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+    def reset_input_buffer(self):
+        self.pending.clear()
+
+    def close(self):
+        pass
+
+    # Return the response to a request, DEVICE_NOT_FOUND for the objects it doesn't have
+    def answer(self, tx_frame):
+        src_addr, dst_addr = struct.unpack_from("<II", tx_frame, 2)
+        service_id, object_type, object_id, property_id = struct.unpack_from("<BHIH", tx_frame, 15)
+        key = (dst_addr, object_type, object_id, property_id)
+        if object_type == 10 and self.infos is not None:
+            return encode_frame(dst_addr, src_addr, 0x02, service_id, object_type, object_id, property_id, self.answer_multi_info(tx_frame[24:-2]))
+        if key not in self.values:
+            return encode_frame(dst_addr, src_addr, 0x03, service_id, object_type, object_id, property_id, struct.pack("<H", 0x0002))
+        if service_id == 0x02:
+            self.values[key] = tx_frame[24:-2]
+            return encode_frame(dst_addr, src_addr, 0x02, service_id, object_type, object_id, property_id)
+        return encode_frame(dst_addr, src_addr, 0x02, service_id, object_type, object_id, property_id, self.values[key])
+
+
+    # Return the property_data of a multi-info response, the items the installation doesn't have are left out
+    def answer_multi_info(self, data):
+        items = [item for item in struct.iter_unpack("<HB", data) if item in self.infos]
+        return struct.pack("<BBHi", 0, 0, 0, 0) + b"".join(struct.pack("<HBf", *item, self.infos[item]) for item in items)
+
+
+# Values of the fake installation
+GATEWAY_VALUES = {
+    (101, 1, 3000, 1): struct.pack("<f", 51.2),     # Battery voltage
+    (101, 2, 1138, 5): struct.pack("<f", 60),       # Battery charge current
+    (101, 2, 1206, 5): struct.pack("<i", 480),      # Start hour (AUX 1)
+}
+GATEWAY_INFOS = {(3000, 0): 51.2, (3005, 0): 12.5, (11000, 1): 51.3}
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    gateway = FakeGateway(GATEWAY_VALUES)
+    opened = []
+    monkeypatch.setattr(serial, "serial_for_url", lambda **kwargs: opened.append(kwargs["url"]) or gateway)
+    gateway.opened = opened
+    return gateway
+
+
+@pytest.fixture
+def session(gateway):
+    with pyscom.ScomSession("COM3", 38400, timeout=0.5) as session:
+        yield session
+
+
+# Simulated installation served on a local tcp port, one per test
+@pytest.fixture
+def simulator():
+    return XcomSimulator()
+
+
+@pytest.fixture
+def simulated_session(simulator):
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        yield session
+
+
+# Frames
+
+def test_encode_read_request():
+    assert pyscom.encode_read_request(1, 101, 1, 3000, 1) == encode_frame(1, 101, 0x00, 0x01, 1, 3000, 1)
+
+
+def test_frame_round_trip():
+    buffer = bytearray(pyscom.FRAME_OVERHEAD + 4)
+    length = pyscom.encode_frame_into(buffer, 1, 101, pyscom.SERVICE_WRITE_PROPERTY, 2, 1138, 5, struct.pack("<f", 25))
+    frame = pyscom.decode_frame(buffer[:length])
+
+    assert bytes(buffer[:length]) == encode_frame(1, 101, 0x00, 0x02, 2, 1138, 5, struct.pack("<f", 25))
+    assert (frame.src_addr, frame.dest_addr, frame.service_id) == (1, 101, pyscom.SERVICE_WRITE_PROPERTY)
+    assert (frame.object_type, frame.object_id, frame.property_id) == (2, 1138, 5)
+    assert frame.property_data == struct.pack("<f", 25)
+
+
+def test_calc_checksum():
+    header = struct.pack("<BIIH", 0, 1, 101, 10)
+
+    assert pyscom.calc_checksum(header) == int.from_bytes(checksum(header), "big")
+
+
+def test_verify_checksums():
+    tx_frames = [encode_frame(1, 101, 0x00, 0x01, 1, 3000, 1), encode_frame(1, 101, 0x00, 0x01, 1, 3005, 1)]
+    corrupted = bytearray(tx_frames[1])
+    corrupted[-3] ^= 0x01
+
+    assert pyscom.verify_checksums(tx_frames + [bytes(corrupted)]) == ([True, True, True], [True, True, False])
+
+
+def test_verify_checksums_of_array():
+    numpy = pytest.importorskip("numpy")
+    tx_frames = bytearray(encode_frame(1, 101, 0x00, 0x01, 1, 3000, 1) * 2)
+    tx_frames[-3] ^= 0x01
+
+    header_is_valid, data_is_valid = pyscom.verify_checksums(numpy.frombuffer(bytes(tx_frames), dtype=numpy.uint8).reshape(2, -1))
+    assert list(header_is_valid) == [True, True]
+    assert list(data_is_valid) == [True, False]
+
+
+@pytest.mark.parametrize("format, value", [("bool", True), ("short_enum", 3), ("long_enum", 8), ("int32", -480), ("float", 25.5)])
+def test_property_data_round_trip(format, value):
+    data = pyscom.encode_property_data(value, format)
+
+    assert data == pyscom.PROPERTY_FORMATS[format].pack(value)
+    assert pyscom.decode_property_data(data, format) == value
+
+
+def test_decode_byte_stream():
+    byte_stream = struct.pack("<BBHi", 0b00001101, 0b10000000, 0, 1700000000) + struct.pack("<HBf", 3000, 0, 51.25) + struct.pack("<HBf", 11000, 1, 51.5)
+    result = pyscom.decode_byte_stream(byte_stream)
+
+    assert (result.xcom_type, result.xcom_version) == ("Xcom-GSM", 13)
+    assert (result.xtender_present, result.bsp_present, result.variotrack_present, result.variostring_present) == (True, False, True, True)
+    assert list(result) == [(3000, 0, 51.25), (11000, 1, 51.5)]
+    assert len(pyscom.decode_byte_stream(byte_stream[:8])) == 0
+
+
+def test_encode_property_data_refuses_invalid_value():
+    with pytest.raises(pyscom.FrameError):
+        pyscom.encode_property_data("abc", "float")
+
+
+# Parser
+
+def test_parser_returns_frames_fed_byte_by_byte():
+    tx_frames = [encode_frame(1, 101, 0x00, 0x01, 1, 3000, 1), encode_frame(1, 102, 0x00, 0x01, 1, 3000, 1)]
+    parser = pyscom.FrameParser()
+
+    frames = []
+    for byte in b"\x00\x01" + b"".join(tx_frames):
+        frames.extend(parser.feed(bytes([byte])))
+
+    assert [frame.full_frame for frame in frames] == tx_frames
+    assert parser.dropped_bytes == 2
+
+
+def test_parser_drops_corrupted_frame():
+    corrupted = bytearray(encode_frame(1, 101, 0x00, 0x01, 1, 3000, 1))
+    corrupted[-3] ^= 0x01
+    tx_frame = encode_frame(1, 101, 0x00, 0x01, 1, 3005, 1)
+    parser = pyscom.FrameParser()
+
+    frames = parser.feed(bytes(corrupted) + tx_frame)
+
+    assert [frame.full_frame for frame in frames] == [tx_frame]
+    assert parser.checksum_errors == 1
+
+
+def test_parser_drops_frame_without_service():
+    header = struct.pack("<BIIH", 0, 1, 101, 2)
+    short = b"\xaa" + header + checksum(header) + b"\x00\x00" + checksum(b"\x00\x00")
+    tx_frame = encode_frame(1, 101, 0x00, 0x01, 1, 3005, 1)
+    parser = pyscom.FrameParser()
+
+    assert [frame.full_frame for frame in parser.feed(short + tx_frame)] == [tx_frame]
+    assert parser.checksum_errors == 1
+    with pytest.raises(pyscom.FrameError):
+        pyscom.decode_frame(short)
+    with pytest.raises(pyscom.FrameError):
+        pyscom.decode_frame(tx_frame[:10])
+
+
+def test_parser_bytes_needed():
+    tx_frame = encode_frame(1, 101, 0x00, 0x02, 2, 1138, 5, struct.pack("<f", 25))
+    parser = pyscom.FrameParser()
+
+    assert parser.bytes_needed == 14
+    parser.feed(tx_frame[:14])
+    assert parser.bytes_needed == len(tx_frame) - 14
+
+
+# Session
+
+def test_session_opens_port_once(gateway, session):
+    assert session.read_property(101, 1, 3000, 1, "float").property_data == pytest.approx(51.2)
+    assert session.read_property(101, 2, 1206, 5, "int32").property_data == 480
+
+    assert gateway.opened == ["COM3"]
+    assert len(gateway.requests) == 2
+
+
+def test_session_write_then_read(session):
+    session.write_property(101, 2, 1138, 5, 25, "float")
+
+    assert session.read_property(101, 2, 1138, 5, "float").property_data == pytest.approx(25)
+
+
+def test_read_frame_stops_at_end_of_frame(gateway, session):
+    response = encode_frame(101, 1, 0x02, 0x01, 1, 3000, 1, struct.pack("<f", 51.2))
+    next_frame = encode_frame(101, 1, 0x02, 0x01, 1, 3005, 1, struct.pack("<f", 12.5))
+    gateway.pending += b"\x00\x55" + response + next_frame[:5]
+
+    assert session.read_frame() == response
+    # No byte of the next frame is read
+    assert gateway.pending == next_frame[:5]
+
+
+def test_read_frame_returns_nothing_at_deadline(session):
+    assert not session.read_frame(timeout=0.05)
+
+
+def test_read_many(gateway, session):
+    gateway.infos = GATEWAY_INFOS
+    values = session.read_many([(3000, "Master"), (3005, "Master"), (11000, 1), (1138, 1), (3000, "Master")])
+
+    assert values == pytest.approx({(3000, "Master"): 51.2, (3005, "Master"): 12.5, (11000, 1): 51.3, (1138, 1): 60})
+    # The user infos are read with one multi-info request, the parameter on its own
+    assert len(gateway.requests) == 2
+
+
+def test_read_many_with_undecodable_multi_info(gateway, session):
+    gateway.infos = GATEWAY_INFOS
+    gateway.answer_multi_info = lambda data: b"\x00"
+    values = session.read_many([(3000, 1), (3000, "Average")])
+
+    # The user infos of a single device are read one by one instead
+    assert values == pytest.approx({(3000, 1): 51.2, (3000, "Average"): None})
+    assert len(gateway.requests) == 2
+
+
+def test_read_many_refuses_invalid_assembly(gateway, session):
+    with pytest.raises(pyscom.FrameError, match="3005"):
+        session.read_many([(3000, "Master"), (3005, 1.5)])
+    assert gateway.requests == []
+
+
+def test_read_many_without_multi_info(gateway, session):
+    values = session.read_many([(3000, 1), (1206, "Uid1", "int32"), (3000, "Average"), (9999, 1)])
+
+    # Without the multi-info service the user infos of a single device are read one by one
+    assert values == pytest.approx({(3000, 1): 51.2, (1206, "Uid1", "int32"): 480, (3000, "Average"): None, (9999, 1): None})
+
+
+def test_late_response_isnt_given_to_next_request():
+    with XcomSimulator(turnaround=0.3).serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=0.2) as session:
+        assert session.send_frame(pyscom.encode_read_request(1, 101, 1, 3000, 1)) == b""
+        session.timeout = 1
+        frame = session.read_property(101, 1, 3005, 1, "float")
+
+    assert frame.object_id == 3005
+
+
+# Errors
+
+def test_transact_raises_typed_error(simulator, simulated_session):
+    with pytest.raises(pyscom.DeviceNotFoundError) as excinfo:
+        simulated_session.transact(pyscom.encode_read_request(1, 105, 1, 3000, 1))
+
+    assert (excinfo.value.code, excinfo.value.name) == (pyscom.ERROR_DEVICE_NOT_FOUND, "DEVICE_NOT_FOUND")
+    # An error that can't be temporary isn't retried
+    assert simulator.requests == 1
+
+
+def test_transact_retries_busy_gateway():
+    simulator = XcomSimulator(queue_depth=0)
+    retry = pyscom.RetryPolicy(attempts=3, backoff=0.001)
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1, retry=retry) as session:
+        with pytest.raises(pyscom.GatewayBusyError):
+            session.transact(pyscom.encode_read_request(1, 101, 1, 3000, 1))
+
+    assert simulator.busy_responses == 3
+
+
+def test_circuit_breaker_stops_requests_to_failing_device(gateway):
+    gateway.answer = lambda tx_frame: b""
+    retry = pyscom.RetryPolicy(attempts=1, failure_threshold=2, reset_timeout=0.1)
+    with pyscom.ScomSession("COM3", 38400, timeout=0.05, retry=retry) as session:
+        tx_frame = pyscom.encode_read_request(1, 101, 1, 3000, 1)
+        for _ in range(2):
+            with pytest.raises(pyscom.NoResponseError):
+                session.transact(tx_frame)
+        with pytest.raises(pyscom.CircuitOpenError):
+            session.transact(tx_frame)
+        assert len(gateway.requests) == 2
+
+        # Once reset_timeout is over a request is tried again, its success closes the breaker
+        gateway.answer = FakeGateway(GATEWAY_VALUES).answer
+        time.sleep(0.1)
+        session.transact(tx_frame)
+        assert session.breakers[101].opened_at is None
+
+
+# Cache
+
+def test_cache_keeps_parameters_only(gateway):
+    with pyscom.ScomSession("COM3", 38400, timeout=0.5, cache=pyscom.PropertyCache()) as session:
+        for _ in range(2):
+            session.read_property(101, 1, 3000, 1, "float")
+            session.read_property(101, 2, 1138, 5, "float")
+            session.read_property(105, 2, 1138, 5, "float")
+
+    # User infos and errors are read every time
+    assert len(gateway.requests) == 5
+
+
+def test_cache_expires_and_drops_least_recently_used():
+    cache = pyscom.PropertyCache({2: 0.05}, max_entries=2)
+    for object_id in (1138, 1206, 1287):
+        cache.put((101, 2, object_id, 5), bytes([object_id % 256]))
+        if object_id == 1206:
+            cache.get((101, 2, 1138, 5))
+
+    assert [cache.get((101, 2, object_id, 5)) for object_id in (1138, 1206, 1287)] == [bytes([1138 % 256]), None, bytes([1287 % 256])]
+    time.sleep(0.06)
+    assert cache.get((101, 2, 1138, 5)) is None
+
+
+def test_cache_is_invalidated_by_write(gateway):
+    with pyscom.ScomSession("COM3", 38400, timeout=0.5, cache=pyscom.PropertyCache()) as session:
+        session.read_property(101, 2, 1138, 5, "float")
+        # A write to the multicast address invalidates the object of every device
+        session.write_property(100, 2, 1138, 5, 25, "float")
+        gateway.values[(101, 2, 1138, 5)] = struct.pack("<f", 25)
+
+        assert session.read_property(101, 2, 1138, 5, "float").property_data == pytest.approx(25)
+
+
+def test_sqlite_cache_is_shared_between_runs(gateway, tmp_path):
+    for _ in range(2):
+        with contextlib.closing(pyscom.PropertyCache(file_name=str(tmp_path / "cache.db"))) as cache, pyscom.ScomSession("COM3", 38400, timeout=0.5, cache=cache) as session:
+            assert session.read_property(101, 2, 1206, 5, "int32").property_data == 480
+
+    # The second run reads the response of the first one from the file, without any traffic on the port
+    assert len(gateway.requests) == 1
+
+
+def test_cached_command_doesnt_open_port(gateway, tmp_path):
+    options = ["--port", "COM3", "--verb", "0", "--cache", str(tmp_path / "cache.db")]
+    for _ in range(2):
+        result = CliRunner().invoke(pyscom.commands, [*options, "read_property", "101", "2", "1206", "5", "int32"])
+        assert result.exit_code == 0
+
+    # The second command is answered by the file
+    assert gateway.opened == ["COM3"]
+    assert len(gateway.requests) == 1
+
+
+# Pipelining
+
+def test_send_pipelined_matches_responses(session):
+    tx_frames = [pyscom.encode_read_request(1, dst_addr, object_type, object_id, property_id) for dst_addr, object_type, object_id, property_id in [(101, 1, 3000, 1), (101, 2, 1206, 5), (105, 1, 3000, 1)]]
+    responses = session.send_pipelined(tx_frames, depth=2)
+
+    assert [(frame.src_addr, frame.object_id) for frame in map(pyscom.decode_frame, responses)] == [(101, 3000), (101, 1206), (105, 3000)]
+    assert [pyscom.get_error_code(response) for response in responses] == [None, None, pyscom.ERROR_DEVICE_NOT_FOUND]
+
+
+def test_send_pipelined_retries_busy_request(gateway, session):
+    answer = gateway.answer
+    busy = encode_frame(101, 1, 0x03, 0x01, 1, 3000, 1, struct.pack("<H", pyscom.ERROR_GATEWAY_BUSY))
+    gateway.answer = lambda tx_frame: busy if len(gateway.requests) == 1 else answer(tx_frame)
+
+    responses = session.send_pipelined([pyscom.encode_read_request(1, 101, 1, 3000, 1)], retries=1)
+
+    assert pyscom.decode_response_frame(responses[0], "float", True).property_data == pytest.approx(51.2)
+    assert len(gateway.requests) == 2
+
+
+def test_send_pipelined_gives_up_after_retries(gateway, session):
+    gateway.answer = lambda tx_frame: b""
+
+    assert session.send_pipelined([pyscom.encode_read_request(1, 101, 1, 3000, 1)], timeout=0.05, retries=2) == [b""]
+    assert len(gateway.requests) == 3
+
+
+def test_match_response():
+    requests = [pyscom.decode_frame(pyscom.encode_read_request(1, dst_addr, 1, object_id, 1)) for dst_addr, object_id in [(101, 3000), (102, 3000), (100, 3005)]]
+    response = lambda src_addr, object_id: pyscom.decode_frame(encode_frame(src_addr, 1, 0x02, 0x01, 1, object_id, 1, struct.pack("<f", 0)))
+
+    assert pyscom.match_response(response(102, 3000), requests, [0, 1, 2]) == 1
+    # A multicast request is answered by one of its devices
+    assert pyscom.match_response(response(101, 3005), requests, [0, 1, 2]) == 2
+    assert pyscom.match_response(response(101, 3000), requests, [1]) == 1
+    assert pyscom.match_response(response(101, 3010), requests, [0, 1, 2]) is None
+
+
+# Simulator
+
+def test_simulator_answers_requests(simulator):
+    read = lambda dst_addr, object_type, object_id, property_id: pyscom.decode_frame(simulator.handle_frame(pyscom.encode_read_request(1, dst_addr, object_type, object_id, property_id)))
+    write = lambda dst_addr, object_id, value: simulator.handle_frame(pyscom.encode_write_request(1, dst_addr, 2, object_id, 5, value, "float"))
+
+    assert read(101, 1, 3000, 1).property_data == struct.pack("<f", 51.2)
+    assert read(101, 2, 1138, 7).property_data == struct.pack("<f", 200)
+    assert pyscom.get_error_code(read(105, 1, 3000, 1).full_frame) == pyscom.ERROR_DEVICE_NOT_FOUND
+    assert pyscom.get_error_code(write(101, 1138, 999)) == 0x0028
+    # A multicast write changes every device of the family
+    assert not pyscom.check_frame_has_error(write(100, 1138, 25))
+    assert read(102, 2, 1138, 5).property_data == struct.pack("<f", 25)
+    assert simulator.flash_writes == {(101, 1138): 1, (102, 1138): 1}
+
+
+def test_simulator_over_tcp(simulator, simulated_session):
+    values = simulated_session.read_many([(3000, "Master"), (3000, "Sum"), (11000, 1), (1138, "Master")])
+
+    assert values == pytest.approx({(3000, "Master"): 51.2, (3000, "Sum"): 102.4, (11000, 1): 51.3, (1138, "Master"): 60})
+    # The user infos are read with one multi-info request, the parameter on its own
+    assert simulator.requests == 2
+
+
+def test_simulator_corrupts_responses():
+    simulator = XcomSimulator(corruption_rate=1, seed=1)
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=0.2) as session:
+        assert session.read_property(101, 1, 3000, 1, "float") is None
+
+    # The request is sent again after each corrupted response
+    assert simulator.corrupted_responses == 3
+
+
+def test_simulator_drops_responses_of_gone_client(monkeypatch, simulator):
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    with simulator.serve_tcp() as server:
+        with socket.create_connection((server.host, server.port)) as client:
+            client.sendall(pyscom.encode_read_request(1, 101, 1, 3000, 1) * 3)
+        time.sleep(0.3)
+        with pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+            assert session.read_value(101, 1, 3000, 1, "float") == pytest.approx(51.2)
+
+    assert errors == []
+
+
+# Requests reading different objects and devices, to check each response is matched to its request
+PIPELINED_REQUESTS = [(101, 3000), (102, 3000), (101, 3005), (301, 11000), (601, 7000), (701, 15000)]
+
+
+# Encode the read requests of PIPELINED_REQUESTS
+def encode_pipelined_requests():
+    return [pyscom.encode_read_request(1, dst_addr, 1, object_id, 1) for dst_addr, object_id in PIPELINED_REQUESTS]
+
+
+def test_simulator_answers_pipelined_requests(simulated_session):
+    responses = simulated_session.send_pipelined(encode_pipelined_requests(), depth=3)
+
+    for (dst_addr, object_id), rx_frame in zip(PIPELINED_REQUESTS, responses):
+        frame = pyscom.decode_response_frame(rx_frame, "float")
+        assert (frame.src_addr, frame.object_id) == (dst_addr, object_id)
+        assert not frame.service_flags & pyscom.SERVICE_FLAG_ERROR
+
+
+def test_send_pipelined_retries_requests_of_busy_simulator():
+    simulator = XcomSimulator(queue_depth=1)
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        responses = session.send_pipelined(encode_pipelined_requests(), depth=4, retries=1)
+
+    assert simulator.busy_responses > 0
+    assert all(responses)
+    assert not any(pyscom.check_frame_has_error(rx_frame) for rx_frame in responses)
+
+
+def test_send_pipelined_without_retry_returns_busy():
+    simulator = XcomSimulator(queue_depth=1)
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        responses = session.send_pipelined(encode_pipelined_requests(), depth=4, retries=0)
+
+    busy = [rx_frame for rx_frame in responses if pyscom.get_error_code(rx_frame) == pyscom.ERROR_GATEWAY_BUSY]
+    assert len(busy) == simulator.busy_responses > 0
+
+
+@pytest.mark.parametrize("queue_depth", [1, 3])
+def test_probe_pipeline_depth(queue_depth):
+    simulator = XcomSimulator(queue_depth=queue_depth)
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        depth = session.probe_pipeline_depth(pyscom.encode_read_request(1, 101, 1, 3000, 1), max_depth=8)
+
+    # The request being answered doesn't wait in the queue
+    assert depth == queue_depth + 1
+
+
+# Discovery
+
+def test_discover_ports():
+    with XcomSimulator(devices=[101, 301, 701]).serve_tcp() as server:
+        # Nothing listens on the port of a closed server, it's closed after the other one is open so its port isn't given again
+        with XcomSimulator().serve_tcp() as closed_server:
+            pass
+        results = pyscom.discover_ports([closed_server.url, server.url], timeout=0.2)
+
+    assert results == [(closed_server.url, None, {}), (server.url, 38400, {101: "Xtender", 301: "VarioTrack", 501: "Xcom-232i", 701: "VarioString"})]
+
+
+def test_inventory_skips_absent_families():
+    simulator = XcomSimulator(devices=[101, 102, 701])
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        device_map = session.inventory()
+        assert session.inventory() is device_map
+
+    assert device_map.devices == {101: "Xtender", 102: "Xtender", 501: "Xcom-232i", 701: "VarioString"}
+    assert device_map.multicast_addrs == {100: "Xtender", 700: "VarioString"}
+    assert 100 in device_map and 103 not in device_map
+    # One request per family and one to the Xcom-232i, then only the addresses of the Xtender and VarioString families
+    assert simulator.requests == 5 + len(pyscom.DEVICE_ADDRESSES["Xtender"]) + len(pyscom.DEVICE_ADDRESSES["VarioString"])
+
+
+def test_inventory_probes_the_gateway(gateway, session):
+    # The fake gateway has no multi-info service, the Xcom-232i isn't listed just because it answered errors
+    assert session.inventory().devices == {}
+    assert pyscom.decode_frame(gateway.requests[4]).dest_addr == pyscom.XCOM_ADDR
+
+    gateway.infos = GATEWAY_INFOS
+    assert session.inventory(refresh=True).devices == {pyscom.XCOM_ADDR: "Xcom-232i"}
+
+
+def test_poller_skips_absent_devices(simulated_session):
+    items = [pyscom.PollItem(101, 1, 3000, 1, "float", 0.1), pyscom.PollItem(105, 1, 3000, 1, "float", 0.1)]
+    samples = []
+    pyscom.Poller(simulated_session, items, samples.append, device_map=simulated_session.inventory()).run(0.15)
+
+    assert [(sample.dst_addr, sample.error) for sample in samples] == [(105, "DEVICE_NOT_FOUND"), (101, None), (101, None)]
+
+
+# Apply
+
+def test_apply_skips_unchanged_parameters(simulator, simulated_session):
+    writes = [pyscom.ParameterWrite(101, 1138, "float", 60), pyscom.ParameterWrite(100, 1206, "int32", 500), pyscom.ParameterWrite(101, 1125, "bool", False, "ram"), pyscom.ParameterWrite(101, 1287, "int32", 5)]
+    results = simulated_session.apply(writes)
+
+    assert [(result.memory, result.status) for result in results] == [("flash", "UNCHANGED"), ("flash", "VERIFIED"), ("ram", "VERIFIED"), ("flash", "DATA_TOO_BIG")]
+    # The unchanged parameter isn't written, the multicast write reaches every Xtender
+    assert simulator.flash_writes == {(101, 1206): 1, (102, 1206): 1}
+    assert [result.status for result in simulated_session.apply(writes[:3])] == ["UNCHANGED"] * 3
+
+
+def test_apply_doesnt_write_to_family_without_device():
+    simulator = XcomSimulator(devices=[101])
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        session.inventory()
+        requests = simulator.requests
+        results = session.apply([pyscom.ParameterWrite(300, 10002, "int32", 1)])
+
+    assert [result.status for result in results] == ["DEVICE_NOT_FOUND"]
+    # The family has no device to read or to write
+    assert simulator.requests == requests
+
+
+def test_load_parameter_writes(tmp_path):
+    config_file = tmp_path / "apply.txt"
+    config_file.write_text("101 1138 float 25  # Battery charge current\n100 1125 BOOL 0 RAM\n")
+
+    assert pyscom.load_parameter_writes(str(config_file)) == [pyscom.ParameterWrite(101, 1138, "float", 25), pyscom.ParameterWrite(100, 1125, "bool", 0, "ram")]
+    config_file.write_text("101 1138 float 25 eeprom\n")
+    with pytest.raises(pyscom.click.ClickException, match="line 1: unknown memory"):
+        pyscom.load_parameter_writes(str(config_file))
+
+
+# Polling
+
+def test_poller_reads_each_item_at_its_period(session):
+    items = [pyscom.PollItem(101, 1, 3000, 1, "float", 0.1), pyscom.PollItem(101, 2, 1206, 5, "int32", 0.1), pyscom.PollItem(105, 1, 3000, 1, "float", 1)]
+    samples = []
+    pyscom.Poller(session, items, samples.append).run(0.35)
+
+    assert [sample.value for sample in samples if sample.object_id == 3000 and sample.dst_addr == 101] == pytest.approx([51.2] * 4)
+    # Items of the same period are spread over it
+    assert [sample.value for sample in samples if sample.object_id == 1206] == [480] * 3
+    assert [(sample.value, sample.error) for sample in samples if sample.dst_addr == 105] == [(None, "DEVICE_NOT_FOUND")]
+    assert not any(sample.overdue or sample.skipped for sample in samples)
+
+
+def test_poller_skips_missed_deadlines(session):
+    samples = []
+    def on_sample(sample):
+        samples.append(sample)
+        time.sleep(0.25 if len(samples) == 1 else 0)
+
+    pyscom.Poller(session, [pyscom.PollItem(101, 1, 3000, 1, "float", 0.1)], on_sample, tolerance=0.02).run(0.35)
+
+    # The deadline at 0.1s is skipped, the one at 0.2s is sent late and the next ones in time
+    assert [sample.skipped for sample in samples] == [0, 1, 0]
+    assert [sample.overdue for sample in samples] == [False, True, False]
+
+
+def test_load_poll_items(tmp_path):
+    config_file = tmp_path / "poll.txt"
+    config_file.write_text("# Battery\n101 1 3000 1 FLOAT 1.5s\n\n101 2 1206 5 int32 10m  # AUX 1\n")
+
+    assert pyscom.load_poll_items(str(config_file)) == [pyscom.PollItem(101, 1, 3000, 1, "float", 1.5), pyscom.PollItem(101, 2, 1206, 5, "int32", 600)]
+    config_file.write_text("101 1 3000 1 float 0\n")
+    with pytest.raises(pyscom.click.ClickException, match="line 1"):
+        pyscom.load_poll_items(str(config_file))
+
+
+def test_gateway_manager_spreads_items_by_load():
+    items = [pyscom.PollItem(101, 1, 3000, 1, "float", 1, "COM3"), pyscom.PollItem(101, 1, 3005, 1, "float", 0.5), pyscom.PollItem(101, 1, 3080, 1, "float", 2), pyscom.PollItem(101, 1, 3055, 1, "short_enum", 2)]
+    manager = pyscom.GatewayManager(["COM3", "COM4"], items, print)
+
+    # Both gateways send 2 requests per second
+    assert [item.object_id for item in manager.items_by_port["COM3"]] == [3000, 3080, 3055]
+    assert [item.object_id for item in manager.items_by_port["COM4"]] == [3005]
+
+
+def test_gateway_manager_polls_every_gateway():
+    with XcomSimulator().serve_tcp() as first, XcomSimulator(devices=[101, 102]).serve_tcp() as second:
+        items = [pyscom.PollItem(101, 1, 3000, 1, "float", 0.1, first.url), pyscom.PollItem(102, 1, 3000, 1, "float", 0.1, second.url)]
+        samples = []
+        pyscom.GatewayManager([], items, samples.append).run(0.25)
+
+    assert {sample.port for sample in samples} == {first.url, second.url}
+    assert all(sample.value == pytest.approx(51.2) for sample in samples)
+
+
+def test_gateway_manager_reports_failing_port():
+    with XcomSimulator().serve_tcp() as server:
+        pass
+    items = [pyscom.PollItem(101, 1, 3000, 1, "float", 0.1)]
+    samples = []
+    pyscom.GatewayManager([server.url], items, samples.append, reconnect_delay=0.1).run(0.25)
+
+    assert {(sample.port, sample.error) for sample in samples} == {(server.url, "PORT_ERROR")}
+    # The port is opened again after the reconnect delay
+    assert len(samples) >= 2
+
+
+# Capture
+
+def test_capture_then_replay(tmp_path):
+    capture_file = str(tmp_path / "traffic.scomcap")
+    with pyscom.CaptureWriter(capture_file) as capture, XcomSimulator().serve_tcp() as server:
+        with pyscom.ScomSession(server.url, 38400, timeout=1, capture=capture) as session:
+            session.read_property(101, 1, 3000, 1, "float")
+            session.read_property(105, 1, 3000, 1, "float")
+
+    records = [(direction, frame.src_addr, frame.object_id) for timestamp, direction, frame in pyscom.replay_capture(capture_file)]
+    assert records == [(pyscom.CAPTURE_TX, 1, 3000), (pyscom.CAPTURE_RX, 101, 3000), (pyscom.CAPTURE_TX, 1, 3000), (pyscom.CAPTURE_RX, 105, 3000)]
+    assert [frame.dest_addr for timestamp, direction, frame in pyscom.replay_capture(capture_file, (pyscom.CAPTURE_TX,))] == [101, 105]
+
+    # The replay port answers the recorded requests in any order, without the simulator
+    retry = pyscom.RetryPolicy(attempts=1)
+    with pyscom.ScomSession("replay://" + capture_file, 38400, timeout=0.1, retry=retry) as session:
+        assert pyscom.get_error_code(session.read_property(105, 1, 3000, 1, "float").full_frame) == pyscom.ERROR_DEVICE_NOT_FOUND
+        assert session.read_property(101, 1, 3000, 1, "float").property_data == pytest.approx(51.2)
+        assert session.read_property(101, 1, 3005, 1, "float") is None
+
+
+def test_read_capture_refuses_other_files(tmp_path):
+    (tmp_path / "samples.jsonl").write_text("{}\n")
+
+    with pytest.raises(pyscom.FrameError):
+        list(pyscom.read_capture(str(tmp_path / "samples.jsonl")))
+
+
+# Catalog
+
+def test_catalog_gives_the_format(simulated_session):
+    assert simulated_session.read_value(101, 1, 3000, 1) == pytest.approx(51.2)
+    simulated_session.write_property(101, 2, 1138, 13, 25)
+
+    assert simulated_session.read_property(101, 2, 1138, 5).property_data == pytest.approx(25)
+    # The minimum and maximum of a parameter have its format, not its other properties
+    assert pyscom.get_catalog_object(2, 1138, 6).format == "float"
+    assert pyscom.get_catalog_object(2, 1138, 1) is None
+    with pytest.raises(pyscom.FrameError):
+        simulated_session.read_value(101, 1, 3080, 1)
+
+
+def test_catalog_refuses_value_out_of_range():
+    obj = pyscom.get_catalog_object(2, 1138, 5)
+
+    assert obj.decode(obj.encode(25)) == 25
+    with pytest.raises(pyscom.FrameError):
+        obj.encode(999)
+
+
+def test_catalog_doesnt_check_range_of_enums():
+    obj = pyscom.get_catalog_object(2, 1311, 5)
+
+    # The values of an enum are flags, not numbers in a range
+    assert obj.decode(obj.encode(16)) == 16
+
+
+def test_simulator_agrees_with_catalog(simulator):
+    for (object_type, object_id), obj in simulator.objects.items():
+        catalog_object = pyscom.get_catalog_object(object_type, object_id)
+        if object_type == 2 and catalog_object is not None:
+            assert (obj.minimum, obj.maximum) == (catalog_object.minimum, catalog_object.maximum), object_id
+
+
+def test_write_out_of_range_isnt_sent(simulator, simulated_session):
+    with pytest.raises(pyscom.FrameError):
+        simulated_session.write_property(101, 2, 1138, 5, 999)
+    assert simulator.requests == 0
+
+
+def test_catalog_object_codec():
+    obj = pyscom.get_catalog_object(2, 1125)
+
+    assert (obj.family.device, obj.decode(b"\x01"), obj.decode(b"\x02"), obj.decode(b"")) == ("Xtender", True, None, None)
+    assert obj.encode(True) == b"\x01"
+    with pytest.raises(pyscom.FrameError):
+        obj.encode("on")
+
+
+def test_extend_catalog(monkeypatch, tmp_path):
+    monkeypatch.setattr(pyscom, "_catalog", None)
+    catalog_file = tmp_path / "catalog.csv"
+    catalog_file.write_text("object_type,object_id,format,unit,minimum,maximum,name\n1,3080,float,Ah,,,Battery charge of the day\n")
+    pyscom.extend_catalog(str(catalog_file))
+
+    assert pyscom.get_catalog_object(1, 3080).unit == "Ah"
+    assert pyscom.get_catalog_object(1, 3000) is not None
+
+
+def test_load_catalog_refuses_format_without_single_value(tmp_path):
+    catalog_file = tmp_path / "catalog.csv"
+    catalog_file.write_text("object_type,object_id,format,unit,minimum,maximum,name\n1,3000,float,Vdc,,,Battery voltage\n1,3080,string,,,,Name\n")
+
+    with pytest.raises(ValueError, match="line 3"):
+        pyscom.load_catalog(str(catalog_file))
+
+
+def test_config_files_without_format(tmp_path):
+    config_file = tmp_path / "config.txt"
+    config_file.write_text("101 1 3000 1 1s\n")
+    assert pyscom.load_poll_items(str(config_file)) == [pyscom.PollItem(101, 1, 3000, 1, None, 1)]
+
+    config_file.write_text("101 1206 500 ram\n")
+    assert pyscom.load_parameter_writes(str(config_file)) == [pyscom.ParameterWrite(101, 1206, "int32", 500, "ram")]
+
+    config_file.write_text("101 1 3080 1 1s\n")
+    with pytest.raises(pyscom.click.ClickException, match="isn't in the catalog"):
+        pyscom.load_poll_items(str(config_file))
+
+
+# Metrics
+
+def test_metrics_measure_each_stage(tmp_path):
+    records = []
+    metrics = pyscom.ScomMetrics(records.append)
+    with XcomSimulator().serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1, metrics=metrics) as session:
+        session.read_value(101, 1, 3000, 1, "float")
+        session.read_property(101, 2, 1138, 5, "float")
+        with pytest.raises(pyscom.DeviceNotFoundError):
+            session.read_value(105, 1, 3000, 1, "float")
+
+    assert [(record.dst_addr, record.object_id, record.attempts, record.error) for record in records] == [(101, 3000, 1, None), (101, 1138, 1, None), (105, 3000, 1, "DEVICE_NOT_FOUND")]
+    assert {stage for stage, dst_addr, object_id in metrics.histograms} == set(pyscom.METRICS_STAGES)
+    assert metrics.histograms[("full_frame", 101, 3000)].count == 1
+    assert metrics.counters[("errors", 105, 3000, "DEVICE_NOT_FOUND")] == 1
+    assert "full_frame: count=3" in metrics.summary()
+
+    metrics.write_prometheus(str(tmp_path / "scom.prom"))
+    text = (tmp_path / "scom.prom").read_text()
+    assert 'scom_stage_seconds_count{stage="full_frame",dst_addr="101",object_id="3000"} 1' in text
+    assert 'scom_transactions_total{dst_addr="105",object_id="3000",error="DEVICE_NOT_FOUND"} 1' in text
+
+
+def test_metrics_count_retries_sent():
+    metrics = pyscom.ScomMetrics()
+    retry = pyscom.RetryPolicy(attempts=3, backoff=0.001)
+    with XcomSimulator(queue_depth=0).serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1, retry=retry, metrics=metrics) as session:
+        with pytest.raises(pyscom.GatewayBusyError):
+            session.read_value(101, 1, 3000, 1, "float")
+
+    # The last attempt isn't followed by a retry
+    assert metrics.counters[("errors", 101, 3000, "SCOM_ERROR_GATEWAY_BUSY")] == 3
+    assert metrics.counters[("retries", 101, 3000, None)] == 2
+
+
+def test_commands_measure_encode_and_decode(gateway, tmp_path):
+    metrics_file = tmp_path / "scom.prom"
+    for command in (["read_property", "101", "1", "3000", "1", "float"], ["write_property", "101", "2", "1138", "5", "float", "25"]):
+        result = CliRunner().invoke(pyscom.commands, ["--port", "COM3", "--verb", "0", "--metrics-file", str(metrics_file), *command])
+        assert result.exit_code == 0
+
+        text = metrics_file.read_text()
+        object_id = command[3]
+        for stage in ("encode", "full_frame", "decode"):
+            assert f'scom_stage_seconds_count{{stage="{stage}",dst_addr="101",object_id="{object_id}"}} 1' in text
+
+
+def test_metrics_served_over_http():
+    metrics = pyscom.ScomMetrics()
+    metrics.count("retries", 101, 3000)
+    server = metrics.serve_prometheus(0)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert 'scom_retries_total{dst_addr="101",object_id="3000",error=""} 1' in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_histogram_quantile():
+    histogram = pyscom.Histogram((0.001, 0.01, 0.1, math.inf))
+    for value in [0.0005] * 90 + [0.05] * 9 + [1]:
+        histogram.observe(value)
+
+    assert (histogram.quantile(0.5), histogram.quantile(0.99), histogram.quantile(1)) == (0.001, 0.1, math.inf)
+
+
+# Broker
+
+# Session answering with a simulator without any port, recording the requests it sends
+class SimulatedSession:
+
+    def __init__(self, simulator, delay=0):
+        self.simulator = simulator
+        self.delay = delay      # Seconds each request takes
+        self.requests = []
+        self.cache = None
+
+    def transact(self, tx_frame):
+        self.requests.append(bytes(tx_frame))
+        time.sleep(self.delay)
+        rx_frame = self.simulator.handle_frame(tx_frame)
+        pyscom.raise_for_error(rx_frame)
+        return rx_frame
+
+
+# Session of a gateway whose devices never answer
+class SilentSession(SimulatedSession):
+
+    def transact(self, tx_frame):
+        self.requests.append(bytes(tx_frame))
+        raise pyscom.NoResponseError("the device didn't answer")
+
+
+# Session whose first request fails with an unexpected error
+class FailingSession(SimulatedSession):
+
+    def transact(self, tx_frame):
+        if not self.requests:
+            self.requests.append(bytes(tx_frame))
+            raise RuntimeError("unexpected")
+        return super().transact(tx_frame)
+
+
+# Run a broker in a background thread, yield the address of its clients
+@contextlib.contextmanager
+def running_broker(broker):
+    thread = threading.Thread(target=broker.run, daemon=True)
+    thread.start()
+    try:
+        yield broker.address if broker.address.startswith("unix://") else "tcp://127.0.0.1:%d" % broker.socket.getsockname()[1]
+    finally:
+        broker.close()
+        thread.join()
+
+
+def test_broker_shares_the_session(simulator, tmp_path):
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1) as session:
+        for address in ("tcp://127.0.0.1:0", f"unix://{tmp_path}/scom.sock"):
+            with running_broker(pyscom.ScomBroker(session, address)) as url, pyscom.ScomSession(url, 38400, timeout=1) as client:
+                assert client.read_value(101, 1, 3000, 1, "float") == pytest.approx(51.2)
+                client.write_property(101, 2, 1138, 13, 25, "float")
+                assert client.read_value(101, 2, 1138, 5, "float") == pytest.approx(25)
+                with pytest.raises(pyscom.DeviceNotFoundError):
+                    client.read_value(105, 1, 3000, 1, "float")
+
+
+def test_broker_sends_writes_first(simulator):
+    session = SimulatedSession(simulator)
+    broker = pyscom.ScomBroker(session, "tcp://127.0.0.1:0")
+    read = pyscom.encode_read_request(1, 101, 2, 1138, 5)
+    write = pyscom.encode_write_request(1, 101, 2, 1138, 13, 25, "float")
+    futures = [broker.submit(read), broker.submit(write)]
+
+    with running_broker(broker):
+        responses = [future.result(timeout=1) for future in futures]
+
+    assert session.requests == [write, read]
+    assert pyscom.decode_response_frame(responses[0], "float").property_data == pytest.approx(25)
+
+
+def test_broker_merges_identical_reads(simulator):
+    session = SimulatedSession(simulator, delay=0.1)
+    broker = pyscom.ScomBroker(session, "tcp://127.0.0.1:0")
+    read = pyscom.encode_read_request(1, 101, 1, 3000, 1)
+
+    with running_broker(broker), concurrent.futures.ThreadPoolExecutor(3) as executor:
+        responses = list(executor.map(broker.request, [read] * 3))
+
+    assert session.requests == [read]
+    assert broker.merged_requests == 2
+    assert len(set(responses)) == 1
+
+
+def test_broker_answers_timeout_when_device_is_silent(simulator):
+    with running_broker(pyscom.ScomBroker(SilentSession(simulator), "tcp://127.0.0.1:0")) as url, pyscom.ScomSession(url, 38400, timeout=1, retry=pyscom.RetryPolicy(attempts=1)) as client:
+        with pytest.raises(pyscom.ResponseTimeoutError):
+            client.read_value(101, 1, 3000, 1, "float")
+
+
+def test_broker_keeps_serving_after_unexpected_error(simulator):
+    broker = pyscom.ScomBroker(FailingSession(simulator), "tcp://127.0.0.1:0")
+    with running_broker(broker) as url, pyscom.ScomSession(url, 38400, timeout=1, retry=pyscom.RetryPolicy(attempts=1)) as client:
+        with pytest.raises(RuntimeError):
+            broker.submit(pyscom.encode_read_request(1, 101, 1, 3000, 1)).result(timeout=1)
+        assert client.read_value(101, 1, 3000, 1, "float") == pytest.approx(51.2)
+
+    broker = pyscom.ScomBroker(FailingSession(simulator), "tcp://127.0.0.1:0")
+    with running_broker(broker) as url, pyscom.ScomSession(url, 38400, timeout=1, retry=pyscom.RetryPolicy(attempts=1)) as client:
+        # The client gets an error response instead of waiting for its timeout
+        with pytest.raises(pyscom.ResponseTimeoutError):
+            client.read_value(101, 1, 3000, 1, "float")
+        assert client.read_value(101, 1, 3000, 1, "float") == pytest.approx(51.2)
+
+
+def test_broker_counts_reads_answered_by_cache(simulator):
+    with simulator.serve_tcp() as server, pyscom.ScomSession(server.url, 38400, timeout=1, cache=pyscom.PropertyCache()) as session:
+        broker = pyscom.ScomBroker(session, "tcp://127.0.0.1:0")
+        with running_broker(broker):
+            for _ in range(2):
+                broker.request(pyscom.encode_read_request(1, 101, 2, 1138, 5))
+
+    assert (broker.sent_requests, broker.cached_requests) == (1, 1)
+    assert simulator.requests == 1
+
+
+# Single flight
+
+# Count the calls of a function that takes some time, from every thread
+class SlowFunction:
+
+    def __init__(self, result, delay=0.1):
+        self.result = result
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_single_flight_shares_running_call():
+    single_flight = pyscom.SingleFlight()
+    function = SlowFunction(51.2)
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda key: single_flight.do(key, function), ["a"] * 4))
+
+    assert results == [51.2] * 4
+    assert (function.calls, single_flight.shared_calls) == (1, 3)
+    # Once it returned, without a freshness window, the function runs again
+    assert single_flight.do("a", function) == 51.2 and function.calls == 2
+
+
+def test_single_flight_shares_exception():
+    single_flight = pyscom.SingleFlight()
+    function = SlowFunction(pyscom.NoResponseError("the device 101 didn't answer"))
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        futures = [executor.submit(single_flight.do, "a", function) for _ in range(2)]
+
+    assert [type(future.exception()) for future in futures] == [pyscom.NoResponseError] * 2
+    assert function.calls == 1
+
+
+def test_single_flight_freshness(simulator, simulated_session):
+    simulated_session.single_flight = pyscom.SingleFlight(freshness=0.1)
+    for _ in range(3):
+        frame = simulated_session.read_property(101, 2, 1138, 5, "float")
+    assert simulator.requests == 1
+
+    # A write drops the results kept, an expired result isn't given
+    simulated_session.write_property(101, 2, 1138, 13, 25, "float")
+    assert simulated_session.read_property(101, 2, 1138, 5, "float").property_data == pytest.approx(25)
+    time.sleep(0.1)
+    assert simulated_session.read_property(101, 2, 1138, 5, "float") is not frame
+    assert simulator.requests == 4
+
+
+def test_session_shared_between_threads(simulator, simulated_session):
+    simulated_session.single_flight = pyscom.SingleFlight()
+    object_ids = [3000, 3005, 3000, 3005, 11000, 3000] * 4
+    addresses = {3000: 101, 3005: 101, 11000: 301}
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        frames = list(executor.map(lambda object_id: simulated_session.read_property(addresses[object_id], 1, object_id, 1, "float"), object_ids))
+
+    assert [frame.object_id for frame in frames] == object_ids
+    assert simulator.requests < len(object_ids)
+
+
+def test_async_client_single_flight():
+    gateway = FakeGateway(GATEWAY_VALUES)
+    answer = gateway.answer
+    gateway.answer = lambda tx_frame: gateway.requests.append(tx_frame) or answer(tx_frame)
+
+    async def main(url):
+        async with pyscom.AsyncScomClient(url, timeout=1, single_flight=pyscom.SingleFlight()) as client:
+            return await asyncio.gather(*[client.read_property(101, 1, 3000, 1, "float") for _ in range(3)])
+
+    frames = run_with_tcp_gateway(gateway, main)
+
+    assert frames[0] is frames[1] is frames[2]
+    assert len(gateway.requests) == 1
+
+
+# Sinks
+
+# Samples of a poll, a value of each type and an error
+SAMPLES = [
+    pyscom.PollSample(10.0, 101, 1, 3000, 1, 51.25, None, 0.01, False, 0, "COM3"),
+    pyscom.PollSample(10.5, 101, 2, 1206, 5, 480, None, 0.6, True, 2, "COM3"),
+    pyscom.PollSample(11.0, 101, 2, 1125, 5, True, None, 0, False, 0, "socket://a b"),
+    pyscom.PollSample(11.5, 105, 1, 3000, 1, None, "DEVICE_NOT_FOUND", 0, False, 0, "COM3"),
+]
+
+
+def test_json_lines_sink_writes_by_batches(tmp_path):
+    file_name = tmp_path / "samples.jsonl"
+    with pyscom.JsonLinesSink(str(file_name), batch_size=3) as sink:
+        for sample in SAMPLES:
+            sink(sample)
+            if sample is SAMPLES[1]:
+                assert file_name.read_text() == ""
+
+        assert len(file_name.read_text().splitlines()) == 3
+
+    lines = [json.loads(line) for line in file_name.read_text().splitlines()]
+    assert [(line["object_id"], line["value"], line["error"]) for line in lines] == [(3000, 51.25, None), (1206, 480, None), (1125, True, None), (3000, None, "DEVICE_NOT_FOUND")]
+
+
+def test_csv_sink_writes_the_header_once(tmp_path):
+    file_name = tmp_path / "samples.csv"
+    for samples in (SAMPLES[:2], SAMPLES[2:]):
+        with pyscom.CsvSink(str(file_name)) as sink:
+            for sample in samples:
+                sink(sample)
+
+    rows = list(csv.reader(file_name.open(newline="")))
+    assert rows[0] == pyscom.SampleSink.fields
+    assert [row[4] for row in rows[1:]] == ["3000", "1206", "1125", "3000"]
+
+
+def test_influx_sink_writes_line_protocol(tmp_path):
+    with pyscom.InfluxSink(str(tmp_path / "samples.txt")) as sink:
+        sink.epoch_offset = 1000
+        for sample in SAMPLES:
+            sink(sample)
+
+    assert (tmp_path / "samples.txt").read_text().splitlines() == [
+        "scom,port=COM3,dst_addr=101,object_type=1,object_id=3000,property_id=1 value=51.25 1010000000000",
+        "scom,port=COM3,dst_addr=101,object_type=2,object_id=1206,property_id=5 value=480i 1010500000000",
+        "scom,port=socket://a\\ b,dst_addr=101,object_type=2,object_id=1125,property_id=5 value=true 1011000000000",
+        'scom,port=COM3,dst_addr=105,object_type=1,object_id=3000,property_id=1 error="DEVICE_NOT_FOUND" 1011500000000',
+    ]
+
+
+def test_influx_sink_sends_one_datagram_per_line():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+        receiver.bind(("127.0.0.1", 0))
+        receiver.settimeout(1)
+        with pyscom.InfluxSink(f"udp://127.0.0.1:{receiver.getsockname()[1]}") as sink:
+            sink(SAMPLES[0])
+            sink(SAMPLES[3])
+
+        assert [receiver.recv(1024).count(b"\n") for _ in SAMPLES[:2]] == [1, 1]
+
+
+def test_parquet_sink(tmp_path):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    with pyscom.ParquetSink(str(tmp_path / "samples.parquet"), batch_size=2) as sink:
+        for sample in SAMPLES:
+            sink(sample)
+
+    table = parquet.read_table(str(tmp_path / "samples.parquet"))
+    assert table.column("value").to_pylist() == [51.25, 480, 1, None]
+
+
+def test_poll_items_refuse_formats_without_single_value(tmp_path):
+    config_file = tmp_path / "poll.txt"
+    config_file.write_text("101 1 3000 1 float 1s\n101 1 3000 1 byte_stream 1s\n")
+
+    with pytest.raises(pyscom.click.ClickException, match="line 2"):
+        pyscom.load_poll_items(str(config_file))
+    with pytest.raises(TypeError):
+        pyscom.SampleSink()
+
+
+def test_poll_to_parquet_without_pyarrow(monkeypatch, gateway, tmp_path):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    config_file = tmp_path / "poll.txt"
+    config_file.write_text("101 1 3000 1 float 1s\n")
+    result = CliRunner().invoke(pyscom.commands, ["--port", "COM3", "poll", str(config_file), "--duration", "0", "--output", str(tmp_path / "samples.parquet"), "--output-format", "parquet"])
+
+    assert result.exit_code == 1
+    assert "pyarrow is needed" in result.output
+    assert gateway.requests == []
+
+
+# Asyncio
+
+# Serve a FakeGateway on a local tcp port and run the given coroutine function with its url
+def run_with_tcp_gateway(gateway, main):
+    async def handle(reader, writer):
+        parser = pyscom.FrameParser()
+        while data := await reader.read(256):
+            for frame in parser.feed(data):
+                writer.write(gateway.answer(frame.full_frame))
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        async with server:
+            return await main(f"socket://127.0.0.1:{server.sockets[0].getsockname()[1]}")
+
+    return asyncio.run(serve())
+
+
+def test_async_client_write_then_read():
+    async def main(url):
+        async with pyscom.AsyncScomClient(url, timeout=1) as client:
+            await client.write_property(101, 2, 1138, 5, 25, "float")
+            return await asyncio.gather(client.read_property(101, 2, 1138, 5, "float"), client.read_property(101, 1, 3000, 1, "float"))
+
+    frames = run_with_tcp_gateway(FakeGateway(GATEWAY_VALUES), main)
+
+    assert [frame.object_id for frame in frames] == [1138, 3000]
+    assert [frame.property_data for frame in frames] == pytest.approx([25, 51.2])
+
+
+def test_async_client_returns_none_at_deadline():
+    gateway = FakeGateway(GATEWAY_VALUES)
+    gateway.answer = lambda tx_frame: b""
+
+    async def main(url):
+        async with pyscom.AsyncScomClient(url, timeout=0.05) as client:
+            return await client.read_property(101, 1, 3000, 1, "float")
+
+    assert run_with_tcp_gateway(gateway, main) is None
+
+
+# Command line
+
+def test_shell_runs_commands_over_one_port(monkeypatch):
+    opened = []
+    serial_for_url = serial.serial_for_url
+    monkeypatch.setattr(serial, "serial_for_url", lambda **kwargs: opened.append(kwargs["url"]) or serial_for_url(**kwargs))
+    script = """read_property 101 1 3000 1 float
+                write_property 101 2 1138 13 float 25
+                read_property 101 2 1138 5  # The format of the catalog
+
+                read_property 105 1 3000 1 float
+                poll poll.txt
+                """
+    with XcomSimulator().serve_tcp() as server:
+        result = CliRunner().invoke(pyscom.commands, ["--port", server.url, "--verb", "0", "shell"], input=script)
+
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [(line["line"], line["ok"], line["error"]) for line in lines] == [(1, True, None), (2, True, None), (3, True, None), (5, False, "DEVICE_NOT_FOUND"), (6, False, "poll can't be run in the shell")]
+    assert [line["value"] for line in lines[:3]] == pytest.approx([51.2, None, 25])
+    assert opened == [server.url]
+
+
+@pytest.mark.parametrize("options, requests", [([], 1), (["--retries", "2"], 3)])
+def test_read_property_retries_only_when_asked(gateway, options, requests):
+    gateway.answer = lambda tx_frame: encode_frame(101, 1, 0x03, 0x01, 1, 3000, 1, struct.pack("<H", 0x0013))
+    CliRunner().invoke(pyscom.commands, ["--port", "COM3", "--verb", "0", *options, "read_property", "101", "1", "3000", "1", "float"])
+
+    assert len(gateway.requests) == requests
+
+
+def test_modules_are_imported_lazily():
+    check = "import sys, pyscom; print(' '.join(name for name in ('asyncio', 'serial', 'sqlite3', 'http.server', 'concurrent.futures', 'socket', 'json', 'csv', 'mmap') if name in sys.modules))"
+    imported = subprocess.run([sys.executable, "-c", check], cwd=os.path.dirname(os.path.abspath(pyscom.__file__)), capture_output=True, text=True, check=True).stdout
+
+    assert imported.split() == []